@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Times build/ab.py generating the makefile for synthetic trees of up to
+--targets targets, as it is and with the original bubbledattrsof(), which
+walked the whole dependency graph again for every source file,
+templateexpand(), which defined a class for every flag it expanded, and
+flatten().
+
+Each library has a header, --files source files and depends on three of
+the libraries before it on lower levels, --levels in all, so that each
+source file sees a few dozen libraries' flags. (Flags are transitive, so a
+graph as deep as it is wide makes a makefile that grows with the square of
+the number of targets, whatever ab.py does.) Each directory of libraries
+has a program linking its top level ones.
+
+Both makefiles are checked to have the same flags for every rule,
+ignoring order and repeats, which the original didn't keep.
+"""
+
+import argparse
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BUILD = os.path.join(os.path.dirname(os.path.abspath(__file__)), "build")
+
+# The original versions of what changed, put back into a copy of ab.py.
+LEGACY = {
+    "flatten": '''def flatten(*xs):
+    def recurse(xs):
+        for x in xs:
+            if isinstance(x, Iterable) and not isinstance(x, (str, bytes)):
+                yield from recurse(x)
+            else:
+                yield x
+
+    return list(recurse(xs))
+''',
+    "bubbledattrsof": '''def bubbledattrsof(x, attr):
+    x = targetsof(x)
+    alltargets = set()
+    pending = set(x) if isinstance(x, Iterable) else {x}
+    while pending:
+        t = pending.pop()
+        if t not in alltargets:
+            alltargets.add(t)
+            if hasattr(t.attrdeps, attr):
+                pending.update(getattr(t.attrdeps, attr))
+
+    values = []
+    for t in alltargets:
+        if hasattr(t.attr, attr):
+            values += getattr(t.attr, attr)
+    return values
+''',
+    "templateexpand": '''def templateexpand(s, invocation):
+    class Formatter(string.Formatter):
+        def get_field(self, name, a1, a2):
+            return (
+                eval(name, invocation.callback.__globals__, invocation.args),
+                False,
+            )
+
+        def format_field(self, value, format_spec):
+            if type(self) == str:
+                return value
+            return " ".join(
+                [templateexpand(f, invocation) for f in filenamesof(value)]
+            )
+
+    return Formatter().format(s)
+''',
+}
+
+LIBS_PER_DIR = 10
+
+
+def write_tree(root, libs, files, levels, seed=0):
+    rng = random.Random(seed)
+    for name in os.listdir(BUILD):
+        if name.endswith(".py") or name.endswith(".mk"):
+            shutil.copy(os.path.join(BUILD, name), os.path.join(root, "build"))
+
+    def lib(n):
+        return f"d{n // LIBS_PER_DIR:04d}+lib{n}"
+
+    for d in range(0, libs, LIBS_PER_DIR):
+        path = os.path.join(root, f"d{d // LIBS_PER_DIR:04d}")
+        os.mkdir(path)
+        lines = ["from build.c import clibrary, cprogram\n"]
+        top = []
+        for n in range(d, min(d + LIBS_PER_DIR, libs)):
+            level = n % levels
+            lower = [m for m in range(max(0, n - 40), n) if m % levels < level]
+            deps = rng.sample(lower, min(len(lower), 3))
+            if level == levels - 1:
+                top.append(f".+lib{n}")
+            lines.append(
+                f"clibrary(name='lib{n}',"
+                f" srcs=[{', '.join(repr(f'./l{n}_{i}.c') for i in range(files))}],"
+                f" hdrs={{'lib{n}.h': './lib{n}.h'}},"
+                f" caller_cflags=['-DLIB{n}'],"
+                f" caller_ldflags=['-lm'],"
+                f" deps={[lib(m) for m in deps]!r})\n"
+            )
+        lines.append(f"cprogram(name='prog', srcs=['./main.c'], deps={top!r})\n")
+        with open(os.path.join(path, "build.py"), "w") as f:
+            f.writelines(lines)
+
+    dirs = [f"d{d:04d}" for d in range(-(-libs // LIBS_PER_DIR))]
+    items = {f"bin/{d}": f"{d}+prog" for d in dirs}
+    with open(os.path.join(root, "build.py"), "w") as f:
+        f.write("from build.ab import export\n")
+        f.write(f"export(name='all', items={items!r})\n")
+
+
+def use_legacy(root):
+    path = os.path.join(root, "build", "ab.py")
+    with open(path) as f:
+        source = f.read()
+    for name, legacy in LEGACY.items():
+        source, n = re.subn(
+            rf"^def {name}\(.*?\n(?=\n\n)", legacy, source, flags=re.S | re.M
+        )
+        if n != 1:
+            sys.exit(f"couldn't find {name}() in build/ab.py")
+    with open(path, "w") as f:
+        f.write(source)
+
+
+def generate(root, output):
+    # ab.py reuses its last output if nothing changed; start afresh.
+    for path in (output, output + ".cache"):
+        if os.path.exists(path):
+            os.unlink(path)
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "build/ab.py", "-o", output, "-t", "+all", "build.py"],
+        cwd=root,
+        capture_output=True,
+        text=True,
+    )
+    elapsed = time.perf_counter() - start
+    if result.returncode:
+        sys.exit(result.stdout + result.stderr)
+    return elapsed
+
+
+def normalised(path):
+    # The original's order followed set iteration, and it repeated flags.
+    with open(path) as f:
+        return [sorted(set(line.split())) for line in f]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--targets", type=int, default=10000)
+    parser.add_argument("--files", type=int, default=8, help="per library")
+    parser.add_argument("--levels", type=int, default=4)
+    parser.add_argument("--steps", type=int, default=4)
+    args = parser.parse_args()
+
+    # Each library is a target, with one for its headers and one per file,
+    # and each directory's program and its main.c another two.
+    per_lib = args.files + 2 + 2 / LIBS_PER_DIR
+    print(f"{'targets':>8} {'original':>10} {'now':>10} {'speedup':>8}")
+    for step in range(args.steps, 0, -1):
+        libs = max(LIBS_PER_DIR, int(args.targets / per_lib / 2 ** (step - 1)))
+        times = []
+        outputs = []
+        for legacy in (True, False):
+            root = tempfile.mkdtemp()
+            try:
+                os.mkdir(os.path.join(root, "build"))
+                write_tree(root, libs, args.files, args.levels)
+                if legacy:
+                    use_legacy(root)
+                output = os.path.join(root, "build.mk")
+                times.append(generate(root, output))
+                outputs.append(normalised(output))
+            finally:
+                shutil.rmtree(root)
+        if outputs[0] != outputs[1]:
+            sys.exit(f"the makefiles for {libs} libraries differ")
+        old, new = times
+        print(
+            f"{round(libs * per_lib):8d} {old:9.2f}s {new:9.2f}s"
+            f" {old / new:7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Checks bmd_auth against calculateKeyboardResponse() in src/auth.h (the code
+main.cc uses) bit-for-bit, and times the scalar and batch Python paths.
+
+Needs a C++ compiler ($CXX, default g++) and NumPy.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from bmd_auth import bmd_kbd_auth, bmd_kbd_auth_batch
+
+
+def legacy_bmd_kbd_auth(challenge):
+    # The original per-call implementation from custom_bmd.py, for comparison.
+    AUTH_EVEN_TBL=[0x3ae1206f97c10bc8,0x2a9ab32bebf244c6,0x20a6f8b8df9adf0a,0xaf80ece52cfc1719,0xec2ee2f7414fd151,0xb055adfd73344a15,0xa63d2e3059001187,0x751bf623f42e0dde];AUTH_ODD_TBL=[0x3e22b34f502e7fde,0x24656b981875ab1c,0xa17f3456df7bf8c3,0x6df72e1941aef698,0x72226f011e66ab94,0x3831a3c606296b42,0xfd7ff81881332c89,0x61a3f6474ff236c6];MASK=0xa79a63f585d37bf0
+    def rol8(v): return ((v<<56)|(v>>8))&0xffffffffffffffff
+    def rol8n(v,n):
+        for _ in range(n): v=rol8(v)
+        return v
+    n=challenge&7;v=rol8n(challenge,n)
+    if(v&1)==((0x78>>n)&1):k=AUTH_EVEN_TBL[n]
+    else:v=v^rol8(v);k=AUTH_ODD_TBL[n]
+    return v^(rol8(v)&MASK)^k
+
+
+def build_reference(tmpdir):
+    src = os.path.join(os.path.dirname(os.path.abspath(__file__)), "src")
+    exe = os.path.join(tmpdir, "authvectors")
+    cxx = os.environ.get("CXX", "g++")
+    subprocess.run(
+        [cxx, "-O2", "-std=c++20", "-I" + src, "-o", exe,
+         os.path.join(src, "authvectors.cc")],
+        check=True,
+    )
+    return exe
+
+
+def timed(label, count, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<20} {elapsed * 1e3:10.1f} ms  {count / elapsed / 1e6:8.2f} M/s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--count", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    challenges = rng.integers(0, 2**64, size=args.count, dtype=np.uint64)
+    # Make sure the corners are covered whatever the seed.
+    challenges[:4] = [0, 2**64 - 1, 0x78, 0x0123456789abcdef]
+    as_ints = challenges.tolist()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        exe = build_reference(tmpdir)
+        reference = timed(
+            "C++ reference",
+            args.count,
+            lambda: np.frombuffer(
+                subprocess.run(
+                    [exe],
+                    input=challenges.astype("<u8").tobytes(),
+                    stdout=subprocess.PIPE,
+                    check=True,
+                ).stdout,
+                dtype="<u8",
+            ),
+        )
+
+    legacy = timed(
+        "legacy scalar", args.count,
+        lambda: [legacy_bmd_kbd_auth(c) for c in as_ints],
+    )
+    scalar = timed(
+        "bmd_kbd_auth", args.count,
+        lambda: [bmd_kbd_auth(c) for c in as_ints],
+    )
+    batch = timed(
+        "bmd_kbd_auth_batch", args.count,
+        lambda: bmd_kbd_auth_batch(challenges),
+    )
+
+    failures = 0
+    for label, result in (
+        ("legacy scalar", np.array(legacy, dtype=np.uint64)),
+        ("bmd_kbd_auth", np.array(scalar, dtype=np.uint64)),
+        ("bmd_kbd_auth_batch", batch),
+    ):
+        bad = np.flatnonzero(result != reference)
+        if len(bad):
+            i = bad[0]
+            print(
+                f"MISMATCH {label}: {len(bad)} of {args.count}, first "
+                f"challenge {int(challenges[i]):016x} gave {int(result[i]):016x}, "
+                f"expected {int(reference[i]):016x}"
+            )
+            failures += 1
+    if failures:
+        sys.exit(1)
+    print(f"All {args.count} responses match the C++ implementation.")
+
+
+if __name__ == "__main__":
+    main()
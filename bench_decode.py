@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark of bmd_decode.ReportDecoder against the decoding it replaced:
+SpeedEditor.parse_keys() plus the list diff from custom_bmd.main() for key
+list reports, and process_report() from gemini_round15.py for bitmap
+reports. Both old and new are checked to produce the same presses.
+"""
+
+import argparse
+import random
+import struct
+import time
+
+from bmd_decode import BITMAP_KEYS, ReportDecoder
+from bmd_protocol import SpeedEditorKey
+
+
+def legacy_keylist(reports):
+    # SpeedEditor.parse_keys() and the press diff from custom_bmd.main().
+    pressed = []
+    last_keys = []
+    for report in reports:
+        if not report or report[0] != 4:
+            continue
+        current_keys = [
+            SpeedEditorKey(k)
+            for k in struct.unpack("<6H", report[1:13])
+            if k != 0
+        ]
+        pressed += [k for k in current_keys if k not in last_keys]
+        last_keys = current_keys
+    return pressed
+
+
+def legacy_bitmap(reports):
+    # process_report() from gemini_round15.py, collecting instead of printing.
+    pressed = []
+    prev = [0] * 64
+    for report in reports:
+        for byte_index in range(1, 9):
+            if byte_index < len(report) and report[byte_index] != prev[byte_index]:
+                for bit in range(8):
+                    bit_mask = 1 << bit
+                    if (byte_index, bit_mask) in BITMAP_KEYS:
+                        key = BITMAP_KEYS[(byte_index, bit_mask)]
+                        if (report[byte_index] & bit_mask) and not (prev[byte_index] & bit_mask):
+                            pressed.append(key)
+        prev = report
+    return pressed
+
+
+def new_decoder(reports):
+    pressed = []
+    decoder = ReportDecoder()
+    for report in reports:
+        for event in decoder.decode(report):
+            if event.pressed:
+                pressed.append(event.key)
+    return pressed
+
+
+def keylist_reports(count, rng):
+    keys = [int(k) for k in SpeedEditorKey if k]
+    held = []
+    reports = []
+    for _ in range(count):
+        if held and (len(held) == 6 or rng.random() < 0.5):
+            held.remove(rng.choice(held))
+        else:
+            k = rng.choice(keys)
+            if k not in held:
+                held.append(k)
+        report = bytes([4]) + struct.pack("<6H", *(held + [0] * (6 - len(held))))
+        reports.append(report + bytes(64 - len(report)))
+    return reports
+
+
+def bitmap_reports(count, rng):
+    positions = list(BITMAP_KEYS)
+    state = bytearray(64)
+    state[0] = 1
+    reports = []
+    for _ in range(count):
+        byte, mask = rng.choice(positions)
+        state[byte] ^= mask
+        reports.append(bytes(state))
+    return reports
+
+
+def measure(label, func, reports):
+    start = time.perf_counter()
+    result = func(reports)
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"{label:<22} {elapsed / len(reports) * 1e9:8.0f} ns/report"
+        f"  {len(reports) / elapsed / 1e6:6.2f} M reports/s"
+    )
+    return [int(k) for k in result]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--count", type=int, default=200_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    reports = keylist_reports(args.count, rng)
+    print(f"Key list reports ({args.count}):")
+    old = measure("  parse_keys + diff", legacy_keylist, reports)
+    new = measure("  ReportDecoder", new_decoder, reports)
+    assert old == new, "key list decoders disagree"
+
+    reports = bitmap_reports(args.count, rng)
+    print(f"Bitmap reports ({args.count}):")
+    old = measure("  process_report", legacy_bitmap, reports)
+    new = measure("  ReportDecoder", new_decoder, reports)
+    assert old == new, "bitmap decoders disagree"
+
+
+if __name__ == "__main__":
+    main()
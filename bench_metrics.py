@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Measures what recording a metric costs on the read path, next to the empty
+loop, and fails if any of it reaches a microsecond per event.
+"""
+
+import argparse
+import sys
+import timeit
+
+from bmd_metrics import Metrics
+
+BUDGET_NS = 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--count", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    namespace = {"m": Metrics(), "report": bytes([4]) + bytes(63), "ns": 123_456}
+    cases = [
+        ("empty statement", "pass"),
+        ("count report", "m.reports[report[0]] += 1"),
+        ("count unhandled", "m.unhandled += 1"),
+        ("observe latency", "m.read_to_inject.observe(ns)"),
+    ]
+    over = False
+    for label, stmt in cases:
+        best = min(
+            timeit.repeat(stmt, globals=namespace, number=args.count, repeat=5)
+        )
+        ns = best / args.count * 1e9
+        print(f"{label:<16} {ns:6.1f} ns")
+        over |= ns >= BUDGET_NS
+    if over:
+        sys.exit(f"recording costs {BUDGET_NS} ns or more")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Times build/_objectify.py on a multi-MB input: the original byte-at-a-time
+version against the chunked initializer and the .incbin output, and, with
+--compile, how long the compiler takes over each result.
+
+Needs a C++ compiler ($CXX, default g++) for --compile.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+OBJECTIFY = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "build", "_objectify.py"
+)
+
+
+def legacy_objectify(filename, symbol, out):
+    # The original implementation, for comparison.
+    from functools import partial
+
+    print("const uint8_t " + symbol + "[] = {", file=out)
+    n = 0
+    with open(filename, "rb") as in_file:
+        for c in iter(partial(in_file.read, 1), b""):
+            print("0x%02X," % ord(c), end="", file=out)
+            n += 1
+            if n % 16 == 0:
+                print(file=out)
+    print("};", file=out)
+    print("const size_t " + symbol + "_len = sizeof(" + symbol + ");", file=out)
+
+
+def timed(label, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {elapsed * 1e3:10.1f} ms")
+    return elapsed
+
+
+def objectify(*args):
+    subprocess.run([sys.executable, OBJECTIFY, *args], check=True)
+
+
+def compile_files(*paths):
+    cxx = os.environ.get("CXX", "g++")
+    for path in paths:
+        subprocess.run([cxx, "-c", "-O2", "-o", path + ".o", path], check=True)
+
+
+def write(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=float, default=4, help="input size in MB")
+    parser.add_argument("--compile", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        data = os.path.join(tmpdir, "blob.bin")
+        with open(data, "wb") as f:
+            f.write(os.urandom(int(args.size * 1e6)))
+        legacy = os.path.join(tmpdir, "legacy.h")
+        header = os.path.join(tmpdir, "blob.h")
+        incbin_h = os.path.join(tmpdir, "incbin.h")
+        incbin_s = os.path.join(tmpdir, "incbin.S")
+
+        print(f"Objectifying {args.size:g} MB:")
+
+        def run_legacy():
+            with open(legacy, "w") as out:
+                legacy_objectify(data, "blob", out)
+
+        old = timed("byte at a time (in process)", run_legacy)
+        new = timed("chunked initializer", lambda: objectify("-o", header, data, "blob"))
+        timed(
+            "incbin",
+            lambda: objectify("-o", incbin_h, "--incbin", incbin_s, data, "blob"),
+        )
+        timed("unchanged (skipped)", lambda: objectify("-o", header, data, "blob"))
+        print(f"{'speedup':<32} {old / new:10.1f} x")
+
+        with open(legacy, "rb") as a, open(header, "rb") as b:
+            b.readline()
+            if a.read() != b.read():
+                sys.exit("the chunked initializer differs from the original")
+
+        if args.compile:
+            init = write(
+                os.path.join(tmpdir, "init.cc"),
+                '#include <stdint.h>\n#include <stddef.h>\n#include "blob.h"\n'
+                "size_t size() { return blob_len; }\n",
+            )
+            inc = write(
+                os.path.join(tmpdir, "inc.cc"),
+                '#include "incbin.h"\nsize_t size() { return blob_len; }\n',
+            )
+            print("Compiling:")
+            timed("initializer", lambda: compile_files(init))
+            timed("incbin", lambda: compile_files(inc, incbin_s))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Latency and throughput of the custom_bmd pipeline, from report to output.
+
+Synthetic report 4 and report 3 streams are sent from an emulated panel
+(bmd_emulator) and go through the same stages as in custom_bmd.main():
+
+    read      panel -> HidReader -> read loop
+    decode    ReportDecoder.decode(), which replaced read_keys() and the
+              press diff (bench_decode.py compares the two)
+    dispatch  the compiled keymap action, which queues a macro
+    inject    MacroRunner queue -> a counting Injector
+    total     panel -> injector, for key presses
+
+Each report carries its send time in the padding after the key list or jog
+delta, which the decoder ignores. Latencies are reported as p50/p99/p999
+at a fixed rate; then the rate is doubled until the pipeline stops keeping
+up (reports dropped or p99 over --max-latency) to find the sustained
+maximum.
+
+    python3 bench_pipeline.py --save baseline.json
+    python3 bench_pipeline.py --compare baseline.json --threshold 0.25
+
+With --compare, the exit status is 1 if any p50 or p99 got worse, or the
+sustained rate lower, by more than the threshold (a fraction).
+"""
+
+import argparse
+import json
+import struct
+import sys
+import threading
+import time
+from collections import deque
+
+from bmd_decode import ReportDecoder
+from bmd_emulator import EmulatedDevice, SpeedEditorEmulator
+from bmd_keymap import KeyResolver, compile_keymap
+from bmd_macro import MacroRunner
+from bmd_output import Injector
+from bmd_protocol import (
+    REPORT_JOG,
+    REPORT_KEYS,
+    JogEvent,
+    SpeedEditorKey,
+    authenticate,
+)
+from bmd_reader import HidReader
+
+STAGES = ("read", "decode", "dispatch", "inject", "total")
+PERCENTILES = (("p50", 0.5), ("p99", 0.99), ("p999", 0.999))
+# Well beyond the 1000 reports/s a USB full speed interrupt endpoint can
+# deliver.
+MAX_RATE = 1 << 20
+
+_keylist = struct.Struct("<B6H")
+_jog = struct.Struct("<BBi")
+# Where the send time goes: past the key list, in the unused part.
+_STAMP_OFFSET = 16
+_stamp = struct.Struct("<q")
+
+now_ns = time.perf_counter_ns
+
+
+class CountingInjector(Injector):
+    """Counts output and records when each key press arrives."""
+
+    def __init__(self, on_press):
+        self.keys = 0
+        self.scrolled = 0
+        self.flushes = 0
+        self._on_press = on_press
+
+    def key(self, name, pressed):
+        self.keys += 1
+        if pressed:
+            self._on_press(now_ns())
+
+    def scroll(self, steps):
+        self.scrolled += abs(steps)
+
+    def flush(self):
+        self.flushes += 1
+
+
+def make_reports(count):
+    """A stream alternating presses and releases of every key, with a jog
+    report after each key report."""
+    keys = [int(k) for k in SpeedEditorKey if k]
+    reports = []
+    for i in range(count):
+        if i % 2:
+            delta = 360 if i % 4 == 1 else -360
+            reports.append(_jog.pack(REPORT_JOG, 0, delta))
+        elif i % 4 == 0:
+            key = keys[(i // 4) % len(keys)]
+            reports.append(_keylist.pack(REPORT_KEYS, key, 0, 0, 0, 0, 0))
+        else:
+            reports.append(_keylist.pack(REPORT_KEYS, 0, 0, 0, 0, 0, 0))
+    return [bytearray(r + bytes(64 - len(r))) for r in reports]
+
+
+def percentiles(values):
+    if not values:
+        return {name: None for name, _ in PERCENTILES}
+    values = sorted(values)
+    n = len(values)
+    # In microseconds.
+    return {
+        name: values[min(n - 1, int(q * n))] / 1000 for name, q in PERCENTILES
+    }
+
+
+def run(rate, seconds):
+    """Runs the pipeline at `rate` reports/s; returns the results."""
+    emulator = SpeedEditorEmulator(lifetime=3600)
+    dev = EmulatedDevice(emulator)
+    authenticate(dev)
+
+    samples = {stage: [] for stage in STAGES}
+    # (sent, dispatched) per queued key press, in queue order.
+    pending = deque()
+
+    def on_press(t):
+        if pending:
+            sent, dispatched = pending.popleft()
+            samples["inject"].append(t - dispatched)
+            samples["total"].append(t - sent)
+
+    output = CountingInjector(on_press)
+    runner = MacroRunner(output, maxsize=1 << 16).start()
+    keymap = {
+        k.name: {"type": "key", "action": "a"} for k in SpeedEditorKey if k
+    }
+    keymap = compile_keymap(keymap, runner)
+    decoder = ReportDecoder()
+    resolver = KeyResolver()
+    reader = HidReader(dev, maxsize=4096, timeout_ms=100).start()
+
+    count = int(rate * seconds)
+    reports = make_reports(count)
+    interval = 1e9 / rate
+
+    def produce():
+        start = now_ns()
+        for i, report in enumerate(reports):
+            delay = start + i * interval - now_ns()
+            if delay > 0:
+                # Sleeping rather than spinning leaves the GIL to the
+                # pipeline.
+                time.sleep(delay / 1e9)
+            _stamp.pack_into(report, _STAMP_OFFSET, now_ns())
+            emulator.send_report(bytes(report))
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+
+    received = 0
+    deadline = time.monotonic() + seconds + 2.0
+    while received < count - emulator.overflows - reader.dropped:
+        report = reader.get(timeout=max(0.0, deadline - time.monotonic()))
+        if report is None:
+            break
+        got = now_ns()
+        received += 1
+        sent = _stamp.unpack_from(report, _STAMP_OFFSET)[0]
+        samples["read"].append(got - sent)
+        events = decoder.decode(report)
+        decoded = now_ns()
+        samples["decode"].append(decoded - got)
+        for event in events:
+            if type(event) is JogEvent:
+                runner.scroll(1 if event.delta > 0 else -1)
+        # As custom_bmd does, through the layers and chords.
+        for action, label in resolver.update(keymap, decoder.held):
+            pending.append((sent, now_ns()))
+            action()
+        samples["dispatch"].append(now_ns() - decoded)
+
+    producer.join()
+    reader.stop()
+    runner.close()
+    dev.close()
+
+    return {
+        "rate": rate,
+        "sent": count,
+        "received": received,
+        "dropped": emulator.overflows + reader.dropped + runner.dropped,
+        "stages": {stage: percentiles(v) for stage, v in samples.items()},
+    }
+
+
+def sustained_rate(start, seconds, max_latency):
+    """Doubles the rate from `start` until the pipeline falls behind;
+    returns the highest rate it kept up with."""
+    best = 0
+    rate = start
+    while rate <= MAX_RATE:
+        result = run(rate, seconds)
+        p99 = result["stages"]["total"]["p99"]
+        if result["dropped"] or p99 is None or p99 > max_latency:
+            break
+        best = rate
+        rate *= 2
+    return best
+
+
+def print_result(result):
+    print(
+        f"{result['rate']} reports/s: {result['received']}/{result['sent']}"
+        f" received, {result['dropped']} dropped (latency in us)"
+    )
+    for stage in STAGES:
+        p = result["stages"][stage]
+        cells = "  ".join(
+            f"{name} {p[name]:9.1f}"
+            if p[name] is not None
+            else f"{name} {'n/a':>9}"
+            for name, _ in PERCENTILES
+        )
+        print(f"  {stage:<9} {cells}")
+
+
+def compare(baseline, current, threshold):
+    """Returns the regressions of `current` against `baseline`."""
+    problems = []
+    for stage in STAGES:
+        for name in ("p50", "p99"):
+            old = baseline["stages"][stage][name]
+            new = current["stages"][stage][name]
+            if old and new and new > old * (1 + threshold):
+                problems.append(f"{stage} {name}: {old:.1f} -> {new:.1f} us")
+    old = baseline.get("sustained_rate")
+    new = current.get("sustained_rate")
+    if old and new is not None and new < old * (1 - threshold):
+        problems.append(f"sustained rate: {old} -> {new} reports/s")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--rate", type=int, default=1000, help="reports/s for the latency run"
+    )
+    parser.add_argument("--seconds", type=float, default=2.0)
+    parser.add_argument(
+        "--max-latency",
+        type=float,
+        default=10_000,
+        help="p99 in us above which a rate isn't sustained",
+    )
+    parser.add_argument("--no-sustained", action="store_true")
+    parser.add_argument("--save", metavar="JSON")
+    parser.add_argument("--compare", metavar="JSON")
+    parser.add_argument("--threshold", type=float, default=0.25)
+    args = parser.parse_args()
+
+    result = run(args.rate, args.seconds)
+    print_result(result)
+    if not args.no_sustained:
+        result["sustained_rate"] = sustained_rate(
+            args.rate, args.seconds, args.max_latency
+        )
+        print(f"Sustained: {result['sustained_rate']} reports/s")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        problems = compare(baseline, result, args.threshold)
+        for p in problems:
+            print(f"REGRESSION: {p}")
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
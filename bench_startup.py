@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+How long custom_bmd takes to start: from launching the process to its first
+key event, after authenticating.
+
+An emulated panel (bmd_emulator) is served on a Unix socket sending key
+reports at --key-rate, and custom_bmd.main() is run against it in a fresh
+interpreter each time. The child's output is timestamped as it arrives,
+which splits each start into:
+
+    imports   until main() starts connecting
+    auth      until the handshake has finished
+    event     until the first key press is dispatched
+
+With --output null (the default) a do-nothing injector replaces the real
+one, so the numbers don't depend on a display; pass e.g. --output pynput to
+include it.
+
+Device discovery is timed separately, as the emulator doesn't need any:
+find_hidraw() on a fake sysfs with --devices HID devices, with and without
+its path cache, and hid.enumerate() if hidapi is installed.
+
+    python3 bench_startup.py --runs 20
+"""
+
+import argparse
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from bmd_emulator import SpeedEditorEmulator, serve
+from bmd_hidraw import find_hidraw
+from bmd_protocol import USB_VID
+
+PHASES = ("imports", "auth", "event")
+
+# Runs custom_bmd.main() against the emulator at argv[1]; every key is mapped
+# so the first press prints its label.
+CHILD = """
+import sys
+import custom_bmd
+from bmd_emulator import SocketDevice
+from bmd_output import Injector
+from bmd_protocol import SpeedEditorKey
+custom_bmd.KEY_MAP = {k.name: {"type": "key", "action": "a"} for k in SpeedEditorKey if k}
+if sys.argv[2] == "null":
+    custom_bmd.make_injector = lambda backend, keymap=None: Injector()
+else:
+    custom_bmd.OUTPUT = sys.argv[2]
+custom_bmd.main(SocketDevice(sys.argv[1]))
+"""
+
+
+def start_once(path, output):
+    """Starts custom_bmd once; returns the time to each phase, in ms."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    start = time.perf_counter()
+    child = subprocess.Popen(
+        [sys.executable, "-u", "-c", CHILD, path, output],
+        cwd=here,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    times = {}
+    try:
+        for line in child.stdout:
+            now = (time.perf_counter() - start) * 1e3
+            if line.startswith("Attempting to connect"):
+                times["imports"] = now
+            elif line.startswith("Authentication successful"):
+                times["auth"] = now
+            elif "auth" in times and line.strip() and not line.startswith("("):
+                times["event"] = now
+                break
+            elif line.startswith("ERROR") or line.startswith("\nERROR"):
+                break
+    finally:
+        child.send_signal(signal.SIGINT)
+        try:
+            child.communicate(timeout=5)
+        except subprocess.TimeoutExpired:
+            child.kill()
+            child.communicate()
+    if len(times) != len(PHASES):
+        raise RuntimeError(f"custom_bmd didn't get as far as a key event: {times}")
+    return times
+
+
+def fake_sysfs(root, count):
+    """Creates `count` hidraw entries under `root`, the Speed Editor last."""
+    # A vendor-defined usage page, then one other page.
+    panel = bytes([0x06, 0x01, 0xff, 0x09, 0x01, 0xa1, 0x01, 0x85, 0x06, 0xb1, 0x02, 0xc0])
+    other = bytes([0x05, 0x01, 0x09, 0x06, 0xa1, 0x01, 0x85, 0x01, 0x81, 0x02, 0xc0])
+    for i in range(count):
+        device = os.path.join(root, f"hidraw{i}", "device")
+        os.makedirs(device)
+        last = i == count - 1
+        vid, pid = (USB_VID, 0xda0e) if last else (0x046d, 0xc000 + i)
+        with open(os.path.join(device, "uevent"), "w") as f:
+            f.write(f"HID_ID=0003:{vid:08X}:{pid:08X}\nHID_NAME=device {i}\n")
+        with open(os.path.join(device, "report_descriptor"), "wb") as f:
+            f.write(panel if last else other)
+
+
+def time_discovery(devices, repeat):
+    with tempfile.TemporaryDirectory() as root:
+        sysfs = os.path.join(root, "sys")
+        fake_sysfs(sysfs, devices)
+        cache = os.path.join(root, "cache", "hidraw")
+        kwargs = dict(vendor_id=USB_VID, usage_page=0xff01, sysfs=sysfs)
+
+        def per_call(fn):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                info = fn()
+            assert info and info.path.endswith(f"hidraw{devices - 1}")
+            return (time.perf_counter() - start) / repeat * 1e6
+
+        print(f"Discovery among {devices} HID devices (us per call):")
+        print(f"  find_hidraw, no cache   {per_call(lambda: find_hidraw(**kwargs)):9.1f}")
+        find_hidraw(cache=cache, **kwargs)
+        print(f"  find_hidraw, cached     {per_call(lambda: find_hidraw(cache=cache, **kwargs)):9.1f}")
+    try:
+        import hid
+    except ImportError:
+        print("  hid.enumerate()         (hidapi not installed)")
+        return
+    start = time.perf_counter()
+    for _ in range(repeat):
+        hid.enumerate()
+    us = (time.perf_counter() - start) / repeat * 1e6
+    print(f"  hid.enumerate(), this machine {us:9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--output", default="null", help="custom_bmd OUTPUT, or null")
+    parser.add_argument("--key-rate", type=float, default=1000)
+    parser.add_argument("--devices", type=int, default=30)
+    args = parser.parse_args()
+
+    time_discovery(args.devices, repeat=200)
+
+    emulator = SpeedEditorEmulator(lifetime=3600, key_rate=args.key_rate)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "speed-editor.sock")
+        threading.Thread(target=serve, args=(emulator, path), daemon=True).start()
+        while not os.path.exists(path):
+            time.sleep(0.001)
+        emulator.start()
+
+        results = {phase: [] for phase in PHASES}
+        for _ in range(args.runs):
+            # Make each run authenticate for itself.
+            emulator.unlocked_until = 0.0
+            for phase, ms in start_once(path, args.output).items():
+                results[phase].append(ms)
+        emulator.stop()
+
+    print(f"Start to first key event, {args.runs} runs (ms since launch):")
+    for phase in PHASES:
+        values = results[phase]
+        print(
+            f"  {phase:<8} median {statistics.median(values):7.1f}"
+            f"  min {min(values):7.1f}  max {max(values):7.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
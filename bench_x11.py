@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Counts the X round trips a keypress costs with the old output paths and
+with bmd_x11.X11Injector, and times them.
+
+The old paths are reproduced with python-xlib making the same requests:
+
+    pynput   every press and release is followed by a sync (keysyms
+             with no keycode are left out, so this is a lower bound)
+    main.cc  XSync after each modifier, after each key event (libfakekey),
+             after each wheel button event, and an XChangeKeyboardMapping
+             plus XSync whenever the keysym has no keycode
+
+Each runs the same workload: presses from the custom_bmd KEY_MAP, one HID
+report at a time, plus jog reports worth a few wheel steps each.
+
+Needs an X server with XTEST. Without $DISPLAY, Xvfb is started for the
+run:
+
+    python3 bench_x11.py
+    DISPLAY=:1 python3 bench_x11.py -n 2000
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import time
+
+from Xlib import X, display as xdisplay
+from Xlib.ext import xtest
+from Xlib.protocol import display as pdisplay, rq
+
+from bmd_output import Injector, keymap_keys
+from bmd_x11 import BUTTONS, SCROLL_DOWN, SCROLL_UP, X11Injector, keysym
+
+# Like custom_bmd.KEY_MAP, plus two keysyms that need a spare keycode.
+KEY_MAP = {
+    "SMART_INSRT": {"type": "key", "action": "f5"},
+    "APPND": {"type": "string", "action": "Hi!"},
+    "RIPL_OWR": {"type": "mouse_click", "action": "right"},
+    "CLOSE_UP": {"type": "combo", "action": ["ctrl", "c"]},
+    "PLACE_ON_TOP": {"type": "combo", "action": ["ctrl", "v"]},
+    "CAM1": {"type": "key", "action": "1"},
+    "SNAP": {"type": "key", "action": "enter"},
+    "IN": {"type": "key", "action": "ß"},
+    "OUT": {"type": "key", "action": "€"},
+}
+JOG_STEPS = 3
+
+
+class Counter:
+    """Counts replies waited for and flushes on every connection."""
+
+    def __init__(self):
+        self.round_trips = 0
+        self.flushes = 0
+
+    def __enter__(self):
+        self._reply = rq.ReplyRequest.reply
+        self._flush = pdisplay.Display.flush
+        counter = self
+
+        def reply(request):
+            counter.round_trips += 1
+            return counter._reply(request)
+
+        def flush(d):
+            counter.flushes += 1
+            return counter._flush(d)
+
+        rq.ReplyRequest.reply = reply
+        pdisplay.Display.flush = flush
+        return self
+
+    def __exit__(self, *exc):
+        rq.ReplyRequest.reply = self._reply
+        pdisplay.Display.flush = self._flush
+
+
+class SyncEachInjector(Injector):
+    """The pynput path: a sync after every event."""
+
+    def __init__(self, display):
+        self.display = display
+
+    def key(self, name, pressed):
+        d = self.display
+        keycode = d.keysym_to_keycode(keysym(name))
+        if not keycode:
+            return
+        xtest.fake_input(d, X.KeyPress if pressed else X.KeyRelease, keycode)
+        d.sync()
+
+    def click(self, button):
+        d = self.display
+        xtest.fake_input(d, X.ButtonPress, BUTTONS[button])
+        d.sync()
+        xtest.fake_input(d, X.ButtonRelease, BUTTONS[button])
+        d.sync()
+
+    def scroll(self, steps):
+        d = self.display
+        button = SCROLL_DOWN if steps > 0 else SCROLL_UP
+        for _ in range(abs(steps)):
+            xtest.fake_input(d, X.ButtonPress, button)
+            d.sync()
+            xtest.fake_input(d, X.ButtonRelease, button)
+            d.sync()
+
+    def close(self):
+        self.display.close()
+
+
+class MainCcInjector(SyncEachInjector):
+    """The main.cc path: libfakekey plus pressReleaseModifiers()."""
+
+    def __init__(self, display):
+        super().__init__(display)
+        info = display.display.info
+        mapping = display.get_keyboard_mapping(
+            info.min_keycode, info.max_keycode - info.min_keycode + 1
+        )
+        free = [info.min_keycode + i for i, s in enumerate(mapping) if not any(s)]
+        # libfakekey keeps one scratch keycode for unbound keysyms.
+        self.scratch = free[-1]
+        self.bound = None
+
+    def key(self, name, pressed):
+        d = self.display
+        sym = keysym(name)
+        if pressed:
+            keycode = d.keysym_to_keycode(sym)
+            if not keycode:
+                if self.bound != sym:
+                    d.change_keyboard_mapping(self.scratch, [(sym, sym)])
+                    d.sync()
+                    self.bound = sym
+                keycode = self.scratch
+            self.last = keycode
+            xtest.fake_input(d, X.KeyPress, keycode)
+        else:
+            xtest.fake_input(d, X.KeyRelease, self.last)
+        d.sync()
+
+    def combo(self, names):
+        # Modifiers are pressed and released with an XSync each.
+        d = self.display
+        mods = [d.keysym_to_keycode(keysym(n)) for n in names[:-1]]
+        for keycode in mods:
+            xtest.fake_input(d, X.KeyPress, keycode)
+            d.sync()
+        self.tap(names[-1])
+        for keycode in reversed(mods):
+            xtest.fake_input(d, X.KeyRelease, keycode)
+            d.sync()
+
+    def close(self):
+        self.display.change_keyboard_mapping(self.scratch, [(X.NoSymbol,) * 2])
+        self.display.sync()
+        super().close()
+
+
+def run(injector, count):
+    actions = list(KEY_MAP.values())
+    for i in range(count):
+        injector.perform(actions[i % len(actions)])
+        injector.flush()
+        injector.scroll(JOG_STEPS if i % 2 else -JOG_STEPS)
+        injector.flush()
+
+
+def measure(label, make, count):
+    d = xdisplay.Display()
+    with Counter() as setup:
+        injector = make(d)
+    with Counter() as c:
+        start = time.perf_counter()
+        run(injector, count)
+        d.sync()
+        elapsed = time.perf_counter() - start
+    # The final sync is the benchmark's, not the injector's.
+    c.round_trips -= 1
+    injector.close()
+    print(
+        f"{label:<14} {c.round_trips / count:6.2f} round trips/press"
+        f"  {c.flushes / count:5.2f} flushes/press"
+        f"  {elapsed / count * 1e6:8.1f} us/press"
+        f"  (setup: {setup.round_trips} round trips)"
+    )
+
+
+def start_xvfb():
+    if os.environ.get("DISPLAY"):
+        return None
+    if not shutil.which("Xvfb"):
+        raise SystemExit("no $DISPLAY and no Xvfb to start")
+    display = ":97"
+    proc = subprocess.Popen(
+        ["Xvfb", display, "-nolisten", "tcp"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    os.environ["DISPLAY"] = display
+    for _ in range(100):
+        try:
+            xdisplay.Display().close()
+            return proc
+        except Exception:
+            time.sleep(0.05)
+    proc.kill()
+    raise SystemExit("Xvfb didn't start")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--count", type=int, default=500)
+    args = parser.parse_args()
+
+    names = keymap_keys(KEY_MAP)
+    xvfb = start_xvfb()
+    try:
+        print(f"{args.count} presses, each followed by {JOG_STEPS} wheel steps:")
+        measure("pynput", SyncEachInjector, args.count)
+        measure("main.cc", MainCcInjector, args.count)
+        measure("X11Injector", lambda d: X11Injector(names, display=d), args.count)
+    finally:
+        if xvfb:
+            xvfb.terminate()
+            xvfb.wait()
+
+
+if __name__ == "__main__":
+    main()
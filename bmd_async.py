@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+asyncio interface to the Speed Editor.
+
+AsyncSpeedEditor opens a hidraw node directly and registers its descriptor
+with the event loop, so no thread is tied up per device and an idle pad
+costs nothing until the kernel has a report for it:
+
+    async with AsyncSpeedEditor("/dev/hidraw3") as editor:
+        await editor.authenticate()
+        async for event in editor.events():
+            ...
+
+Events are the KeyEvent, JogEvent and UnknownReport tuples from
+bmd_protocol. With reports=True, events() yields a Report per input report
+instead, with the time it was read and its events together.
+"""
+
+import asyncio
+import sys
+import time
+from collections import namedtuple
+
+from bmd_hidraw import HidrawDevice
+from bmd_decode import ReportDecoder
+from bmd_protocol import authenticate
+
+# `time_ns` is time.monotonic_ns() when the report was read.
+Report = namedtuple("Report", "time_ns events")
+
+
+class AsyncSpeedEditor:
+    """A Speed Editor on a hidraw node, driven by the running event loop.
+
+    Decoded events wait in a queue of `maxsize` entries; if the consumer
+    falls that far behind the oldest are discarded and counted in
+    `dropped`.
+
+    `dev` is an already open transport to use instead of the node at
+    `path`, such as a bmd_emulator device.
+    """
+
+    def __init__(self, path, maxsize=1024, dev=None, reports=False):
+        self.path = path
+        self.reports = reports
+        self.dev = dev if dev is not None else HidrawDevice(path)
+        self.decoder = ReportDecoder()
+        self.dropped = 0
+        self.error = None
+        self._queue = asyncio.Queue(maxsize)
+        self._loop = None
+        self._auth = None
+        self._auth_lock = asyncio.Lock()
+        self._closed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    async def authenticate(self):
+        """Runs the handshake; returns the device's auth status word.
+
+        The feature report ioctls block for a USB round trip each, so they
+        run on the default executor to keep a slow device from stalling
+        the loop. Concurrent calls are run one after the other.
+        """
+        async with self._auth_lock:
+            if self._auth is not None and not self._auth.done():
+                # An earlier, cancelled, handshake is still running.
+                await asyncio.wait([self._auth])
+            loop = asyncio.get_running_loop()
+            self._auth = loop.run_in_executor(None, authenticate, self.dev)
+            return await asyncio.shield(self._auth)
+
+    def _put(self, item):
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except asyncio.QueueFull:
+                self._queue.get_nowait()
+                self.dropped += 1
+
+    def _on_readable(self):
+        decoder = self.decoder
+        while True:
+            try:
+                n = decoder.readinto(self.dev)
+            except OSError as e:
+                self.error = e
+                self.close()
+                return
+            if not n:
+                return
+            events = decoder.decode(decoder.buffer, n)
+            if self.reports:
+                if events:
+                    self._put(Report(time.monotonic_ns(), tuple(events)))
+                continue
+            for event in events:
+                self._put(event)
+
+    def start(self):
+        """Starts watching the device; events() calls this itself."""
+        if self._loop is None and not self._closed:
+            self._loop = asyncio.get_running_loop()
+            self._loop.add_reader(self.dev.fileno(), self._on_readable)
+
+    async def events(self):
+        """Yields decoded events, or Reports, until the device is closed.
+
+        If the device failed, the error is raised once the events queued
+        before it have been consumed.
+        """
+        self.start()
+        while True:
+            event = await self._queue.get()
+            if event is None:
+                self._put(None)
+                if self.error:
+                    raise self.error
+                return
+            yield event
+
+    def close(self):
+        """Stops watching the device and closes it. Safe to call at any time,
+        including while authenticate() or events() are being cancelled."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._loop is not None:
+            self._loop.remove_reader(self.dev.fileno())
+        if self._auth is not None and not self._auth.done():
+            # The handshake is still using the descriptor on another thread.
+            self._auth.add_done_callback(lambda f: self.dev.close())
+        else:
+            self.dev.close()
+        self._put(None)
+
+
+async def _print_events(path):
+    async with AsyncSpeedEditor(path) as editor:
+        status = await editor.authenticate()
+        print(f"{path}: authenticated, status {status}")
+        async for event in editor.events():
+            print(f"{path}: {event}")
+
+
+async def _main(paths):
+    await asyncio.gather(*[_print_events(p) for p in paths])
+
+
+def main():
+    if len(sys.argv) < 2:
+        sys.exit("Usage: %s /dev/hidrawN..." % sys.argv[0])
+    try:
+        asyncio.run(_main(sys.argv[1:]))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
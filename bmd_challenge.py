@@ -1,37 +1,9 @@
 import hid
-
-def rol8(value):
-    """Rotate 64-bit integer left by 8 bits (1 byte)."""
-    return ((value << 8) & 0xFFFFFFFFFFFFFFFF) | (value >> (64 - 8))
-
-def rol8n(value, n):
-    """Rotate 64-bit integer left by n bytes (n*8 bits)."""
-    shift = (n * 8) % 64
-    return ((value << shift) & 0xFFFFFFFFFFFFFFFF) | (value >> (64 - shift))
+from bmd_auth import AUTH_EVEN_TBL, AUTH_ODD_TBL, MASK, rol8, rol8n
+from bmd_protocol import SPEED_EDITOR_PIDS, USB_VID
 
 def calculateKeyboardResponse(challenge):
-    auth_even_tbl = [
-        0x3ae1206f97c10bc8,
-        0x2a9ab32bebf244c6,
-        0x20a6f8b8df9adf0a,
-        0xaf80ece52cfc1719,
-        0xec2ee2f7414fd151,
-        0xb055adfd73344a15,
-        0xa63d2e3059001187,
-        0x751bf623f42e0dde
-    ]
-    auth_odd_tbl = [
-        0x3e22b34f502e7fde,
-        0x24656b981875ab1c,
-        0xa17f3456df7bf8c3,
-        0x6df72e1941aef698,
-        0x72226f011e66ab94,
-        0x3831a3c606296b42,
-        0xfd7ff81881332c89,
-        0x61a3f6474ff236c6
-    ]
-    mask = 0xa79a63f585d37bf0
-
+    """Same as bmd_auth.bmd_kbd_auth(), but printing each intermediate step."""
     print(f"\n--- Calculating response for challenge: {challenge:016X} ---")
 
     n = challenge & 0b111
@@ -42,17 +14,17 @@ def calculateKeyboardResponse(challenge):
 
     if (v & 1) == ((0x78 >> n) & 1):
         print("Path: EVEN")
-        k = auth_even_tbl[n]
+        k = AUTH_EVEN_TBL[n]
     else:
         print("Path: ODD")
         v = v ^ rol8(v)
         print(f"v after XOR rol8: {v:016X}")
-        k = auth_odd_tbl[n]
+        k = AUTH_ODD_TBL[n]
 
     print(f"k (table value) : {k:016X}")
     rotated_v = rol8(v)
     print(f"rol8(v)         : {rotated_v:016X}")
-    masked = rotated_v & mask
+    masked = rotated_v & MASK
     print(f"masked rol8(v)  : {masked:016X}")
 
     response = v ^ masked ^ k
@@ -60,12 +32,11 @@ def calculateKeyboardResponse(challenge):
     return response
 
 def find_speed_editor():
-    """Find Blackmagic Speed Editor HID device by name."""
-    for dev in hid.enumerate():
-        product = dev.get("product_string", "") or ""
+    """Find Blackmagic Speed Editor HID device by vendor and product ID."""
+    for dev in hid.enumerate(USB_VID):
         vendor_id = dev.get("vendor_id")
         product_id = dev.get("product_id")
-        if "speed editor" in product.lower():
+        if product_id in SPEED_EDITOR_PIDS:
             print(f"Found Speed Editor: VID={vendor_id:04X}, PID={product_id:04X}")
             return vendor_id, product_id
     raise RuntimeError("Blackmagic Speed Editor not found")
@@ -0,0 +1,238 @@
+"""
+Client side of the bmd_daemon event socket.
+
+The daemon owns and authenticates the panels; any number of clients
+connect to its Unix socket and receive every event as a fixed-size frame:
+
+    u8   type       FRAME_* below
+    u8   device     which panel, numbered from 0 as they are first seen
+    u16  code       keycode, jog mode, protocol version or report ID
+    i32  value      jog delta, auth status, ring size or drop count
+    u64  time_ns    CLOCK_MONOTONIC when the daemon read the report
+
+The first frame is FRAME_HELLO. Then come FRAME_DEVICE_ADDED and the held
+keys of every panel already attached, so a client that connects while a
+key is down still sees it released. A client that doesn't keep up loses
+the oldest frames first; FRAME_DROPPED says how many, before the frames
+that follow the gap, and its `code` how many panels' held keys are sent
+after those frames, as FRAME_HELD frames. Each FRAME_HELD carries the bits
+of 32 keycodes as `value`, from the keycode in `code`; the one from
+keycode 0 replaces what was known of that panel's keys, and panels without
+one have gone.
+
+    with EventClient() as client:
+        for device, event in client.events():
+            ...
+
+events() yields the KeyEvent and JogEvent tuples from bmd_protocol, plus
+DeviceAdded, DeviceRemoved and Dropped; reports() groups them by the report
+they came from, and frames() yields the raw Frame tuples. `held` tracks each
+device's held keys as a keycode bitset, like ReportDecoder.held, including
+the FRAME_HELD resyncs.
+"""
+
+import os
+import socket
+import struct
+from collections import namedtuple
+
+from bmd_protocol import JogEvent, KeyEvent
+
+DEFAULT_SOCKET = os.path.join(
+    os.environ.get("XDG_RUNTIME_DIR") or "/tmp", "speed-editor.sock"
+)
+
+PROTOCOL_VERSION = 2
+
+FRAME_HELLO = 0
+FRAME_KEY_DOWN = 1
+FRAME_KEY_UP = 2
+FRAME_JOG = 3
+FRAME_DEVICE_ADDED = 4
+FRAME_DEVICE_REMOVED = 5
+FRAME_DROPPED = 6
+FRAME_UNKNOWN = 7
+FRAME_HELD = 8
+
+FRAME = struct.Struct("<BBHiQ")
+FRAME_SIZE = FRAME.size
+
+Frame = namedtuple("Frame", "type device code value time_ns")
+
+# The events for frames that aren't input; `errno` is 0 if the device was
+# unplugged rather than failing.
+DeviceAdded = namedtuple("DeviceAdded", "status")
+DeviceRemoved = namedtuple("DeviceRemoved", "errno")
+Dropped = namedtuple("Dropped", "count")
+
+
+class ProtocolError(OSError):
+    pass
+
+
+def frame_event(frame):
+    """Returns the event a frame carries, or None for FRAME_HELLO,
+    FRAME_UNKNOWN and FRAME_HELD."""
+    t = frame.type
+    if t == FRAME_KEY_DOWN:
+        return KeyEvent(frame.code, True)
+    if t == FRAME_KEY_UP:
+        return KeyEvent(frame.code, False)
+    if t == FRAME_JOG:
+        return JogEvent(frame.code, frame.value)
+    if t == FRAME_DEVICE_ADDED:
+        return DeviceAdded(frame.value)
+    if t == FRAME_DEVICE_REMOVED:
+        return DeviceRemoved(frame.value)
+    if t == FRAME_DROPPED:
+        return Dropped(frame.value)
+    return None
+
+
+class EventClient:
+    """A connection to the daemon at `path`."""
+
+    def __init__(self, path=DEFAULT_SOCKET):
+        self.path = path
+        self.held = {}
+        self.ring_size = None
+        self.dropped = 0
+        # After FRAME_DROPPED, the devices not resynced yet and how many
+        # resyncs are to come.
+        self._stale = None
+        self._resyncs = 0
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._sock.connect(path)
+        except OSError:
+            self._sock.close()
+            raise
+        self._buffer = bytearray(FRAME_SIZE * 256)
+        self._view = memoryview(self._buffer)
+        self._filled = 0
+        hello = self._read_frames()
+        if not hello or hello[0].type != FRAME_HELLO:
+            raise ProtocolError("no hello from the daemon")
+        if hello[0].code != PROTOCOL_VERSION:
+            raise ProtocolError(f"daemon speaks version {hello[0].code}")
+        self.ring_size = hello[0].value
+        self._pending = hello[1:]
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def close(self):
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _read_frames(self):
+        # Blocks for at least one whole frame; returns [] once the daemon
+        # has closed the connection.
+        while True:
+            n = self._sock.recv_into(self._view[self._filled :])
+            if not n:
+                return []
+            self._filled += n
+            whole = self._filled - self._filled % FRAME_SIZE
+            if whole:
+                break
+        frames = [
+            Frame._make(f) for f in FRAME.iter_unpack(self._view[:whole])
+        ]
+        rest = self._filled - whole
+        self._buffer[:rest] = self._buffer[whole : self._filled]
+        self._filled = rest
+        return frames
+
+    def _track(self, frame):
+        t = frame.type
+        if t == FRAME_KEY_DOWN:
+            self.held[frame.device] = self.held.get(frame.device, 0) | (
+                1 << frame.code
+            )
+        elif t == FRAME_KEY_UP:
+            self.held[frame.device] = self.held.get(frame.device, 0) & ~(
+                1 << frame.code
+            )
+        elif t == FRAME_DEVICE_REMOVED:
+            self.held.pop(frame.device, None)
+        elif t == FRAME_DROPPED:
+            self.dropped += frame.value
+            self._stale = set(self.held)
+            self._resyncs = frame.code
+            self._resynced()
+        elif t == FRAME_HELD:
+            bits = (frame.value & 0xFFFFFFFF) << frame.code
+            if frame.code:
+                self.held[frame.device] = self.held.get(frame.device, 0) | bits
+                return
+            self.held[frame.device] = bits
+            if self._stale is not None:
+                self._stale.discard(frame.device)
+                self._resyncs -= 1
+                self._resynced()
+
+    def _resynced(self):
+        # Once every panel attached has been resynced, the others have gone.
+        if self._resyncs <= 0:
+            for device in self._stale:
+                self.held.pop(device, None)
+            self._stale = None
+
+    def _batches(self):
+        while True:
+            frames, self._pending = self._pending, []
+            if not frames:
+                frames = self._read_frames()
+                if not frames:
+                    return
+            yield frames
+
+    def frames(self):
+        """Yields frames until the daemon goes away."""
+        for batch in self._batches():
+            for frame in batch:
+                self._track(frame)
+                yield frame
+
+    def events(self):
+        """Yields (device, event) pairs until the daemon goes away."""
+        for frame in self.frames():
+            event = frame_event(frame)
+            if event is not None:
+                yield frame.device, event
+
+    def reports(self):
+        """Yields (device, events) for each report the daemon read, once
+        `held` includes all of its events, and (device, []) when `held` has
+        been resynced after dropped frames.
+
+        The frames of one report share their device and time_ns, and the
+        daemon sends them in one write, so they are grouped together
+        unless a single report is split between two reads.
+        """
+        for batch in self._batches():
+            i = 0
+            while i < len(batch):
+                first = batch[i]
+                events = []
+                resync = False
+                while (
+                    i < len(batch)
+                    and batch[i].device == first.device
+                    and batch[i].time_ns == first.time_ns
+                ):
+                    self._track(batch[i])
+                    event = frame_event(batch[i])
+                    if event is not None:
+                        events.append(event)
+                    elif batch[i].type == FRAME_HELD:
+                        resync = True
+                    i += 1
+                if events or resync:
+                    yield first.device, events
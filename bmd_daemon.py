@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+A daemon that owns the panels and fans their events out to clients.
+
+Only one program can use a Speed Editor at a time, and each has to open and
+authenticate it itself. bmd_daemon does that once, through a Supervisor
+that follows hot-plugging and renews the authentication, and publishes the
+decoded events on a Unix socket as fixed-size frames (see bmd_client for
+the format and the client side):
+
+    python3 bmd_daemon.py                      # every panel attached
+    python3 bmd_daemon.py --emulator /tmp/speed-editor-emu.sock
+
+Every subscriber has a ring buffer of `ring_size` frames between the
+reader and its socket. Publishing an event only appends it to the rings;
+each subscriber's frames are written by a task of its own, as fast as that
+client reads them, and when a ring is full its oldest frame is dropped to
+make room. So a slow or stuck client only ever loses its own frames and
+never holds up reading the panels or the other clients. A client that lost
+frames is sent the keys held on every panel afterwards, in case a release
+was among them.
+
+Each panel's jog wheel is put in relative mode when it is attached, as
+custom_bmd does when it opens the panel itself.
+"""
+
+import argparse
+import asyncio
+import functools
+import os
+import time
+from collections import deque
+
+from bmd_client import (
+    DEFAULT_SOCKET,
+    FRAME,
+    FRAME_DEVICE_ADDED,
+    FRAME_DEVICE_REMOVED,
+    FRAME_DROPPED,
+    FRAME_HELD,
+    FRAME_HELLO,
+    FRAME_JOG,
+    FRAME_KEY_DOWN,
+    FRAME_KEY_UP,
+    FRAME_UNKNOWN,
+    PROTOCOL_VERSION,
+)
+from bmd_async import AsyncSpeedEditor, Report
+from bmd_leds import jog_mode_report
+from bmd_protocol import JogEvent, JogMode, KeyEvent, UnknownReport
+from bmd_supervisor import DeviceAdded, DeviceRemoved, Supervisor
+
+# Frames number the devices with a byte.
+MAX_DEVICES = 256
+
+
+class _Subscriber:
+    def __init__(self, writer, ring_size):
+        self.writer = writer
+        self.ring = deque(maxlen=ring_size)
+        self.ready = asyncio.Event()
+        self.closed = False
+        # Frames dropped since the client was last told, and in all.
+        self.unreported = 0
+        self.dropped = 0
+
+    def close(self):
+        self.closed = True
+        self.ready.set()
+
+    def push(self, frames):
+        ring = self.ring
+        for frame in frames:
+            if len(ring) == ring.maxlen:
+                self.unreported += 1
+                self.dropped += 1
+            ring.append(frame)
+        self.ready.set()
+
+
+class EventDaemon:
+    """Publishes events to every client connected to the socket at `path`.
+
+    `published` counts the frames published and `dropped` those dropped
+    from any subscriber's ring.
+    """
+
+    def __init__(self, path=DEFAULT_SOCKET, ring_size=256):
+        self.path = path
+        self.ring_size = ring_size
+        self.published = 0
+        self.dropped = 0
+        self.subscribers = set()
+        self._devices = {}
+        self._held = {}
+        self._status = {}
+        self._server = None
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._serve, self.path)
+        os.chmod(self.path, 0o600)
+        return self
+
+    def close(self):
+        if self._server is None:
+            return
+        self._server.close()
+        self._server = None
+        for sub in list(self.subscribers):
+            sub.close()
+        os.unlink(self.path)
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def device_index(self, path):
+        """Returns the number frames use for the device at `path`, or None
+        if MAX_DEVICES are attached already.
+
+        A number is freed when its device is removed, and reused.
+        """
+        index = self._devices.get(path)
+        if index is None:
+            used = set(self._devices.values())
+            for index in range(MAX_DEVICES):
+                if index not in used:
+                    self._devices[path] = index
+                    return index
+            return None
+        return index
+
+    def _frame(self, device, event, now):
+        t = type(event)
+        if t is KeyEvent:
+            held = self._held.get(device, 0)
+            if event.pressed:
+                self._held[device] = held | (1 << event.key)
+                return FRAME.pack(FRAME_KEY_DOWN, device, event.key, 0, now)
+            self._held[device] = held & ~(1 << event.key)
+            return FRAME.pack(FRAME_KEY_UP, device, event.key, 0, now)
+        if t is JogEvent:
+            return FRAME.pack(FRAME_JOG, device, event.mode, event.delta, now)
+        if t is DeviceAdded:
+            self._held[device] = 0
+            self._status[device] = event.status
+            return FRAME.pack(FRAME_DEVICE_ADDED, device, 0, event.status, now)
+        if t is DeviceRemoved:
+            self._held.pop(device, None)
+            self._status.pop(device, None)
+            errno = getattr(event.error, "errno", 0) or 0
+            return FRAME.pack(FRAME_DEVICE_REMOVED, device, 0, errno, now)
+        if t is UnknownReport:
+            report_id = event.data[0] if event.data else 0
+            return FRAME.pack(FRAME_UNKNOWN, device, report_id, 0, now)
+        return None
+
+    def publish(self, path, events, time_ns=None):
+        """Publishes the events of one report from the device at `path`.
+
+        `time_ns` defaults to now.
+        """
+        device = self.device_index(path)
+        if device is None:
+            return
+        now = time.monotonic_ns() if time_ns is None else time_ns
+        frames = []
+        for event in events:
+            frame = self._frame(device, event, now)
+            if frame is not None:
+                frames.append(frame)
+            if type(event) is DeviceRemoved:
+                del self._devices[path]
+        if not frames:
+            return
+        self.published += len(frames)
+        for sub in self.subscribers:
+            sub.push(frames)
+
+    def _snapshot(self):
+        # What a new client needs to know: the panels attached and the keys
+        # held on them.
+        now = time.monotonic_ns()
+        frames = [FRAME.pack(FRAME_HELLO, 0, PROTOCOL_VERSION, self.ring_size, 0)]
+        for device, held in sorted(self._held.items()):
+            status = self._status[device]
+            frames.append(
+                FRAME.pack(FRAME_DEVICE_ADDED, device, 0, status, now)
+            )
+            k = 0
+            while held:
+                if held & 1:
+                    frames.append(FRAME.pack(FRAME_KEY_DOWN, device, k, 0, now))
+                held >>= 1
+                k += 1
+        return frames
+
+    def _resync(self):
+        # Every panel's held keys, for a client that lost frames: FRAME_HELD
+        # frames each carry 32 keycodes' bits as `value`, from the keycode
+        # in `code`.
+        now = time.monotonic_ns()
+        frames = []
+        for device, held in sorted(self._held.items()):
+            first = 0
+            while True:
+                word = (held >> first) & 0xFFFFFFFF
+                if word & 0x80000000:
+                    word -= 1 << 32
+                frames.append(FRAME.pack(FRAME_HELD, device, first, word, now))
+                first += 32
+                if not held >> first:
+                    break
+        return frames
+
+    async def _serve(self, reader, writer):
+        sub = _Subscriber(writer, self.ring_size)
+        sub.push(self._snapshot())
+        self.subscribers.add(sub)
+        # Clients send nothing; waiting for the end of file notices one that
+        # has gone while idle, without an event to write to it.
+        eof = asyncio.ensure_future(reader.read())
+        eof.add_done_callback(lambda f: sub.close())
+        try:
+            while True:
+                await sub.ready.wait()
+                sub.ready.clear()
+                if sub.closed:
+                    break
+                if sub.unreported:
+                    # The notice says how many panels' held keys follow the
+                    # frames that are left.
+                    notice = FRAME.pack(
+                        FRAME_DROPPED,
+                        0,
+                        len(self._held),
+                        sub.unreported,
+                        time.monotonic_ns(),
+                    )
+                    resync = b"".join(self._resync())
+                    self.dropped += sub.unreported
+                    sub.unreported = 0
+                else:
+                    notice = resync = b""
+                batch = notice + b"".join(sub.ring) + resync
+                sub.ring.clear()
+                writer.write(batch)
+                # Frames published while this waits go into the ring.
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            eof.cancel()
+            self.subscribers.discard(sub)
+            writer.close()
+
+
+def _publish(daemon, path, item):
+    if type(item) is Report:
+        daemon.publish(path, item.events, item.time_ns)
+    else:
+        daemon.publish(path, (item,))
+
+
+def _enable_jog(editor):
+    try:
+        editor.dev.write(jog_mode_report(JogMode.RELATIVE))
+    except OSError:
+        # The device has gone; its pump reports that.
+        pass
+
+
+async def _pump_supervisor(daemon):
+    opener = functools.partial(AsyncSpeedEditor, reports=True)
+    async with Supervisor(opener=opener) as supervisor:
+        async for path, item in supervisor.events():
+            if type(item) is DeviceAdded and path in supervisor.editors:
+                _enable_jog(supervisor.editors[path])
+            _publish(daemon, path, item)
+
+
+async def _pump_emulator(daemon, path):
+    # One emulated panel, through bmd_emulator's socket transport.
+    from bmd_emulator import SocketDevice
+    from bmd_reauth import AsyncReauthScheduler
+
+    editor = AsyncSpeedEditor(path, dev=SocketDevice(path), reports=True)
+    status = await editor.authenticate()
+    reauth = AsyncReauthScheduler(editor).start(status)
+    _enable_jog(editor)
+    daemon.publish(path, (DeviceAdded(status),))
+    error = None
+    try:
+        async for item in editor.events():
+            _publish(daemon, path, item)
+    except OSError as e:
+        error = e
+    finally:
+        reauth.stop()
+        editor.close()
+        daemon.publish(path, editor.decoder.release_all() + [DeviceRemoved(error)])
+
+
+async def _main(args):
+    async with EventDaemon(args.socket, args.ring_size) as daemon:
+        print(f"Publishing events on {args.socket}")
+        if args.emulator:
+            await _pump_emulator(daemon, args.emulator)
+        else:
+            await _pump_supervisor(daemon)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--socket", default=DEFAULT_SOCKET)
+    parser.add_argument(
+        "--ring-size", type=int, default=256, help="frames buffered per client"
+    )
+    parser.add_argument(
+        "--emulator", metavar="PATH", help="use `bmd_emulator.py serve PATH`"
+    )
+    args = parser.parse_args()
+    try:
+        asyncio.run(_main(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""
+Input report decoding.
+
+ReportDecoder turns raw input reports into KeyEvent, JogEvent and
+UnknownReport tuples (see bmd_protocol). It understands:
+
+    report 4: the Speed Editor's key list, six little-endian u16 keycodes
+    report 1: the key bitmap some firmware sends instead, bytes 1-8
+    report 3: the jog wheel, a mode byte followed by a signed i32 delta
+
+It is built to do as little work as possible per report. Held keys are an
+integer bitset; the KeyEvent for every press and release is created up
+front and reused; bitmap changes are looked up a byte at a time in
+precomputed transition tables; and decode() returns the same list object
+every time, so a report allocates nothing except jog and unknown-report
+events. Use readinto() to read reports into the decoder's own buffer.
+"""
+
+import struct
+
+from bmd_protocol import (
+    REPORT_JOG,
+    REPORT_KEYS,
+    BitmapKey,
+    JogEvent,
+    KeyEvent,
+    SpeedEditorKey,
+    UnknownReport,
+)
+
+REPORT_BITMAP = 1
+
+# Keycodes are a u16 on the wire but the Speed Editor only uses up to 0x3c.
+# Anything beyond NUM_KEYS still works, just through the slow path.
+NUM_KEYS = 64
+
+_BITS = tuple(1 << k for k in range(NUM_KEYS))
+PRESS = tuple(KeyEvent(k, True) for k in range(NUM_KEYS))
+RELEASE = tuple(KeyEvent(k, False) for k in range(NUM_KEYS))
+
+# Bit positions of the keys in the report 1 bitmap, as (byte, mask).
+BITMAP_KEYS = {
+    (1, 0x01): BitmapKey.SMART_IN,
+    (1, 0x02): BitmapKey.SMART_OUT,
+    (1, 0x04): SpeedEditorKey.TRANS,
+    (1, 0x08): BitmapKey.BLACK,
+    (1, 0x10): BitmapKey.FREEZE,
+    (1, 0x20): SpeedEditorKey.JOG,
+    (1, 0x40): SpeedEditorKey.SHTL,
+    (1, 0x80): SpeedEditorKey.SCRL,
+    (2, 0x01): SpeedEditorKey.ESC,
+    (2, 0x02): SpeedEditorKey.SYNC_BIN,
+    (2, 0x04): SpeedEditorKey.AUDIO_LEVEL,
+    (2, 0x08): SpeedEditorKey.FULL_VIEW,
+    (2, 0x10): SpeedEditorKey.TRANS_DUR,
+    (2, 0x20): SpeedEditorKey.CUT,
+    (2, 0x40): SpeedEditorKey.DIS,
+    (2, 0x80): SpeedEditorKey.SMTH_CUT,
+    (3, 0x01): SpeedEditorKey.SMART_INSRT,
+    (3, 0x02): SpeedEditorKey.APPND,
+    (3, 0x04): SpeedEditorKey.RIPL_OWR,
+    (3, 0x08): SpeedEditorKey.PLACE_ON_TOP,
+    (3, 0x10): SpeedEditorKey.SRC_OWR,
+    (4, 0x01): SpeedEditorKey.CAM1,
+    (4, 0x02): SpeedEditorKey.CAM2,
+    (4, 0x04): SpeedEditorKey.CAM3,
+    (4, 0x08): SpeedEditorKey.CAM4,
+    (4, 0x10): SpeedEditorKey.CAM5,
+    (4, 0x20): SpeedEditorKey.CAM6,
+    (4, 0x40): SpeedEditorKey.CAM7,
+    (4, 0x80): SpeedEditorKey.CAM8,
+    (5, 0x01): SpeedEditorKey.CAM9,
+    (5, 0x02): SpeedEditorKey.LIVE_OWR,
+    (5, 0x04): SpeedEditorKey.VIDEO_ONLY,
+    (5, 0x08): SpeedEditorKey.AUDIO_ONLY,
+    (5, 0x10): SpeedEditorKey.STOP_PLAY,
+    (6, 0x01): SpeedEditorKey.IN,
+    (6, 0x02): SpeedEditorKey.OUT,
+    (6, 0x04): SpeedEditorKey.TRIM_IN,
+    (6, 0x08): SpeedEditorKey.TRIM_OUT,
+    (6, 0x10): SpeedEditorKey.ROLL,
+    (6, 0x20): SpeedEditorKey.SLIP_SRC,
+    (6, 0x40): SpeedEditorKey.SLIP_DEST,
+    (6, 0x80): BitmapKey.TRANS_DISS,
+    (7, 0x01): SpeedEditorKey.SNAP,
+    (7, 0x02): SpeedEditorKey.RIPL_DEL,
+}
+BITMAP_BYTES = 8
+
+
+def _transition_tables():
+    # For each bitmap byte, and each of the 256 possible sets of bits, the
+    # press and release events for the keys those bits represent.
+    presses = []
+    releases = []
+    for byte in range(BITMAP_BYTES + 1):
+        p = []
+        r = []
+        for bits in range(256):
+            keys = [
+                int(BITMAP_KEYS[(byte, 1 << b)])
+                for b in range(8)
+                if (bits & (1 << b)) and (byte, 1 << b) in BITMAP_KEYS
+            ]
+            p.append(tuple(PRESS[k] for k in keys))
+            r.append(tuple(RELEASE[k] for k in keys))
+        presses.append(tuple(p))
+        releases.append(tuple(r))
+    return tuple(presses), tuple(releases)
+
+
+_BITMAP_PRESSES, _BITMAP_RELEASES = _transition_tables()
+
+_keylist = struct.Struct("<6H")
+_jog = struct.Struct("<Bi")
+_unpack_keylist = _keylist.unpack_from
+
+
+class ReportDecoder:
+    """Decodes the reports from one device, tracking which keys are held.
+
+    Events come out in a fixed order: releases before presses, and within
+    each in report order (key list) or keycode order (bitmap).
+    """
+
+    def __init__(self):
+        self.held = 0
+        self.buffer = bytearray(64)
+        self.events = []
+        self._keys = (0,) * 6
+        self._bitmap = bytearray(BITMAP_BYTES + 1)
+
+    def readinto(self, dev):
+        """Reads the next report from `dev` into `buffer`; returns its length.
+
+        `dev` needs a readinto() method, like HidrawDevice.
+        """
+        return dev.readinto(self.buffer)
+
+    def held_keys(self):
+        """Returns the held keycodes in ascending order."""
+        h = self.held
+        return [k for k in range(h.bit_length()) if (h >> k) & 1]
+
+    def release_all(self):
+        """Forgets the held keys; returns the events releasing them."""
+        events = [
+            RELEASE[k] if k < NUM_KEYS else KeyEvent(k, False)
+            for k in self.held_keys()
+        ]
+        self.held = 0
+        self._keys = (0,) * 6
+        self._bitmap[:] = bytes(len(self._bitmap))
+        return events
+
+    def decode(self, report, length=None):
+        """Decodes `report`; returns the list of events.
+
+        The list is reused by the next call, so consume it first. `length`
+        defaults to len(report).
+        """
+        events = self.events
+        events.clear()
+        if length is None:
+            length = len(report)
+        if not length:
+            return events
+
+        report_id = report[0]
+        if report_id == REPORT_KEYS and length >= 13:
+            # The common case, so it's inline.
+            keys = _unpack_keylist(report, 1)
+            new = 0
+            for k in keys:
+                if k:
+                    new |= _BITS[k] if k < NUM_KEYS else 1 << k
+            if new != self.held:
+                self._keylist_changed(keys, new, events)
+            self._keys = keys
+        elif report_id == REPORT_JOG and length >= 6:
+            events.append(JogEvent(*_jog.unpack_from(report, 1)))
+        elif report_id == REPORT_BITMAP and length > BITMAP_BYTES:
+            self._decode_bitmap(report, events)
+        else:
+            events.append(UnknownReport(bytes(report[:length])))
+        return events
+
+    def _keylist_changed(self, keys, new, events):
+        held = self.held
+        for k in self._keys:
+            if k and not (new >> k) & 1:
+                if k < NUM_KEYS:
+                    events.append(RELEASE[k])
+                else:
+                    events.append(KeyEvent(k, False))
+        for k in keys:
+            if k and not (held >> k) & 1:
+                if k < NUM_KEYS:
+                    events.append(PRESS[k])
+                else:
+                    events.append(KeyEvent(k, True))
+        self.held = new
+
+    def _decode_bitmap(self, report, events):
+        old = self._bitmap
+        presses = _BITMAP_PRESSES
+        releases = _BITMAP_RELEASES
+        for i in range(1, BITMAP_BYTES + 1):
+            was = old[i]
+            now = report[i]
+            if was != now:
+                events.extend(releases[i][was & ~now])
+        for i in range(1, BITMAP_BYTES + 1):
+            was = old[i]
+            now = report[i]
+            if was != now:
+                events.extend(presses[i][now & ~was])
+                old[i] = now
+
+        held = self.held
+        for event in events:
+            if event.pressed:
+                held |= _BITS[event.key]
+            else:
+                held &= ~_BITS[event.key]
+        self.held = held
@@ -0,0 +1,548 @@
+#!/usr/bin/env python3
+"""
+A software Speed Editor.
+
+SpeedEditorEmulator models the panel: it runs the feature report 6
+handshake the way the hardware does, with a random challenge per handshake
+and the response checked with bmd_kbd_auth(), and sends report 4 key lists
+and report 3 jog deltas, at configurable rates and in bursts, only while it
+is unlocked. Unlocking lasts `lifetime` seconds, after which it goes quiet
+until it's authenticated again, and a handshake not finished within
+`handshake_timeout` seconds is refused.
+
+The drivers reach it through a transport with the hid.Device methods
+(read, write, send_feature_report, get_feature_report) as well as the
+HidrawDevice ones (fileno, readinto, read_nowait), so it can be passed
+anywhere a device can:
+
+    EmulatedDevice(emulator)   in the same process
+    SocketDevice(path)         from another process, connected to
+                               `python3 bmd_emulator.py serve PATH`
+
+Either way input reports arrive on a socket of their own, one report per
+packet, which can be waited on like a hidraw node, while feature and
+output reports take a separate path, as they do on the real device's
+control endpoint.
+
+    python3 bmd_emulator.py run --key-rate 1000 --jog-rate 1000 --seconds 5
+    python3 bmd_emulator.py serve /tmp/speed-editor.sock --jog-rate 100
+"""
+
+import argparse
+import errno
+import os
+import random
+import select
+import socket
+import struct
+import threading
+import time
+
+from bmd_auth import bmd_kbd_auth
+from bmd_protocol import (
+    OUTPUT_JOG_LEDS,
+    OUTPUT_JOG_MODE,
+    OUTPUT_LEDS,
+    REPORT_AUTH,
+    REPORT_JOG,
+    REPORT_KEYS,
+    SpeedEditorKey,
+)
+
+REPORT_SIZE = 64
+
+# Handshake states, named after the reply each one gives.
+_IDLE, _CHALLENGE, _HOST_RESPONSE, _STATUS = range(4)
+
+_KEYS = tuple(int(k) for k in SpeedEditorKey if k)
+_keylist = struct.Struct("<B6H")
+_jog = struct.Struct("<BBi")
+
+
+class SpeedEditorEmulator:
+    """The state of one emulated panel.
+
+    Reports are generated on a thread once start() is called:
+    `key_rate` key list reports (a press or a release each) and `jog_rate`
+    jog reports per second, plus every `burst_interval` seconds a burst of
+    `burst` reports of both kinds back to back. press(), release(), jog()
+    and send_report() send reports on demand. Reports the host isn't
+    reading fast enough for are dropped, as the kernel does, and counted in
+    `overflows`; those generated while locked are counted in `suppressed`.
+    """
+
+    def __init__(
+        self,
+        lifetime=60,
+        handshake_timeout=1.0,
+        key_rate=0,
+        jog_rate=0,
+        burst=0,
+        burst_interval=1.0,
+        jog_max=2048,
+        seed=None,
+    ):
+        self.lifetime = lifetime
+        self.handshake_timeout = handshake_timeout
+        self.key_rate = key_rate
+        self.jog_rate = jog_rate
+        self.burst = burst
+        self.burst_interval = burst_interval
+        self.jog_max = jog_max
+        self.rng = random.Random(seed)
+
+        self.handshakes = 0
+        self.auth_failures = 0
+        self.sent = 0
+        self.suppressed = 0
+        self.overflows = 0
+        self.outputs = 0
+        self.jog_mode = 0
+        self.leds = 0
+        self.jog_leds = 0
+        self.held = []
+        self.unlocked_until = 0.0
+
+        self._lock = threading.Lock()
+        self._state = _IDLE
+        self._challenge = None
+        self._challenge_time = None
+        self._status = 0
+        self._input = None
+        self._input_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    # --- Control endpoint ---
+
+    def set_feature(self, data):
+        data = bytes(data)
+        if not data or data[0] != REPORT_AUTH or len(data) < 2:
+            raise OSError(errno.EPIPE, "unsupported feature report")
+        with self._lock:
+            step = data[1]
+            now = time.monotonic()
+            if step == 0x00:
+                self._challenge = self.rng.getrandbits(64)
+                self._challenge_time = now
+                self._state = _CHALLENGE
+            elif step == 0x01 and self._challenge is not None:
+                self._state = _HOST_RESPONSE
+            elif step == 0x03 and self._challenge is not None:
+                response = int.from_bytes(data[2:10], "little")
+                late = now - self._challenge_time > self.handshake_timeout
+                if late or response != bmd_kbd_auth(self._challenge):
+                    self.auth_failures += 1
+                    self._status = 0
+                else:
+                    self.handshakes += 1
+                    self._status = self.lifetime
+                    self.unlocked_until = now + self.lifetime
+                self._challenge = None
+                self._state = _STATUS
+            else:
+                raise OSError(errno.EPIPE, "unexpected handshake step")
+        return len(data)
+
+    def get_feature(self, report_id, size):
+        if report_id != REPORT_AUTH:
+            raise OSError(errno.EPIPE, "unsupported feature report")
+        with self._lock:
+            if self._state == _CHALLENGE:
+                reply = b"\x06\x00" + self._challenge.to_bytes(8, "little")
+            elif self._state == _HOST_RESPONSE:
+                # The panel's answer to the host's challenge, which the
+                # drivers don't check.
+                reply = b"\x06\x02" + self.rng.getrandbits(64).to_bytes(8, "little")
+            elif self._state == _STATUS:
+                reply = b"\x06\x04" + self._status.to_bytes(2, "little") + bytes(6)
+            else:
+                raise OSError(errno.EPIPE, "no handshake in progress")
+        return reply[:size]
+
+    def output(self, data):
+        data = bytes(data)
+        self.outputs += 1
+        if len(data) >= 2 and data[0] == OUTPUT_JOG_MODE:
+            self.jog_mode = data[1]
+        elif len(data) >= 5 and data[0] == OUTPUT_LEDS:
+            self.leds = int.from_bytes(data[1:5], "little")
+        elif len(data) >= 2 and data[0] == OUTPUT_JOG_LEDS:
+            self.jog_leds = data[1]
+        return len(data)
+
+    def unlocked(self):
+        return time.monotonic() < self.unlocked_until
+
+    # --- Interrupt endpoint ---
+
+    def attach(self, sock):
+        """Sends input reports to `sock` from now on."""
+        sock.setblocking(False)
+        with self._input_lock:
+            if self._input is not None:
+                self._input.close()
+            self._input = sock
+
+    def send_report(self, report):
+        """Sends a raw input report, as long as the panel is unlocked."""
+        with self._input_lock:
+            self._send(report)
+
+    def _send(self, report):
+        # Called with _input_lock held.
+        if not self.unlocked():
+            self.suppressed += 1
+            return
+        sock = self._input
+        if sock is None:
+            return
+        try:
+            sock.send(report)
+            self.sent += 1
+        except BlockingIOError:
+            self.overflows += 1
+        except OSError:
+            # The host has gone.
+            self._input = None
+
+    def _send_keys(self):
+        keys = self.held + [0] * (6 - len(self.held))
+        report = _keylist.pack(REPORT_KEYS, *keys)
+        self._send(report + bytes(REPORT_SIZE - len(report)))
+
+    def press(self, *keys):
+        with self._input_lock:
+            for k in keys:
+                if int(k) not in self.held and len(self.held) < 6:
+                    self.held.append(int(k))
+            self._send_keys()
+
+    def release(self, *keys):
+        """Releases `keys`, or every key if none are given."""
+        with self._input_lock:
+            if keys:
+                released = set(map(int, keys))
+                self.held = [k for k in self.held if k not in released]
+            else:
+                self.held = []
+            self._send_keys()
+
+    def jog(self, delta):
+        report = _jog.pack(REPORT_JOG, self.jog_mode, delta)
+        with self._input_lock:
+            self._send(report + bytes(REPORT_SIZE - len(report)))
+
+    def random_key_report(self):
+        rng = self.rng
+        if self.held and (len(self.held) == 6 or rng.random() < 0.5):
+            self.release(rng.choice(self.held))
+        else:
+            self.press(rng.choice(_KEYS))
+
+    def random_jog_report(self):
+        delta = self.rng.randint(-self.jog_max, self.jog_max)
+        self.jog(delta or 1)
+
+    # --- Traffic ---
+
+    def start(self):
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="SpeedEditorEmulator", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        streams = []
+        if self.key_rate:
+            streams.append([1 / self.key_rate, self.random_key_report])
+        if self.jog_rate:
+            streams.append([1 / self.jog_rate, self.random_jog_report])
+        if self.burst:
+            streams.append([self.burst_interval, self._send_burst])
+        if not streams:
+            return
+        now = time.monotonic()
+        # [due, interval, generate]
+        due = [[now + interval, interval, gen] for interval, gen in streams]
+        while True:
+            nxt = min(due, key=lambda d: d[0])
+            delay = nxt[0] - time.monotonic()
+            if delay > 0 and self._stopping.wait(delay):
+                return
+            if self._stopping.is_set():
+                return
+            nxt[2]()
+            # Fixed schedule, so that a late report doesn't lower the rate,
+            # but don't try to catch up on more than a second.
+            nxt[0] = max(nxt[0] + nxt[1], time.monotonic() - 1.0)
+
+    def _send_burst(self):
+        for i in range(self.burst):
+            if i % 2:
+                self.random_jog_report()
+            else:
+                self.random_key_report()
+
+
+class _InputSocket:
+    # The input side of a transport: one report per packet on `_input`.
+
+    def fileno(self):
+        return self._input.fileno()
+
+    def read_nowait(self, size=REPORT_SIZE):
+        try:
+            data = self._input.recv(size)
+        except BlockingIOError:
+            return None
+        if not data:
+            raise OSError(errno.ENODEV, "emulator disconnected")
+        return data
+
+    def readinto(self, buf):
+        try:
+            n = self._input.recv_into(buf)
+        except BlockingIOError:
+            return 0
+        if not n:
+            raise OSError(errno.ENODEV, "emulator disconnected")
+        return n
+
+    def read(self, size, timeout=None):
+        """Reads a report, waiting up to `timeout` ms; b"" on timeout."""
+        while True:
+            report = self.read_nowait(size)
+            if report is not None:
+                return report
+            r, _, _ = select.select(
+                [self._input], [], [], None if timeout is None else timeout / 1000
+            )
+            if not r:
+                return b""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class EmulatedDevice(_InputSocket):
+    """A transport to an emulator in the same process."""
+
+    def __init__(self, emulator):
+        self.emulator = emulator
+        self._input, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self._input.setblocking(False)
+        emulator.attach(theirs)
+
+    def send_feature_report(self, data):
+        return self.emulator.set_feature(data)
+
+    def get_feature_report(self, report_id, size):
+        return self.emulator.get_feature(report_id, size)
+
+    def write(self, data):
+        return self.emulator.output(data)
+
+    def close(self):
+        self._input.close()
+
+
+# Control messages between SocketDevice and serve(): a tag byte and the
+# payload. Replies start with b"+" and the result, or b"-" and an errno.
+_SET, _GET, _WRITE = b"S", b"G", b"W"
+_get = struct.Struct("<BH")
+_result = struct.Struct("<i")
+
+
+class SocketDevice(_InputSocket):
+    """A transport to an emulator served at the Unix socket `path`."""
+
+    def __init__(self, path):
+        self._control = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        try:
+            self._control.connect(path)
+            _, fds, _, _ = socket.recv_fds(self._control, 16, 1)
+        except OSError:
+            self._control.close()
+            raise
+        if not fds:
+            self._control.close()
+            raise OSError(errno.EPROTO, "no input socket from emulator")
+        self._input = socket.socket(fileno=fds[0])
+        self._input.setblocking(False)
+        self._lock = threading.Lock()
+
+    def _call(self, message):
+        # Feature reports come from the reader and re-authentication
+        # threads alike; keep each request with its reply.
+        with self._lock:
+            self._control.send(message)
+            reply = self._control.recv(REPORT_SIZE + 1)
+        if not reply:
+            raise OSError(errno.ENODEV, "emulator disconnected")
+        if reply[:1] == b"-":
+            e = _result.unpack_from(reply, 1)[0]
+            raise OSError(e, os.strerror(e))
+        return reply[1:]
+
+    def send_feature_report(self, data):
+        return _result.unpack(self._call(_SET + bytes(data)))[0]
+
+    def get_feature_report(self, report_id, size):
+        return self._call(_GET + _get.pack(report_id, size))
+
+    def write(self, data):
+        return _result.unpack(self._call(_WRITE + bytes(data)))[0]
+
+    def close(self):
+        self._input.close()
+        self._control.close()
+
+
+def _handle(emulator, conn):
+    try:
+        while True:
+            message = conn.recv(REPORT_SIZE + 8)
+            if not message:
+                return
+            tag, payload = message[:1], message[1:]
+            try:
+                if tag == _SET:
+                    reply = _result.pack(emulator.set_feature(payload))
+                elif tag == _GET:
+                    reply = emulator.get_feature(*_get.unpack(payload))
+                elif tag == _WRITE:
+                    reply = _result.pack(emulator.output(payload))
+                else:
+                    raise OSError(errno.EINVAL, "unknown request")
+            except OSError as e:
+                conn.send(b"-" + _result.pack(e.errno))
+            else:
+                conn.send(b"+" + reply)
+    except OSError:
+        pass
+    finally:
+        conn.close()
+
+
+def serve(emulator, path):
+    """Serves `emulator` at the Unix socket `path`, one host at a time."""
+    if os.path.exists(path):
+        os.unlink(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    server.bind(path)
+    server.listen(1)
+    try:
+        while True:
+            conn, _ = server.accept()
+            ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            try:
+                socket.send_fds(conn, [b"I"], [theirs.fileno()])
+            finally:
+                theirs.close()
+            emulator.attach(ours)
+            _handle(emulator, conn)
+    finally:
+        server.close()
+        os.unlink(path)
+
+
+def _run(args, emulator):
+    # The synchronous driver pipeline, with a null output.
+    from bmd_decode import ReportDecoder
+    from bmd_keymap import KeyResolver, compile_keymap, load_keymap
+    from bmd_macro import MacroRunner
+    from bmd_output import Injector
+    from bmd_protocol import authenticate
+    from bmd_reader import HidReader
+    from bmd_reauth import ReauthScheduler
+
+    dev = EmulatedDevice(emulator)
+    start = time.perf_counter()
+    status = authenticate(dev)
+    print(f"Authenticated in {(time.perf_counter() - start) * 1e3:.2f} ms, status {status}")
+    reauth = ReauthScheduler(lambda: authenticate(dev))
+    reauth.start(status)
+
+    runner = MacroRunner(Injector(), maxsize=1 << 16).start()
+    keymap = compile_keymap(load_keymap(args.keymap) if args.keymap else {}, runner)
+    decoder = ReportDecoder()
+    resolver = KeyResolver()
+    reader = HidReader(dev, maxsize=4096, timeout_ms=100).start()
+    emulator.start()
+
+    reports = events = 0
+    deadline = time.monotonic() + args.seconds
+    while time.monotonic() < deadline:
+        report = reader.get(timeout=0.1)
+        if not report:
+            continue
+        reports += 1
+        events += len(decoder.decode(report))
+        # Keys are resolved as custom_bmd does, with layers and chords.
+        for action, label in resolver.update(keymap, decoder.held):
+            action()
+
+    emulator.stop()
+    reader.stop()
+    reauth.stop()
+    runner.close()
+    dev.close()
+    print(
+        f"{reports} reports ({reports / args.seconds:.0f}/s), {events} events;"
+        f" emulator sent {emulator.sent}, overflowed {emulator.overflows},"
+        f" suppressed {emulator.suppressed}; reader dropped {reader.dropped};"
+        f" {emulator.handshakes} handshakes, {emulator.auth_failures} failed"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("run", help="drive the pipeline in this process")
+    run.add_argument("--seconds", type=float, default=5.0)
+    run.add_argument("--keymap", help="JSON keymap to dispatch through")
+    srv = sub.add_parser("serve", help="serve an emulator on a Unix socket")
+    srv.add_argument("path")
+    for p in (run, srv):
+        p.add_argument("--key-rate", type=float, default=20)
+        p.add_argument("--jog-rate", type=float, default=100)
+        p.add_argument("--burst", type=int, default=0)
+        p.add_argument("--burst-interval", type=float, default=1.0)
+        p.add_argument("--lifetime", type=int, default=60)
+        p.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    emulator = SpeedEditorEmulator(
+        lifetime=args.lifetime,
+        key_rate=args.key_rate,
+        jog_rate=args.jog_rate,
+        burst=args.burst,
+        burst_interval=args.burst_interval,
+        seed=args.seed,
+    )
+    if args.command == "run":
+        _run(args, emulator)
+        return
+    emulator.start()
+    try:
+        serve(emulator, args.path)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Drives every attached Blackmagic panel from one process.
+
+Fleet finds each hidraw node belonging to a Blackmagic device (VID 0x1edb)
+that declares the feature report 6 authentication interface, authenticates
+them all concurrently, and then runs one task per device delivering that
+device's events to a handler along with its own keymap. Devices are
+independent: one that is slow to authenticate, or wedged entirely, is
+timed out and set aside without delaying the others.
+"""
+
+import asyncio
+import inspect
+import sys
+
+from bmd_async import AsyncSpeedEditor
+from bmd_hidraw import enumerate_hidraw
+from bmd_protocol import REPORT_AUTH, USB_VID, KeyEvent, keycode_name
+from bmd_reauth import AsyncReauthScheduler
+
+
+def is_panel(info):
+    """Returns true if `info` is a Blackmagic panel's control interface."""
+    return info.vendor_id == USB_VID and REPORT_AUTH in info.feature_reports
+
+
+def enumerate_panels(**kwargs):
+    """Lists the control interfaces of all attached Blackmagic panels."""
+    return [
+        info
+        for info in enumerate_hidraw(vendor_id=USB_VID, **kwargs)
+        if is_panel(info)
+    ]
+
+
+class FleetDevice:
+    """One panel in the fleet."""
+
+    def __init__(self, info, keymap):
+        self.info = info
+        self.keymap = keymap
+        self.editor = None
+        self.status = None
+        self.reauth = None
+        self.error = None
+        self.handler_errors = 0
+
+    @property
+    def name(self):
+        return self.info.serial or self.info.path
+
+    def __repr__(self):
+        return f"<FleetDevice {self.name}>"
+
+
+class Fleet:
+    """Manages a set of panels.
+
+    `keymaps` maps a device's serial number or hidraw path to its keymap;
+    devices not listed get `default_keymap`. `handler(device, event)` is
+    called for every event and may be a coroutine function; it runs in the
+    device's own task, so a handler that takes its time only holds up the
+    device it was called for; an exception it raises is reported and
+    counted in the device's `handler_errors`, and the device carries on.
+    Each device's authentication is renewed in the background while it
+    runs.
+    """
+
+    def __init__(
+        self, handler, keymaps=None, default_keymap=None, auth_timeout=2.0
+    ):
+        self.handler = handler
+        self.keymaps = keymaps or {}
+        self.default_keymap = default_keymap
+        self.auth_timeout = auth_timeout
+        self.devices = []
+        self.failed = []
+
+    def keymap_for(self, info):
+        for k in (info.serial, info.path):
+            if k in self.keymaps:
+                return self.keymaps[k]
+        return self.default_keymap
+
+    async def _connect(self, device):
+        try:
+            device.editor = AsyncSpeedEditor(device.info.path)
+            device.status = await asyncio.wait_for(
+                device.editor.authenticate(), self.auth_timeout
+            )
+            return True
+        except (OSError, RuntimeError, asyncio.TimeoutError) as e:
+            device.error = e
+            if device.editor:
+                device.editor.close()
+            return False
+
+    async def _pump(self, device):
+        is_async = inspect.iscoroutinefunction(self.handler)
+        device.reauth = AsyncReauthScheduler(device.editor)
+        device.reauth.start(device.status)
+        try:
+            async for event in device.editor.events():
+                try:
+                    if is_async:
+                        await self.handler(device, event)
+                    else:
+                        self.handler(device, event)
+                except Exception as e:
+                    device.handler_errors += 1
+                    print(
+                        f"{device.name}: handler failed on {event!r}: {e!r}",
+                        file=sys.stderr,
+                    )
+        except OSError as e:
+            device.error = e
+        finally:
+            device.reauth.stop()
+            device.editor.close()
+
+    async def connect(self, infos=None):
+        """Opens and authenticates all panels concurrently.
+
+        Returns the devices which authenticated; the ones that didn't are
+        left in `failed` with their `error` set.
+        """
+        if infos is None:
+            infos = enumerate_panels()
+        devices = [FleetDevice(i, self.keymap_for(i)) for i in infos]
+        ok = await asyncio.gather(*[self._connect(d) for d in devices])
+        self.devices = [d for d, good in zip(devices, ok) if good]
+        self.failed = [d for d, good in zip(devices, ok) if not good]
+        return self.devices
+
+    async def run(self):
+        """Delivers events from every connected device until all are gone."""
+        await asyncio.gather(*[self._pump(d) for d in self.devices])
+
+    def close(self):
+        for d in self.devices:
+            d.editor.close()
+
+
+def _print_event(device, event):
+    if isinstance(event, KeyEvent):
+        key = keycode_name(event.key)
+        action = (device.keymap or {}).get(key)
+        state = "down" if event.pressed else "up"
+        print(f"{device.name}: {key} {state} -> {action}")
+    else:
+        print(f"{device.name}: {event}")
+
+
+async def _main():
+    fleet = Fleet(_print_event)
+    await fleet.connect()
+    for d in fleet.failed:
+        print(f"{d.name}: failed: {d.error!r}", file=sys.stderr)
+    for d in fleet.devices:
+        print(f"{d.name}: {d.info.name} authenticated, status {d.status}")
+    if not fleet.devices:
+        sys.exit("No Blackmagic panels found.")
+    try:
+        await fleet.run()
+    finally:
+        fleet.close()
+
+
+def main():
+    try:
+        asyncio.run(_main())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+The opening handshake, timed, with retries.
+
+The handshake (bmd_protocol.authenticate) is three feature report round
+trips, and the device answers each one as soon as it has the answer, so
+nothing here waits for a fixed time: a handshake that works takes as long
+as those round trips and no longer. Only a real failure, an error from the
+transport or an answer out of sequence, is retried, after a delay that
+starts at `retry` seconds and doubles up to `max_retry`:
+
+    handshake = Handshake(lambda: authenticate(dev))
+    status = handshake.run()
+    for report in reader:
+        handshake.event()
+        ...
+
+`authenticated` and `first_event` are the seconds from run() being called
+to the device being unlocked and to its first input report; `attempts`
+records every try.
+"""
+
+import time
+from collections import namedtuple
+
+from bmd_protocol import authenticate
+
+# What a failed handshake raises, from the transport or from authenticate().
+RETRYABLE = (OSError, RuntimeError)
+
+# `start` is a time.monotonic() value, `duration` is in seconds and `error`
+# is None for the attempt that succeeded.
+Attempt = namedtuple("Attempt", "start duration error")
+
+
+class Handshake:
+    """Runs `authenticate()`, which returns the status word, until it works
+    or `max_attempts` have failed.
+
+    `errors` are the exceptions that count as a failed attempt; anything
+    else is raised at once. `metrics`, an AuthMetrics, records the
+    successful handshake and the failures, as the renewals later do.
+    """
+
+    def __init__(
+        self,
+        authenticate,
+        max_attempts=5,
+        retry=0.01,
+        max_retry=0.5,
+        errors=RETRYABLE,
+        metrics=None,
+    ):
+        if max_attempts < 1:
+            raise ValueError(f"max_attempts must be at least 1, not {max_attempts}")
+        self.authenticate = authenticate
+        self.max_attempts = max_attempts
+        self.retry = retry
+        self.max_retry = max_retry
+        self.errors = errors
+        self.metrics = metrics
+        self.started = None
+        self.authenticated = None
+        self.first_event = None
+        self.attempts = []
+
+    @classmethod
+    def for_device(cls, dev, **kwargs):
+        """A Handshake with the Speed Editor transport `dev`."""
+        return cls(lambda: authenticate(dev), **kwargs)
+
+    def run(self):
+        """Returns the status word; raises the last error if every attempt
+        failed."""
+        self.started = time.monotonic()
+        delay = self.retry
+        for n in range(self.max_attempts):
+            if n:
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_retry)
+            start = time.monotonic()
+            try:
+                status = self.authenticate()
+            except self.errors as e:
+                error = e
+                self.attempts.append(Attempt(start, time.monotonic() - start, e))
+                if self.metrics is not None:
+                    self.metrics.failures += 1
+                    self.metrics.last_error = e
+                continue
+            end = time.monotonic()
+            self.attempts.append(Attempt(start, end - start, None))
+            self.authenticated = end - self.started
+            if self.metrics is not None:
+                self.metrics.record(start, end, status)
+            return status
+        raise error
+
+    def event(self, now=None):
+        """Notes an input report; the first after run() sets
+        `first_event`."""
+        if self.first_event is None and self.authenticated is not None:
+            self.first_event = (now or time.monotonic()) - self.started
+
+    def summary(self):
+        """Describes the timings in one line, for the diagnostic scripts."""
+        failed = len(self.attempts) - (self.authenticated is not None)
+        text = f"{len(self.attempts)} attempt(s), {failed} failed"
+        if self.authenticated is not None:
+            text += f"; authenticated after {self.authenticated * 1000:.1f} ms"
+        if self.first_event is not None:
+            text += f", first event after {self.first_event * 1000:.1f} ms"
+        return text
@@ -0,0 +1,276 @@
+"""
+Direct access to Linux hidraw nodes.
+
+HidrawDevice offers the same read/write/feature report methods as the `hid`
+package's hid.Device, so it can be passed to bmd_protocol.authenticate(),
+but it also exposes the file descriptor so that an event loop can wait on
+it.
+
+enumerate_hidraw() lists the hidraw nodes from sysfs, without going through
+hidapi's full bus scan, and find_hidraw() skips even that when the node it
+found last time still matches.
+"""
+
+import fcntl
+import os
+import select
+from collections import namedtuple
+
+SYSFS_HIDRAW = "/sys/class/hidraw"
+CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "speed-editor",
+)
+
+_IOC_WRITE = 1
+_IOC_READ = 2
+
+
+def _ioc(dir, nr, size):
+    return (dir << 30) | (size << 16) | (ord("H") << 8) | nr
+
+
+def HIDIOCSFEATURE(size):
+    return _ioc(_IOC_WRITE | _IOC_READ, 0x06, size)
+
+
+def HIDIOCGFEATURE(size):
+    return _ioc(_IOC_WRITE | _IOC_READ, 0x07, size)
+
+
+class HidrawDevice:
+    """An open /dev/hidrawN node.
+
+    The descriptor is non-blocking; read() with a timeout waits for it with
+    select().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_NONBLOCK | os.O_CLOEXEC)
+
+    def fileno(self):
+        return self.fd
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def send_feature_report(self, data):
+        buf = bytearray(data)
+        return fcntl.ioctl(self.fd, HIDIOCSFEATURE(len(buf)), buf, True)
+
+    def get_feature_report(self, report_id, size):
+        buf = bytearray(size)
+        buf[0] = report_id
+        n = fcntl.ioctl(self.fd, HIDIOCGFEATURE(size), buf, True)
+        return bytes(buf[:n])
+
+    def write(self, data):
+        return os.write(self.fd, data)
+
+    def read_nowait(self, size=64):
+        """Returns the next queued report, or None if there isn't one."""
+        try:
+            return os.read(self.fd, size)
+        except BlockingIOError:
+            return None
+
+    def readinto(self, buf):
+        """Reads the next queued report into buf; returns its length or 0."""
+        try:
+            return os.readv(self.fd, [buf])
+        except BlockingIOError:
+            return 0
+
+    def read(self, size, timeout=None):
+        """Reads a report, waiting up to `timeout` ms (None means forever).
+
+        Returns b"" on timeout, like hid.Device.read().
+        """
+        while True:
+            report = self.read_nowait(size)
+            if report is not None:
+                return report
+            r, _, _ = select.select(
+                [self.fd], [], [], None if timeout is None else timeout / 1000
+            )
+            if not r:
+                return b""
+
+
+HidrawInfo = namedtuple(
+    "HidrawInfo",
+    "path vendor_id product_id name serial feature_reports usage_page",
+)
+
+
+def _descriptor_items(desc):
+    i = 0
+    while i < len(desc):
+        prefix = desc[i]
+        if prefix == 0xfe:
+            # Long item: the data size is in the next byte.
+            i += 3 + desc[i + 1]
+            continue
+        size = (0, 1, 2, 4)[prefix & 3]
+        value = int.from_bytes(desc[i + 1 : i + 1 + size], "little")
+        yield prefix & 0xfc, value
+        i += 1 + size
+
+
+def feature_report_ids(desc):
+    """Returns the feature report IDs declared in a report descriptor."""
+    ids = set()
+    report_id = 0
+    for tag, value in _descriptor_items(desc):
+        if tag == 0x84:  # Report ID
+            report_id = value
+        elif tag == 0xb0:  # Feature
+            ids.add(report_id)
+    return frozenset(ids)
+
+
+def descriptor_usage_page(desc):
+    """Returns the first usage page in a report descriptor, which is the
+    one hidapi reports for the interface; None if there isn't one."""
+    for tag, value in _descriptor_items(desc):
+        if tag == 0x04:  # Usage Page
+            return value
+    return None
+
+
+def _read_uevent(path):
+    fields = {}
+    with open(path) as fp:
+        for line in fp:
+            k, _, v = line.rstrip("\n").partition("=")
+            fields[k] = v
+    return fields
+
+
+def hidraw_info(
+    name,
+    sysfs=SYSFS_HIDRAW,
+    devdir="/dev",
+    vendor_id=None,
+    product_id=None,
+    usage_page=None,
+):
+    """Describes the hidraw node `name` (e.g. "hidraw3") from sysfs.
+
+    Returns None if it doesn't exist (or has already gone away), or doesn't
+    match the IDs and usage page given. The report descriptor is only read
+    for nodes whose IDs match.
+    """
+    devpath = os.path.join(sysfs, name, "device")
+    try:
+        uevent = _read_uevent(os.path.join(devpath, "uevent"))
+        # HID_ID is bus:vendor:product, in hex.
+        _, vid, pid = uevent["HID_ID"].split(":")
+        vid = int(vid, 16)
+        pid = int(pid, 16)
+        if vendor_id is not None and vid != vendor_id:
+            return None
+        if product_id is not None and pid != product_id:
+            return None
+        with open(os.path.join(devpath, "report_descriptor"), "rb") as fp:
+            desc = fp.read()
+    except (OSError, KeyError, ValueError):
+        return None
+
+    page = descriptor_usage_page(desc)
+    if usage_page is not None and page != usage_page:
+        return None
+    return HidrawInfo(
+        path=os.path.join(devdir, name),
+        vendor_id=vid,
+        product_id=pid,
+        name=uevent.get("HID_NAME", ""),
+        serial=uevent.get("HID_UNIQ", ""),
+        feature_reports=feature_report_ids(desc),
+        usage_page=page,
+    )
+
+
+def enumerate_hidraw(
+    vendor_id=None,
+    product_id=None,
+    usage_page=None,
+    sysfs=SYSFS_HIDRAW,
+    devdir="/dev",
+):
+    """Lists hidraw nodes, optionally filtered by USB vendor and product ID
+    and usage page."""
+    try:
+        names = sorted(os.listdir(sysfs), key=lambda n: (len(n), n))
+    except FileNotFoundError:
+        return []
+
+    results = []
+    for name in names:
+        info = hidraw_info(
+            name, sysfs, devdir, vendor_id, product_id, usage_page
+        )
+        if info:
+            results.append(info)
+    return results
+
+
+def find_hidraw(
+    vendor_id=None,
+    product_id=None,
+    usage_page=None,
+    cache=None,
+    sysfs=SYSFS_HIDRAW,
+    devdir="/dev",
+):
+    """Returns the first hidraw node matching the filters, or None.
+
+    `cache` is the path of a file remembering the node found last time. If
+    sysfs says that node still matches, it's returned without listing the
+    others; otherwise they are listed and the file updated.
+    """
+    if cache:
+        try:
+            with open(cache) as fp:
+                name = fp.read().strip()
+        except OSError:
+            name = None
+        if name and "/" not in name:
+            info = hidraw_info(
+                name, sysfs, devdir, vendor_id, product_id, usage_page
+            )
+            if info:
+                return info
+
+    found = enumerate_hidraw(vendor_id, product_id, usage_page, sysfs, devdir)
+    if not found:
+        return None
+    if cache:
+        _write_cache(cache, os.path.basename(found[0].path))
+    return found[0]
+
+
+def _write_cache(path, name):
+    # Written to a temporary file and renamed, as other processes starting at
+    # the same time may be reading it. A cache that can't be written just
+    # means a full scan next time.
+    tmp = f"{path}.{os.getpid()}"
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(tmp, "w") as fp:
+            fp.write(name + "\n")
+        os.replace(tmp, path)
+    except OSError:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
@@ -0,0 +1,94 @@
+"""
+Jog wheel to scroll conversion.
+
+This is the wheel accumulator from main.cc: report 3 deltas are summed, and
+every WHEEL_STEP units of movement is one scroll step. The difference is
+that all the steps a report produces come out as one signed count, so the
+output side can send them as one batch and flush once, where main.cc does
+an XSync'd button press and release per step.
+
+Optionally the deltas can be scaled up when the wheel is spun quickly. The
+scaling is done in fixed point and the part of the movement that doesn't
+make up a whole step is carried over exactly, so slow movements never lose
+ticks however they are split between reports.
+"""
+
+import time
+from collections import namedtuple
+
+WHEEL_STEP = 30000
+
+# Gains are applied in units of 1/GAIN_ONE.
+GAIN_ONE = 256
+
+# Velocities are in wheel units per second. Below `threshold` the gain is
+# 1; above it the gain rises by `factor` for every further `threshold` of
+# speed, up to `max_gain`.
+Acceleration = namedtuple("Acceleration", "threshold factor max_gain")
+
+DEFAULT_ACCELERATION = Acceleration(
+    threshold=300_000, factor=0.5, max_gain=4.0
+)
+
+# Deltas further apart than this (in seconds) are treated as separate
+# movements, not as a slow spin.
+IDLE_TIME = 0.25
+
+
+class JogEngine:
+    """Turns jog deltas into scroll steps.
+
+    feed() returns the number of steps for one report: positive is down
+    (X button 5), negative is up (button 4), which is how main.cc maps the
+    wheel. If `scroll` is given, it's also called with each non-zero count.
+    """
+
+    def __init__(self, step=WHEEL_STEP, acceleration=None, scroll=None):
+        self.step = step
+        self.acceleration = acceleration
+        self.scroll = scroll
+        self.steps = 0
+        self.flushes = 0
+        self._remainder = 0
+        self._last_time = None
+
+    def _gain(self, delta, now):
+        a = self.acceleration
+        last = self._last_time
+        self._last_time = now
+        if a is None or last is None:
+            return GAIN_ONE
+        dt = now - last
+        if dt > IDLE_TIME:
+            return GAIN_ONE
+        velocity = abs(delta) / max(dt, 0.001)
+        if velocity <= a.threshold:
+            return GAIN_ONE
+        gain = 1 + a.factor * (velocity - a.threshold) / a.threshold
+        return int(min(gain, a.max_gain) * GAIN_ONE)
+
+    def feed(self, delta, now=None):
+        """Accumulates one report's delta; returns the steps to scroll."""
+        if now is None:
+            now = time.monotonic()
+        total = self._remainder + delta * self._gain(delta, now)
+
+        # Truncate towards zero, so that the remainder keeps the sign of the
+        # movement, as main.cc does.
+        unit = self.step * GAIN_ONE
+        steps = abs(total) // unit
+        if total < 0:
+            steps = -steps
+        self._remainder = total - steps * unit
+
+        if steps:
+            self.steps += abs(steps)
+            self.flushes += 1
+            if self.scroll:
+                self.scroll(steps)
+        return steps
+
+    def reset(self):
+        """Discards any partial step, e.g. when the jog mode changes."""
+        self._remainder = 0
+        self._last_time = None
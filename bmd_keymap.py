@@ -0,0 +1,506 @@
+"""
+Keymap loading and compilation.
+
+A keymap maps Speed Editor key names (see SpeedEditorKey) to actions, in
+the format of custom_bmd.KEY_MAP:
+
+    {"SMART_INSRT": {"type": "key", "action": "f5"},
+     "CLOSE_UP": {"type": "combo", "action": ["ctrl", "c"]}, ...}
+
+It can be a dict in Python, with pynput Key and Button objects as actions,
+or a JSON file with their names instead. Besides those four types there
+are macros, a list of steps (see bmd_macro.STEP_TYPES):
+
+    "APPND": {"type": "macro", "action": [{"down": "ctrl"}, {"text": "s"},
+              {"up": "ctrl"}, {"delay": 0.5}, {"click": "left"}]}
+
+and any action may have a "key_delay", in seconds, to send its keys one at
+a time rather than all at once.
+
+Two more entries add layers and chords:
+
+    "layers": {"SOURCE": {"CAM1": {...}, "CAM2": {...}}},
+    "chords": {"IN+OUT": {...}}
+
+While a layer key is held, the keys its layer maps do that instead (the
+rest keep their usual actions); the layer key itself does nothing. A chord
+is two keys held together, and fires instead of either key's own action.
+
+compile_keymap() checks the whole keymap up front and turns each layer into
+a tuple indexed by raw keycode, each entry either None or a callable that
+submits the key's macro to a MacroRunner, so a keypress costs one index
+and one call. The layers are looked up by the held layer keys' bitset and
+chords by the bitset of their two keys, and KeyResolver applies them to the
+held keys after each report; see it for how presses in the same report are
+ordered. KeymapWatcher recompiles the file whenever it changes and
+swaps the new table in with a single assignment; a file that doesn't
+validate is reported and the old table stays in use.
+"""
+
+import functools
+import json
+import numbers
+import os
+import select
+import threading
+from collections import namedtuple
+
+from bmd_decode import NUM_KEYS
+from bmd_inotify import IN_CLOSE_WRITE, IN_MOVED_TO, Inotify
+from bmd_macro import STEP_TYPES, steps_for
+from bmd_output import (
+    KEY_NAMES,
+    MOUSE_BUTTONS,
+    button_name,
+    key_name,
+    keymap_keys,
+)
+from bmd_protocol import SpeedEditorKey
+
+ACTION_TYPES = ("key", "string", "mouse_click", "combo", "macro")
+
+# Each held layer key doubles the number of tables.
+MAX_LAYERS = 8
+
+_ALL_KEYS = (1 << NUM_KEYS) - 1
+
+# `actions` and `labels` are indexed by keycode; `keys` is the bitset of the
+# keys the layer itself maps, and `name` the layer key's name (None for the
+# base layer).
+Layer = namedtuple("Layer", "actions labels keys name")
+
+# `actions` and `labels` are the base layer's. `layers` maps every
+# combination of held layer keys (held & layer_mask) to the Layer in effect;
+# `chords` maps the bitset of a chord's two keys to an (action, label) pair,
+# `chord_keys` is the bitset of every key in a chord and `chord_partners`
+# the keys each keycode forms a chord with. `keymap` is the validated
+# keymap they were compiled from, with names in place of pynput objects.
+CompiledKeymap = namedtuple(
+    "CompiledKeymap",
+    "actions labels keymap layers layer_mask chords chord_keys chord_partners",
+)
+
+
+class KeymapError(ValueError):
+    """A keymap failed validation; `problems` lists everything wrong."""
+
+    def __init__(self, problems, path=None):
+        self.problems = problems
+        self.path = path
+        where = f"{path}: " if path else ""
+        super().__init__(where + "; ".join(problems))
+
+
+def _check_key(name, problems, where):
+    if not isinstance(name, str) or (
+        len(name) != 1 and name not in KEY_NAMES
+    ):
+        problems.append(f"{where}: unknown key {name!r}")
+
+
+def _check_delay(value, problems, where):
+    if (
+        not isinstance(value, numbers.Real)
+        or isinstance(value, bool)
+        or not 0 <= value <= 60
+    ):
+        problems.append(f"{where}: {value!r} is not a delay in seconds")
+
+
+def _step_names(step):
+    # Key and Button objects in macro steps become names, like elsewhere.
+    if not isinstance(step, dict):
+        return step
+    return {kind: key_name(value) for kind, value in step.items()}
+
+
+def _check_macro(action, problems, where):
+    if not isinstance(action, (list, tuple)) or not action:
+        problems.append(f"{where}: macro action must be a list of steps")
+        return
+    for step in action:
+        if not isinstance(step, dict) or len(step) != 1:
+            problems.append(f"{where}: macro step {step!r} must have one entry")
+            continue
+        ((kind, value),) = step.items()
+        if kind in ("down", "up"):
+            _check_key(value, problems, where)
+        elif kind == "text":
+            if not isinstance(value, str):
+                problems.append(f"{where}: text step must be text")
+        elif kind == "delay":
+            _check_delay(value, problems, where)
+        elif kind == "click":
+            if value not in MOUSE_BUTTONS:
+                problems.append(f"{where}: unknown mouse button {value!r}")
+        else:
+            problems.append(
+                f"{where}: step {kind!r} is not one of " + ", ".join(STEP_TYPES)
+            )
+
+
+def _validate_mapping(name, mapping, problems):
+    """Returns `mapping` with pynput objects replaced by names, or None if
+    it is too malformed to go on with."""
+    if not isinstance(mapping, dict):
+        problems.append(f"{name}: mapping must have a type and action")
+        return None
+    action_type = mapping.get("type")
+    action = mapping.get("action")
+    if action_type == "key":
+        action = key_name(action)
+        _check_key(action, problems, name)
+    elif action_type == "string":
+        if not isinstance(action, str) or not action:
+            problems.append(f"{name}: string action must be text")
+    elif action_type == "mouse_click":
+        action = button_name(action)
+        if action not in MOUSE_BUTTONS:
+            problems.append(f"{name}: unknown mouse button {action!r}")
+    elif action_type == "combo":
+        if not isinstance(action, (list, tuple)) or not action:
+            problems.append(f"{name}: combo action must be a list of keys")
+            return None
+        action = [key_name(a) for a in action]
+        for a in action:
+            _check_key(a, problems, name)
+    elif action_type == "macro":
+        if isinstance(action, (list, tuple)):
+            action = [_step_names(step) for step in action]
+        _check_macro(action, problems, name)
+    else:
+        problems.append(
+            f"{name}: type {action_type!r} is not one of "
+            + ", ".join(ACTION_TYPES)
+        )
+        return None
+    result = {"type": action_type, "action": action}
+    if "key_delay" in mapping:
+        _check_delay(mapping["key_delay"], problems, name)
+        result["key_delay"] = mapping["key_delay"]
+    return result
+
+
+def _is_key(name):
+    return name in SpeedEditorKey.__members__ and name != "NONE"
+
+
+def _validate_keys(keymap, problems, where=""):
+    result = {}
+    for name, mapping in keymap.items():
+        if not _is_key(name):
+            problems.append(f"{where}unknown Speed Editor key {name!r}")
+            continue
+        mapping = _validate_mapping(where + name, mapping, problems)
+        if mapping is not None:
+            result[name] = mapping
+    return result
+
+
+def _chord_keys(chord):
+    # "IN+OUT" -> ("IN", "OUT"), in keycode order; None if it isn't two
+    # different keys.
+    names = chord.split("+") if isinstance(chord, str) else ()
+    if len(names) != 2 or names[0] == names[1] or not all(map(_is_key, names)):
+        return None
+    return tuple(sorted(names, key=lambda n: SpeedEditorKey[n]))
+
+
+def validate_keymap(keymap):
+    """Checks `keymap`; returns it with pynput objects replaced by names.
+
+    Raises KeymapError listing every problem found.
+    """
+    if not isinstance(keymap, dict):
+        raise KeymapError(["a keymap must be a mapping of key names"])
+
+    problems = []
+    layers = keymap.get("layers", {})
+    chords = keymap.get("chords", {})
+    result = _validate_keys(
+        {n: m for n, m in keymap.items() if n not in ("layers", "chords")},
+        problems,
+    )
+
+    if not isinstance(layers, dict):
+        problems.append("layers must map layer keys to keymaps")
+        layers = {}
+    if len(layers) > MAX_LAYERS:
+        problems.append(f"at most {MAX_LAYERS} layers are supported")
+    for name, layer in layers.items():
+        if not _is_key(name):
+            problems.append(f"unknown layer key {name!r}")
+        elif name in result:
+            problems.append(f"{name}: a layer key can't have an action")
+        if not isinstance(layer, dict):
+            problems.append(f"layer {name}: must map key names to actions")
+            continue
+        for key in layer:
+            if key in layers:
+                problems.append(f"layer {name}: {key} is a layer key")
+        result.setdefault("layers", {})[name] = _validate_keys(
+            layer, problems, f"layer {name}: "
+        )
+
+    if not isinstance(chords, dict):
+        problems.append("chords must map key pairs like 'IN+OUT' to actions")
+        chords = {}
+    seen = {}
+    for chord, mapping in chords.items():
+        keys = _chord_keys(chord)
+        if keys is None:
+            problems.append(f"chord {chord!r} must be two different keys")
+            continue
+        if keys in seen:
+            problems.append(f"chords {seen[keys]!r} and {chord!r} are the same")
+            continue
+        seen[keys] = chord
+        for key in keys:
+            if key in layers:
+                problems.append(f"chord {chord}: {key} is a layer key")
+        mapping = _validate_mapping(f"chord {chord}", mapping, problems)
+        if mapping is not None:
+            result.setdefault("chords", {})["+".join(keys)] = mapping
+
+    if problems:
+        raise KeymapError(problems)
+    return result
+
+
+def load_keymap(path):
+    """Reads and validates a JSON keymap file."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            keymap = json.load(f)
+    except ValueError as e:
+        raise KeymapError([f"invalid JSON: {e}"], path) from None
+    try:
+        return validate_keymap(keymap)
+    except KeymapError as e:
+        raise KeymapError(e.problems, path) from None
+
+
+def _bind(mapping, runner, trigger):
+    steps = steps_for(
+        mapping["type"], mapping["action"], mapping.get("key_delay", 0)
+    )
+    return functools.partial(runner.submit, trigger, steps)
+
+
+def _compile_layer(keymap, runner, base=None, name=None):
+    actions = list(base.actions) if base else [None] * NUM_KEYS
+    labels = list(base.labels) if base else [None] * NUM_KEYS
+    keys = 0
+    for key, mapping in keymap.items():
+        keycode = SpeedEditorKey[key]
+        actions[keycode] = _bind(mapping, runner, keycode)
+        where = f"{name}+{key}" if name else key
+        labels[keycode] = f"Key: {where:<12} -> Action: {mapping}"
+        keys |= 1 << keycode
+    return Layer(tuple(actions), tuple(labels), keys, name)
+
+
+def compile_keymap(keymap, runner):
+    """Validates `keymap` and binds its actions to `runner`, a MacroRunner.
+
+    The actions take an optional `since`, passed on to runner.submit().
+    """
+    keymap = validate_keymap(keymap)
+    base = _compile_layer(
+        {n: m for n, m in keymap.items() if n not in ("layers", "chords")},
+        runner,
+    )
+
+    # Every combination of held layer keys gets its table, so finding the
+    # layer is one lookup; the lowest keycode held wins.
+    layer_keys = sorted(SpeedEditorKey[n] for n in keymap.get("layers", {}))
+    tables = {
+        k: _compile_layer(keymap["layers"][k.name], runner, base, k.name)
+        for k in layer_keys
+    }
+    layer_mask = sum(1 << k for k in layer_keys)
+    layers = {}
+    for combination in range(1 << len(layer_keys)):
+        held = [k for i, k in enumerate(layer_keys) if combination >> i & 1]
+        mask = sum(1 << k for k in held)
+        layers[mask] = tables[held[0]] if held else base
+
+    chords = {}
+    chord_keys = 0
+    partners = [0] * NUM_KEYS
+    for chord, mapping in keymap.get("chords", {}).items():
+        a, b = (SpeedEditorKey[n] for n in chord.split("+"))
+        mask = (1 << a) | (1 << b)
+        chords[mask] = (
+            _bind(mapping, runner, (int(a), int(b))),
+            f"Chord: {chord:<12} -> Action: {mapping}",
+        )
+        chord_keys |= mask
+        partners[a] |= 1 << b
+        partners[b] |= 1 << a
+
+    return CompiledKeymap(
+        base.actions,
+        base.labels,
+        keymap,
+        layers,
+        layer_mask,
+        chords,
+        chord_keys,
+        tuple(partners),
+    )
+
+
+class KeyResolver:
+    """Turns the held keys into the actions of a CompiledKeymap, applying
+    its layers and chords.
+
+    update() takes the bitset of held keys after each report (as in
+    ReportDecoder.held) and returns the (action, label) pairs to carry out,
+    in order. However many keys change in one report, the result is the
+    same:
+
+    - releases are handled before presses, and presses in ascending keycode
+      order;
+    - the layer is chosen by the layer keys held after the report, so a
+      layer key pressed together with another key applies to it;
+    - a chord fires when one of its keys is pressed while the other is held
+      or pressed in the same report (if several of its partners are held,
+      with the lowest keycode); its keys' own actions are then suppressed
+      until they are released;
+    - so a key that is in any chord acts when it is released rather than
+      when it is pressed, in the layer that was active when it was pressed.
+
+    `layer` is the active layer's bitset of held layer keys.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forgets the held keys, without carrying out anything pending."""
+        self.held = 0
+        self.layer = 0
+        self._chorded = 0
+        self._pending = [None] * NUM_KEYS
+
+    def update(self, keymap, held):
+        held &= _ALL_KEYS
+        old = self.held
+        if held == old:
+            return ()
+        self.held = held
+        fired = []
+
+        released = old & ~held & keymap.chord_keys
+        while released:
+            bit = released & -released
+            released ^= bit
+            k = bit.bit_length() - 1
+            binding = self._pending[k]
+            self._pending[k] = None
+            if binding and not self._chorded & bit:
+                fired.append(binding)
+        self._chorded &= held
+
+        self.layer = held & keymap.layer_mask
+        table = keymap.layers[self.layer]
+        pressed = held & ~old & ~keymap.layer_mask
+        while pressed:
+            bit = pressed & -pressed
+            pressed ^= bit
+            if self._chorded & bit:
+                # Already part of a chord its partner fired in this report.
+                continue
+            k = bit.bit_length() - 1
+            partners = keymap.chord_partners[k] & held
+            if partners:
+                both = bit | (partners & -partners)
+                fired.append(keymap.chords[both])
+                self._chorded |= both
+            elif table.actions[k]:
+                binding = (table.actions[k], table.labels[k])
+                if bit & keymap.chord_keys:
+                    self._pending[k] = binding
+                else:
+                    fired.append(binding)
+        return fired
+
+
+class KeymapWatcher:
+    """Keeps `keymap` compiled from the file at `path`, reloading it when
+    the file changes.
+
+    The directory is watched rather than the file, so editors that save by
+    writing a new file and renaming it over the old one are noticed too.
+    A reloaded keymap is checked against the runner's output, as
+    make_injector() checks the one the driver starts with, so one naming a
+    key the backend can't send is rejected too. After each reload attempt
+    `on_reload(keymap, error)` is called, with exactly one of the two set.
+    """
+
+    def __init__(self, path, runner, on_reload=None):
+        self.path = os.path.abspath(path)
+        self.runner = runner
+        self.on_reload = on_reload
+        self.reloads = 0
+        self.errors = 0
+        self.keymap = compile_keymap(load_keymap(self.path), runner)
+        self._inotify = Inotify()
+        self._inotify.add_watch(
+            os.path.dirname(self.path), IN_CLOSE_WRITE | IN_MOVED_TO
+        )
+        self._wake_r, self._wake_w = os.pipe()
+        self._thread = threading.Thread(
+            target=self._run, name="KeymapWatcher", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._wake_w is None:
+            return
+        os.write(self._wake_w, b"\0")
+        if self._thread.is_alive():
+            self._thread.join()
+        self._inotify.close()
+        for fd in (self._wake_r, self._wake_w):
+            os.close(fd)
+        self._wake_w = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reload(self):
+        """Recompiles the file; returns the new keymap, or None if it was
+        rejected."""
+        try:
+            mapping = load_keymap(self.path)
+            self.runner.output.check(keymap_keys(mapping))
+            keymap = compile_keymap(mapping, self.runner)
+        except (OSError, ValueError) as e:
+            self.errors += 1
+            if self.on_reload:
+                self.on_reload(None, e)
+            return None
+        self.keymap = keymap
+        self.reloads += 1
+        if self.on_reload:
+            self.on_reload(keymap, None)
+        return keymap
+
+    def _run(self):
+        name = os.path.basename(self.path)
+        while True:
+            readable, _, _ = select.select(
+                [self._inotify.fileno(), self._wake_r], [], []
+            )
+            if self._wake_r in readable:
+                return
+            if any(e.name == name for e in self._inotify.read_events()):
+                self.reload()
@@ -0,0 +1,192 @@
+"""
+The panel's LEDs.
+
+LedManager keeps a shadow copy of what the LEDs should show and writes the
+output reports from its own thread: report 2 for the key LEDs, report 4 for
+the jog mode key LEDs and report 3 for the jog mode. A report is only sent
+when its value differs from what was last sent, and no more often than
+every `interval` seconds, so a burst of changes costs at most one write
+per report per interval, of the state at the end of it, and setting the
+LEDs never waits for the device.
+
+The LEDs are the union of several sources, each set independently:
+
+    leds.set("held", Led.CUT | Led.CAM1)
+    leds.set("layer", Led.CAM4, JogLed.SHTL)
+    leds.set("held", 0)    # CAM4 and SHTL stay lit
+
+KEY_LEDS maps keycodes to the LED of the same key, and leds_for() a bitset
+of keycodes to their LEDs, for lighting keys while they are held.
+"""
+
+import struct
+import threading
+import time
+
+from bmd_decode import NUM_KEYS
+from bmd_protocol import (
+    OUTPUT_JOG_LEDS,
+    OUTPUT_JOG_MODE,
+    OUTPUT_LEDS,
+    JogLed,
+    JogMode,
+    Led,
+    SpeedEditorKey,
+)
+
+
+def _key_bits(flags):
+    bits = [0] * NUM_KEYS
+    for flag in flags:
+        bits[SpeedEditorKey[flag.name]] = int(flag)
+    return tuple(bits)
+
+
+# The LED bit of each keycode, 0 for keys without one, and likewise for the
+# jog mode keys.
+KEY_LEDS = _key_bits(Led)
+KEY_JOG_LEDS = _key_bits(JogLed)
+
+
+def leds_for(keys):
+    """Returns the LEDs of the keys in the keycode bitset `keys`."""
+    leds = 0
+    keys &= (1 << NUM_KEYS) - 1
+    while keys:
+        bit = keys & -keys
+        keys ^= bit
+        leds |= KEY_LEDS[bit.bit_length() - 1]
+    return leds
+
+
+_leds = struct.Struct("<BI")
+_jog_leds = struct.Struct("<BB")
+_jog_mode = struct.Struct("<BBIB")
+
+
+def jog_mode_report(mode):
+    """Returns the output report that sets the jog wheel's JogMode."""
+    return _jog_mode.pack(OUTPUT_JOG_MODE, mode, 0, 255)
+
+
+class LedManager:
+    """Drives the LEDs of `dev` from a daemon thread.
+
+    Once started it turns off any LED no source has set, whatever the panel
+    was showing before. `writes` counts the reports sent and `updates` the
+    calls to set() and set_jog_mode() that changed something; the
+    difference is what was coalesced. If a write fails the thread stops and
+    the exception is kept in `error`.
+    """
+
+    def __init__(self, dev, interval=0.02):
+        self.dev = dev
+        self.interval = interval
+        self.writes = 0
+        self.updates = 0
+        self.error = None
+        self._sources = {}
+        self._leds = 0
+        self._jog_leds = 0
+        self._jog_mode = None
+        self._sent = (None, None, None)
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self._run, name="LedManager", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Sends any change still pending, then stops the thread."""
+        with self._lock:
+            self._stopping = True
+            self._changed.notify()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def leds(self):
+        return Led(self._leds)
+
+    @property
+    def jog_leds(self):
+        return JogLed(self._jog_leds)
+
+    def set(self, source, leds=0, jog_leds=0):
+        """Sets the LEDs `source` wants lit, replacing its previous ones."""
+        with self._lock:
+            if self._sources.get(source) == (leds, jog_leds):
+                return
+            self._sources[source] = (leds, jog_leds)
+            all_leds = all_jog_leds = 0
+            for l, j in self._sources.values():
+                all_leds |= l
+                all_jog_leds |= j
+            if (all_leds, all_jog_leds) == (self._leds, self._jog_leds):
+                return
+            self._leds = all_leds
+            self._jog_leds = all_jog_leds
+            self.updates += 1
+            self._changed.notify()
+
+    def clear(self):
+        """Forgets every source, turning all the LEDs off."""
+        with self._lock:
+            self._sources.clear()
+            if self._leds or self._jog_leds:
+                self._leds = self._jog_leds = 0
+                self.updates += 1
+                self._changed.notify()
+
+    def set_jog_mode(self, mode):
+        """Sets what the jog wheel reports (see JogMode)."""
+        with self._lock:
+            if mode == self._jog_mode:
+                return
+            self._jog_mode = JogMode(mode)
+            self.updates += 1
+            self._changed.notify()
+
+    def _pending(self):
+        # Called with the lock held.
+        return (self._leds, self._jog_leds, self._jog_mode) != self._sent
+
+    def _run(self):
+        try:
+            while True:
+                with self._lock:
+                    while not self._pending() and not self._stopping:
+                        self._changed.wait()
+                    if not self._pending():
+                        return
+                    state = (self._leds, self._jog_leds, self._jog_mode)
+                self._send(state)
+                # Whatever changes in the meantime goes out together.
+                time.sleep(self.interval)
+        except OSError as e:
+            self.error = e
+
+    def _send(self, state):
+        leds, jog_leds, jog_mode = state
+        sent_leds, sent_jog_leds, sent_jog_mode = self._sent
+        if jog_mode is not None and jog_mode != sent_jog_mode:
+            self.dev.write(jog_mode_report(jog_mode))
+            self.writes += 1
+        if leds != sent_leds:
+            self.dev.write(_leds.pack(OUTPUT_LEDS, leds))
+            self.writes += 1
+        if jog_leds != sent_jog_leds:
+            self.dev.write(_jog_leds.pack(OUTPUT_JOG_LEDS, jog_leds))
+            self.writes += 1
+        self._sent = state
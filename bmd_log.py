@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+Structured event logging, off the read path.
+
+Printing from the read loop ties input handling to the speed of whatever is
+on the other end of stdout: a slow terminal, or journald applying back
+pressure to a pipe. An EventLog instead has the read loop append a
+fixed-shape Record to a bounded queue, which is all emit() does, and a
+writer thread formats and writes the records every `interval` seconds:
+
+    log = EventLog([ConsoleSink(), JsonlSink("events.jsonl")]).start()
+    log.emit("key", INFO, label, code=keycode)
+    ...
+    log.stop()
+
+Records are dropped, and counted in `dropped`, if the writer falls
+`maxsize` records behind. A sink that fails is counted in `errors`, and the
+writer carries on with the others and with the next records. Each category
+has its own level, and a category can be sampled, logging one record in
+every N that pass the level, for something as frequent as the jog wheel.
+
+Messages are not formatted by emit(): a str is written as it is and bytes,
+such as an unhandled report, are written as hex by the writer.
+
+The sinks write text to a stream, JSON lines to a file or a compact binary
+file (see REC_HEADER); the file sinks append to what is there and rotate
+at `max_bytes`, keeping `backups` old files as PATH.1, PATH.2... Binary
+logs are read back with read_binary(), or converted to JSON lines:
+
+    python3 bmd_log.py dump events.bmdlog
+"""
+
+import argparse
+import json
+import os
+import struct
+import sys
+import threading
+import time
+from collections import deque, namedtuple
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = {DEBUG: "debug", INFO: "info", WARNING: "warning", ERROR: "error"}
+
+# The categories records are filed under; the binary format stores the index.
+CATEGORIES = ("general", "key", "jog", "report", "device", "auth")
+
+# `time_ns` is time.monotonic_ns(), as elsewhere; `code` is a keycode,
+# report ID or the like, and `value` a jog delta, status or count.
+Record = namedtuple("Record", "time_ns category level code value message")
+
+MAGIC = b"BMDLOG\x00\x01"
+
+# time (ns), category, level, flags, code, value, message length
+REC_HEADER = struct.Struct("<QBBBHiH")
+# Set in flags when the message is bytes rather than text.
+FLAG_BYTES = 1
+
+
+def level_value(level):
+    """Returns a level given as a number or a name such as 'debug'."""
+    if isinstance(level, int):
+        return level
+    for value, name in LEVEL_NAMES.items():
+        if name == level.lower():
+            return value
+    raise ValueError(f"unknown log level {level!r}")
+
+
+def message_text(message):
+    return message.hex(" ") if isinstance(message, (bytes, bytearray)) else message
+
+
+def record_json(r):
+    """Returns a Record as a line of JSON."""
+    line = json.dumps(
+        {
+            "time_ns": r.time_ns,
+            "category": r.category,
+            "level": LEVEL_NAMES.get(r.level, r.level),
+            "code": r.code,
+            "value": r.value,
+            "message": message_text(r.message),
+        }
+    )
+    return line + "\n"
+
+
+class EventLog:
+    """Queues records for `sinks`, written on a thread of its own.
+
+    `levels` maps categories to the lowest level logged for them, by
+    number or name; others use `level`. `sample` maps categories to N, to
+    log one record in N.
+
+    `errors` counts the writes that failed, per sink, and `last_error` is
+    the exception the latest raised.
+    """
+
+    def __init__(
+        self,
+        sinks,
+        level=INFO,
+        levels=None,
+        sample=None,
+        maxsize=4096,
+        interval=0.05,
+    ):
+        self.sinks = list(sinks)
+        self.level = level_value(level)
+        self.levels = {c: level_value(v) for c, v in (levels or {}).items()}
+        self.sample = dict(sample or {})
+        self.interval = interval
+        self.written = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        self.errors = [0] * len(self.sinks)
+        self.last_error = None
+        self._queue = deque(maxlen=maxsize)
+        self._counts = dict.fromkeys(self.sample, 0)
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="EventLog", daemon=True
+        )
+
+    def enabled(self, category, level):
+        return level >= self.levels.get(category, self.level)
+
+    def emit(self, category, level, message, code=0, value=0, time_ns=None):
+        """Queues a record, unless its level or sampling leaves it out."""
+        if level < self.levels.get(category, self.level):
+            return
+        n = self.sample.get(category)
+        if n:
+            count = self._counts[category]
+            self._counts[category] = count + 1
+            if count % n:
+                self.sampled_out += 1
+                return
+        queue = self._queue
+        if len(queue) == queue.maxlen:
+            self.dropped += 1
+        # A plain tuple, made into a Record by the writer.
+        queue.append(
+            (
+                time.monotonic_ns() if time_ns is None else time_ns,
+                category,
+                level,
+                code,
+                value,
+                message,
+            )
+        )
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Writes what is queued and closes the sinks."""
+        self._stopping.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self._drain()
+        for sink in self.sinks:
+            sink.close()
+
+    def _drain(self):
+        queue = self._queue
+        make = Record._make
+        records = []
+        while queue:
+            records.append(make(queue.popleft()))
+        if not records:
+            return
+        for i, sink in enumerate(self.sinks):
+            try:
+                sink.write(records)
+                sink.flush()
+            except Exception as e:
+                # A full disk or a record a sink can't encode mustn't stop
+                # the writer.
+                self.errors[i] += 1
+                self.last_error = e
+        self.written += len(records)
+
+    def _run(self):
+        # Polling keeps emit() down to an append: waking the writer for
+        # each record would take a lock on the read path.
+        while not self._stopping.wait(self.interval):
+            self._drain()
+
+
+class ConsoleSink:
+    """Writes each record's message as a line of text to `stream`, followed
+    by its value unless that is zero."""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+
+    def write(self, records):
+        lines = []
+        for r in records:
+            text = message_text(r.message)
+            lines.append(f"{text} {r.value}\n" if r.value else f"{text}\n")
+        self.stream.write("".join(lines))
+
+    def flush(self):
+        self.stream.flush()
+
+    def close(self):
+        self.flush()
+
+
+class _FileSink:
+    """A log file that is appended to, and rotated once it reaches
+    `max_bytes`; subclasses define _encode() and the header written to a
+    new file. Records that can't be encoded, such as a binary record with
+    a code out of range, are left out and counted in `skipped`."""
+
+    mode = "a"
+    header = empty = ""
+
+    def __init__(self, path, max_bytes=16 << 20, backups=3):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.skipped = 0
+        self._file = None
+        self._open()
+
+    def _open(self):
+        self._file = open(self.path, self.mode)
+        self._size = os.fstat(self._file.fileno()).st_size
+        if not self._size:
+            self._file.write(self.header)
+            self._size = len(self.header)
+
+    def _rotate(self):
+        self._file.close()
+        for n in range(self.backups - 1, 0, -1):
+            older = f"{self.path}.{n}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.path}.{n + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        self._open()
+
+    def write(self, records):
+        chunk = []
+        size = self._size
+        for record in records:
+            try:
+                data = self._encode(record)
+            except (struct.error, ValueError):
+                self.skipped += 1
+                continue
+            if size + len(data) > self.max_bytes and size > len(self.header):
+                self._file.write(self.empty.join(chunk))
+                chunk = []
+                self._rotate()
+                size = self._size
+            chunk.append(data)
+            size += len(data)
+        if chunk:
+            self._file.write(self.empty.join(chunk))
+        self._size = size
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class JsonlSink(_FileSink):
+    """Writes one JSON object per line."""
+
+    # Sizes are counted in characters, which for JSON's ASCII output are
+    # bytes.
+    _encode = staticmethod(record_json)
+
+
+class BinarySink(_FileSink):
+    """Writes MAGIC, then a REC_HEADER and the message for each record."""
+
+    mode = "ab"
+    header = MAGIC
+    empty = b""
+
+    def _encode(self, r):
+        message = r.message
+        if isinstance(message, (bytes, bytearray)):
+            flags = FLAG_BYTES
+        else:
+            flags = 0
+            message = message.encode()
+        # The length is 16 bits.
+        message = message[:0xFFFF]
+        return (
+            REC_HEADER.pack(
+                r.time_ns,
+                CATEGORIES.index(r.category),
+                r.level,
+                flags,
+                r.code,
+                r.value,
+                len(message),
+            )
+            + message
+        )
+
+
+def read_binary(path):
+    """Yields the Records in a BinarySink file."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} is not a binary event log")
+    offset = len(MAGIC)
+    size = REC_HEADER.size
+    while offset + size <= len(data):
+        time_ns, category, level, flags, code, value, n = REC_HEADER.unpack_from(
+            data, offset
+        )
+        offset += size
+        message = data[offset : offset + n]
+        offset += n
+        if not flags & FLAG_BYTES:
+            message = message.decode()
+        yield Record(time_ns, CATEGORIES[category], level, code, value, message)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    dump = sub.add_parser("dump", help="print a binary log as JSON lines")
+    dump.add_argument("path")
+    args = parser.parse_args()
+
+    try:
+        for record in read_binary(args.path):
+            sys.stdout.write(record_json(record))
+    except BrokenPipeError:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+Macros, played on a worker thread.
+
+A macro is a tuple of steps: KeyDown, KeyUp, Text, Delay, Click and Scroll.
+Every keymap action compiles to one (see steps_for()), and MacroRunner
+plays them on its own thread, so typing a long string or waiting out a
+delay never holds up reading the device: submitting a macro only appends
+it to a queue.
+
+The runner sends everything it can in one batch: macros queued back to
+back are played without flushing the output in between, and it only
+flushes before a delay and when the queue runs dry.
+"""
+
+import threading
+import time
+from collections import deque, namedtuple
+
+KeyDown = namedtuple("KeyDown", "key")
+KeyUp = namedtuple("KeyUp", "key")
+Text = namedtuple("Text", "text")
+Delay = namedtuple("Delay", "seconds")
+Click = namedtuple("Click", "button")
+Scroll = namedtuple("Scroll", "steps")
+
+# Keymap macro steps are one-entry dicts, e.g. {"down": "ctrl"}.
+STEP_TYPES = {
+    "down": KeyDown,
+    "up": KeyUp,
+    "text": Text,
+    "delay": Delay,
+    "click": Click,
+}
+
+
+def steps_for(action_type, action, key_delay=0):
+    """Returns the steps for a validated keymap action.
+
+    With a `key_delay` (in seconds), keys and clicks are sent one at a time
+    that far apart, instead of all at once.
+    """
+    if action_type == "key":
+        steps = [KeyDown(action), KeyUp(action)]
+    elif action_type == "string":
+        steps = [Text(action)]
+    elif action_type == "mouse_click":
+        steps = [Click(action)]
+    elif action_type == "combo":
+        steps = [KeyDown(k) for k in action]
+        steps += [KeyUp(k) for k in reversed(action)]
+    elif action_type == "macro":
+        steps = [STEP_TYPES[k](v) for step in action for k, v in step.items()]
+    else:
+        raise ValueError(f"unknown action type {action_type!r}")
+
+    if key_delay:
+        spaced = []
+        for step in steps:
+            if isinstance(step, Text):
+                for c in step.text:
+                    spaced += [KeyDown(c), KeyUp(c), Delay(key_delay)]
+            elif isinstance(step, Delay):
+                spaced.append(step)
+            else:
+                spaced += [step, Delay(key_delay)]
+        steps = spaced
+    return tuple(steps)
+
+
+class MacroRunner:
+    """Plays macros on `output` from a daemon thread.
+
+    At most `maxsize` macros wait at a time; submit() rejects any more and
+    counts them in `dropped`. Submitting the macro of the key whose macro
+    is playing cancels it instead: the rest of it is skipped and any keys it
+    is holding down are released. Consecutive scrolls are merged.
+
+    Once it has been started, the runner is the only thing that uses
+    `output`.
+
+    If `latency` (a bmd_metrics.Histogram) is given, the time from each
+    macro's `since` (a time.perf_counter_ns() value passed to submit()) to
+    the runner starting to send it is recorded in it.
+
+    A macro the output fails on is abandoned, releasing any keys it holds
+    down, and the runner goes on to the next: the error is counted in
+    `failed`, kept in `error` and passed to `on_error(error)`, which is
+    called on the worker thread.
+    """
+
+    def __init__(self, output, maxsize=16, latency=None, on_error=None):
+        self.output = output
+        self.maxsize = maxsize
+        self.latency = latency
+        self.on_error = on_error
+        self.played = 0
+        self.cancelled = 0
+        self.dropped = 0
+        self.failed = 0
+        self.error = None
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._idle = threading.Condition(self._lock)
+        self._waiting = False
+        self._cancel = threading.Event()
+        self._playing = None
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self._run, name="MacroRunner", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self):
+        """Abandons queued macros, waits for the worker and closes the
+        output."""
+        with self._lock:
+            self._stopping = True
+            self._queue.clear()
+            self._cancel.set()
+            self._ready.notify()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.output.close()
+
+    def join(self):
+        """Waits until every queued macro has been played and sent, or the
+        worker has failed."""
+        with self._lock:
+            while (self._queue or not self._waiting) and self._thread.is_alive():
+                self._idle.wait(0.1)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def submit(self, trigger, steps, since=None):
+        """Queues `steps`, played on behalf of the key `trigger`.
+
+        Returns False if they were not queued, either because they cancelled
+        the macro `trigger` is playing or because the queue is full.
+        """
+        with self._lock:
+            if trigger is not None and self._playing == trigger:
+                self._playing = None
+                self._cancel.set()
+                self.cancelled += 1
+                return False
+            if len(self._queue) >= self.maxsize:
+                self.dropped += 1
+                return False
+            self._queue.append((trigger, steps, since))
+            self._ready.notify()
+            return True
+
+    def scroll(self, steps):
+        """Queues `steps` wheel steps, merged with a scroll queued just
+        before."""
+        with self._lock:
+            q = self._queue
+            if q and q[-1][0] is None and isinstance(q[-1][1], Scroll):
+                q[-1] = (None, Scroll(q[-1][1].steps + steps), None)
+            elif len(q) >= self.maxsize:
+                self.dropped += 1
+                return
+            else:
+                q.append((None, Scroll(steps), None))
+            self._ready.notify()
+
+    def flush(self):
+        # The worker flushes whenever it runs out of work.
+        pass
+
+    def pending(self):
+        return len(self._queue)
+
+    def _next(self):
+        while True:
+            with self._lock:
+                if self._stopping:
+                    return None
+                if self._queue:
+                    trigger, steps, since = self._queue.popleft()
+                    self._playing = trigger
+                    self._cancel.clear()
+                    return steps, since
+            # Out of work: send what has been queued, then wait for more.
+            try:
+                self.output.flush()
+            except Exception as e:
+                self._failed(e)
+            with self._lock:
+                self._waiting = True
+                self._idle.notify_all()
+                while not self._queue and not self._stopping:
+                    self._ready.wait()
+                self._waiting = False
+
+    def _run(self):
+        while True:
+            job = self._next()
+            if job is None:
+                return
+            steps, since = job
+            try:
+                if isinstance(steps, Scroll):
+                    self.output.scroll(steps.steps)
+                else:
+                    self._play(steps, since)
+            except Exception as e:
+                self._failed(e)
+            finally:
+                with self._lock:
+                    self._playing = None
+
+    def _failed(self, error):
+        self.failed += 1
+        self.error = error
+        if self.on_error:
+            self.on_error(error)
+
+    def _play(self, steps, since):
+        output = self.output
+        cancel = self._cancel
+        held = []
+        finished = False
+        try:
+            for step in steps:
+                if cancel.is_set():
+                    break
+                if since is not None and self.latency is not None:
+                    self.latency.observe(time.perf_counter_ns() - since)
+                    since = None
+                kind = type(step)
+                if kind is KeyDown:
+                    output.key(step.key, True)
+                    held.append(step.key)
+                elif kind is KeyUp:
+                    output.key(step.key, False)
+                    if step.key in held:
+                        held.remove(step.key)
+                elif kind is Text:
+                    for c in step.text:
+                        if cancel.is_set():
+                            break
+                        output.tap(c)
+                elif kind is Click:
+                    output.click(step.button)
+                elif kind is Delay:
+                    output.flush()
+                    if cancel.wait(step.seconds):
+                        break
+            finished = not cancel.is_set()
+        finally:
+            # A cancelled or failed macro lets go of the keys it pressed.
+            if not finished:
+                for key in reversed(held):
+                    output.key(key, False)
+                output.flush()
+        if finished:
+            self.played += 1
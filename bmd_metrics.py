@@ -0,0 +1,232 @@
+"""
+Runtime metrics, exported in the Prometheus text format.
+
+Recording is plain attribute and list arithmetic, with no locks and no
+allocation, so it can stay on in production:
+
+    metrics.reports[report[0]] += 1
+    metrics.read_to_inject.observe(ns)
+
+cost well under a microsecond each (bench_metrics.py measures them).
+Anything that already keeps its own counts, like HidReader.dropped or
+AuthMetrics, is read when the metrics are scraped instead of being copied on
+every change: see gauge().
+
+MetricsServer serves the text over HTTP, on a localhost TCP port or a Unix
+socket, from a daemon thread; http.server is only imported when one is
+created:
+
+    curl localhost:9477/metrics
+    curl --unix-socket /run/bmd.sock http://x/metrics
+"""
+
+import os
+import threading
+
+# Histogram buckets are powers of two nanoseconds, from 1 us to ~17 s.
+_FIRST_BUCKET = 10
+_LAST_BUCKET = 34
+
+
+class Histogram:
+    """A latency histogram with power-of-two nanosecond buckets."""
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.counts = [0] * (_LAST_BUCKET + 2)
+        self.sum = 0
+
+    def observe(self, ns):
+        # Bucket i holds values up to and including 2**i ns, as `le` says;
+        # the last is +Inf. (-1).bit_length() is 1, so 0 goes in by hand.
+        if ns > 0:
+            self.counts[min((ns - 1).bit_length(), _LAST_BUCKET + 1)] += 1
+        else:
+            self.counts[0] += 1
+        self.sum += ns
+
+    def render(self, lines):
+        name = self.name
+        lines.append(f"# HELP {name} {self.help}")
+        lines.append(f"# TYPE {name} histogram")
+        counts = self.counts
+        total = sum(counts[: _FIRST_BUCKET + 1])
+        for i in range(_FIRST_BUCKET, _LAST_BUCKET + 1):
+            if i > _FIRST_BUCKET:
+                total += counts[i]
+            lines.append(f'{name}_bucket{{le="{(1 << i) / 1e9:g}"}} {total}')
+        total += counts[_LAST_BUCKET + 1]
+        lines.append(f'{name}_bucket{{le="+Inf"}} {total}')
+        lines.append(f"{name}_sum {self.sum / 1e9:g}")
+        lines.append(f"{name}_count {total}")
+
+
+class Metrics:
+    """The metrics of one driver process.
+
+    `reports` counts input reports by report ID and `unhandled` those the
+    decoder didn't recognise. Other values are registered with gauge() or
+    counter() as functions returning the current value; they are called on
+    each scrape.
+    """
+
+    def __init__(self, prefix="bmd"):
+        self.prefix = prefix
+        self.reports = [0] * 256
+        self.unhandled = 0
+        self.read_to_inject = Histogram(
+            f"{prefix}_read_to_inject_seconds",
+            "Time from a report being read to its first output event.",
+        )
+        self._values = []
+
+    def gauge(self, name, help, get, labels=""):
+        self._values.append((f"{self.prefix}_{name}", "gauge", help, get, labels))
+
+    def counter(self, name, help, get, labels=""):
+        self._values.append((f"{self.prefix}_{name}", "counter", help, get, labels))
+
+    def add_auth(self, auth, labels=""):
+        """Exports an AuthMetrics."""
+        self.counter(
+            "auth_handshakes_total",
+            "Successful authentication handshakes.",
+            lambda: auth.renewals,
+            labels,
+        )
+        self.counter(
+            "auth_failures_total",
+            "Failed authentication attempts.",
+            lambda: auth.failures,
+            labels,
+        )
+        self.counter(
+            "auth_duration_seconds_total",
+            "Time spent in successful handshakes.",
+            lambda: auth.total_duration,
+            labels,
+        )
+        self.gauge(
+            "auth_last_duration_seconds",
+            "Duration of the last successful handshake.",
+            lambda: auth.last_duration,
+            labels,
+        )
+        self.gauge(
+            "auth_max_duration_seconds",
+            "Longest successful handshake.",
+            lambda: auth.max_duration,
+            labels,
+        )
+
+    def add_handshake(self, handshake, labels=""):
+        """Exports the timings of a bmd_handshake Handshake."""
+        self.gauge(
+            "handshake_attempts",
+            "Attempts the opening handshake took.",
+            lambda: len(handshake.attempts),
+            labels,
+        )
+        self.gauge(
+            "time_to_authenticated_seconds",
+            "Time from starting the opening handshake to the device being unlocked.",
+            lambda: handshake.authenticated,
+            labels,
+        )
+        self.gauge(
+            "time_to_first_event_seconds",
+            "Time from starting the opening handshake to the first input report.",
+            lambda: handshake.first_event,
+            labels,
+        )
+
+    def render(self):
+        p = self.prefix
+        lines = [
+            f"# HELP {p}_reports_total Input reports received, by report ID.",
+            f"# TYPE {p}_reports_total counter",
+        ]
+        for report_id, n in enumerate(self.reports):
+            if n:
+                lines.append(f'{p}_reports_total{{report_id="{report_id}"}} {n}')
+        lines += [
+            f"# HELP {p}_unhandled_reports_total Reports the decoder didn't recognise.",
+            f"# TYPE {p}_unhandled_reports_total counter",
+            f"{p}_unhandled_reports_total {self.unhandled}",
+        ]
+        self.read_to_inject.render(lines)
+
+        described = set()
+        for name, kind, help, get, labels in self._values:
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+            value = get()
+            if value is None:
+                continue
+            labels = f"{{{labels}}}" if labels else ""
+            lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _http_server(address):
+    import socketserver
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = self.server.metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    class UnixHTTPServer(
+        socketserver.ThreadingMixIn, socketserver.UnixStreamServer
+    ):
+        daemon_threads = True
+
+        def get_request(self):
+            request, _ = super().get_request()
+            # BaseHTTPRequestHandler expects a (host, port) client address.
+            return request, ("local", 0)
+
+    if isinstance(address, str):
+        return UnixHTTPServer(address, Handler)
+    server = ThreadingHTTPServer(address, Handler)
+    server.daemon_threads = True
+    return server
+
+
+class MetricsServer:
+    """Serves `metrics` at `address`: a (host, port) pair or the path of a
+    Unix socket."""
+
+    def __init__(self, metrics, address=("127.0.0.1", 9477)):
+        self.address = address
+        if isinstance(address, str) and os.path.exists(address):
+            os.unlink(address)
+        self._server = _http_server(address)
+        self._server.metrics = metrics
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="MetricsServer", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if isinstance(self.address, str):
+            os.unlink(self.address)
@@ -0,0 +1,185 @@
+"""
+Output backends.
+
+An injector synthesises the keyboard and mouse events the keymap asks for.
+Calls may be buffered until flush(), which the drivers call once per HID
+report, so a backend can send everything one report produces in a single
+batch.
+
+Keys are named the way pynput names them: the `name` of a pynput Key
+('f5', 'enter', 'ctrl', ...) or a single character. key_name() accepts
+either form, so a KEY_MAP written with pynput Key objects works with every
+backend.
+"""
+
+MOUSE_BUTTONS = ("left", "middle", "right")
+
+# The names of pynput's Key members, which are the key names keymaps may
+# use besides single characters.
+KEY_NAMES = frozenset(
+    [
+        "alt", "alt_l", "alt_r", "alt_gr", "backspace", "caps_lock",
+        "cmd", "cmd_l", "cmd_r", "ctrl", "ctrl_l", "ctrl_r", "delete",
+        "down", "end", "enter", "esc", "home", "insert", "left",
+        "media_next", "media_play_pause", "media_previous",
+        "media_volume_down", "media_volume_mute", "media_volume_up",
+        "menu", "num_lock", "page_down", "page_up", "pause",
+        "print_screen", "right", "scroll_lock", "shift", "shift_l",
+        "shift_r", "space", "tab", "up",
+    ]
+    + [f"f{n}" for n in range(1, 25)]
+)
+
+# Modifier names, which combos hold down while the final key is tapped.
+MODIFIERS = frozenset(
+    (
+        "alt", "alt_l", "alt_r", "alt_gr",
+        "cmd", "cmd_l", "cmd_r",
+        "ctrl", "ctrl_l", "ctrl_r",
+        "shift", "shift_l", "shift_r",
+    )
+)
+
+
+def key_name(action):
+    """Returns the name of a key given as a pynput Key or a string."""
+    return getattr(action, "name", action)
+
+
+def button_name(action):
+    """Returns the name of a mouse button given as a pynput Button or a
+    string."""
+    return getattr(action, "name", action)
+
+
+class Injector:
+    """Base class for output backends; every operation does nothing."""
+
+    def key(self, name, pressed):
+        pass
+
+    def click(self, button):
+        pass
+
+    def scroll(self, steps):
+        """Scrolls `steps` wheel steps; positive is down."""
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def check(self, names):
+        """Raises ValueError if any of the keys `names` can't be sent."""
+        pass
+
+    def tap(self, name):
+        self.key(name, True)
+        self.key(name, False)
+
+    def combo(self, names):
+        """Holds all but the last key down while tapping the last."""
+        for n in names[:-1]:
+            self.key(n, True)
+        self.tap(names[-1])
+        for n in reversed(names[:-1]):
+            self.key(n, False)
+
+    def type_text(self, text):
+        for c in text:
+            self.tap(c)
+
+    def perform(self, mapping):
+        """Carries out a KEY_MAP entry."""
+        action_type = mapping.get("type")
+        action = mapping.get("action")
+        if action_type == "key":
+            self.tap(key_name(action))
+        elif action_type == "string":
+            self.type_text(action)
+        elif action_type == "mouse_click":
+            self.click(button_name(action))
+        elif action_type == "combo":
+            self.combo([key_name(a) for a in action])
+        else:
+            raise ValueError(f"unknown action type {action_type!r}")
+
+
+class PynputInjector(Injector):
+    """Sends events through pynput, which works anywhere pynput does but
+    costs an X round trip per event."""
+
+    def __init__(self):
+        from pynput.keyboard import Controller as KeyboardController, Key
+        from pynput.mouse import Controller as MouseController, Button
+
+        self._keyboard = KeyboardController()
+        self._mouse = MouseController()
+        self._keys = Key
+        self._buttons = Button
+
+    def _key(self, name):
+        return name if len(name) == 1 else self._keys[name]
+
+    def key(self, name, pressed):
+        if pressed:
+            self._keyboard.press(self._key(name))
+        else:
+            self._keyboard.release(self._key(name))
+
+    def click(self, button):
+        self._mouse.click(self._buttons[button])
+
+    def scroll(self, steps):
+        self._mouse.scroll(0, -steps)
+
+    def type_text(self, text):
+        self._keyboard.type(text)
+
+
+def make_injector(backend, keymap=None):
+    """Creates the injector called `backend`.
+
+    `keymap` is the KEY_MAP the injector will be used with, for backends
+    which prepare for the keys in advance.
+    """
+    if backend == "pynput":
+        return PynputInjector()
+    if backend == "x11":
+        from bmd_x11 import X11Injector
+
+        return X11Injector(keymap_keys(keymap or {}))
+    if backend == "uinput":
+        from bmd_uinput import UinputInjector
+
+        return UinputInjector(keymap_keys(keymap or {}))
+    raise ValueError(f"unknown output backend {backend!r}")
+
+
+def keymap_keys(keymap):
+    """Returns the names of every key a KEY_MAP can send, in any layer or
+    chord."""
+    names = set()
+    mappings = [m for n, m in keymap.items() if n not in ("layers", "chords")]
+    mappings += keymap.get("chords", {}).values()
+    for layer in keymap.get("layers", {}).values():
+        mappings += layer.values()
+    for mapping in mappings:
+        action_type = mapping.get("type")
+        action = mapping.get("action")
+        if action_type == "key":
+            names.add(key_name(action))
+        elif action_type == "string":
+            names.update(action)
+        elif action_type == "combo":
+            names.update(key_name(a) for a in action)
+        elif action_type == "macro":
+            for step in action:
+                for kind, value in step.items():
+                    if kind in ("down", "up"):
+                        names.add(key_name(value))
+                    elif kind == "text":
+                        names.update(value)
+    return names
@@ -0,0 +1,89 @@
+"""
+Speed Editor protocol definitions shared by the drivers.
+
+Nothing in here talks to a device directly: authenticate() works on any
+object with the hid.Device feature report methods. bmd_decode turns raw
+input reports into the event tuples defined here.
+"""
+
+import enum
+from collections import namedtuple
+
+from bmd_auth import bmd_kbd_auth
+
+USB_VID = 0x1edb
+SPEED_EDITOR_PIDS = (0xda0e, 0xbd3d)
+# The vendor usage page of the interface that takes the handshake.
+USAGE_PAGE = 0xff01
+
+REPORT_JOG = 3
+REPORT_KEYS = 4
+REPORT_AUTH = 6
+
+# Output reports.
+OUTPUT_LEDS = 2
+OUTPUT_JOG_MODE = 3
+OUTPUT_JOG_LEDS = 4
+
+
+class SpeedEditorKey(enum.IntEnum):
+    NONE=0x00;SMART_INSRT=0x01;APPND=0x02;RIPL_OWR=0x03;CLOSE_UP=0x04;PLACE_ON_TOP=0x05;SRC_OWR=0x06;IN=0x07;OUT=0x08;TRIM_IN=0x09;TRIM_OUT=0x0a;ROLL=0x0b;SLIP_SRC=0x0c;SLIP_DEST=0x0d;TRANS_DUR=0x0e;CUT=0x0f;DIS=0x10;SMTH_CUT=0x11;SOURCE=0x1a;TIMELINE=0x1b;SHTL=0x1c;JOG=0x1d;SCRL=0x1e;ESC=0x31;SYNC_BIN=0x1f;AUDIO_LEVEL=0x2c;FULL_VIEW=0x2d;TRANS=0x22;SPLIT=0x2f;SNAP=0x2e;RIPL_DEL=0x2b;CAM1=0x33;CAM2=0x34;CAM3=0x35;CAM4=0x36;CAM5=0x37;CAM6=0x38;CAM7=0x39;CAM8=0x3a;CAM9=0x3b;LIVE_OWR=0x30;VIDEO_ONLY=0x25;AUDIO_ONLY=0x26;STOP_PLAY=0x3c
+
+
+class BitmapKey(enum.IntEnum):
+    """Keys only the report 1 bitmap has, which have no Speed Editor keycode;
+    they are numbered with codes the Speed Editor doesn't use."""
+    SMART_IN=0x12;SMART_OUT=0x13;BLACK=0x14;FREEZE=0x15;TRANS_DISS=0x16
+
+
+def keycode_name(code):
+    """Returns the name of keycode `code`, or its hex value if it has none."""
+    for keys in (SpeedEditorKey, BitmapKey):
+        try:
+            return keys(code).name
+        except ValueError:
+            pass
+    return hex(code)
+
+
+class Led(enum.IntFlag):
+    """The key LEDs, as bits of the report 2 bitmask."""
+    CLOSE_UP=1<<0;CUT=1<<1;DIS=1<<2;SMTH_CUT=1<<3;TRANS=1<<4;SNAP=1<<5;CAM7=1<<6;CAM8=1<<7;CAM9=1<<8;LIVE_OWR=1<<9;CAM4=1<<10;CAM5=1<<11;CAM6=1<<12;VIDEO_ONLY=1<<13;CAM1=1<<14;CAM2=1<<15;CAM3=1<<16;AUDIO_ONLY=1<<17
+
+
+class JogLed(enum.IntFlag):
+    """The LEDs of the jog mode keys, as bits of the report 4 byte."""
+    JOG=1<<0;SHTL=1<<1;SCRL=1<<2
+
+
+class JogMode(enum.IntEnum):
+    """What the jog wheel reports, set with report 3."""
+    RELATIVE=0;ABSOLUTE_CONTINUOUS=1;RELATIVE_2=2;ABSOLUTE_DEADZERO=3
+
+
+# Decoded input events. `key` is the raw keycode (see SpeedEditorKey and
+# BitmapKey).
+KeyEvent = namedtuple("KeyEvent", "key pressed")
+JogEvent = namedtuple("JogEvent", "mode delta")
+UnknownReport = namedtuple("UnknownReport", "data")
+
+
+def authenticate(dev):
+    """Runs the feature report 6 handshake; returns the status word.
+
+    The status word is the number of seconds the device stays unlocked for.
+    `dev` may return feature reports as bytes or, like hidapi's hid.device,
+    as lists of ints.
+    """
+    dev.send_feature_report(b'\x06\x00\x00\x00\x00\x00\x00\x00\x00\x00')
+    data=bytes(dev.get_feature_report(6,10))
+    if data[0:2]!=b'\x06\x00':raise RuntimeError('Failed auth get_kbd_challenge')
+    challenge=int.from_bytes(data[2:],'little')
+    dev.send_feature_report(b'\x06\x01\x00\x00\x00\x00\x00\x00\x00\x00')
+    data=bytes(dev.get_feature_report(6,10))
+    if data[0:2]!=b'\x06\x02':raise RuntimeError('Failed auth get_kbd_response')
+    response=bmd_kbd_auth(challenge)
+    dev.send_feature_report(b'\x06\x03'+response.to_bytes(8,'little'))
+    data=bytes(dev.get_feature_report(6,10))
+    if data[0:2]!=b'\x06\x04':raise RuntimeError('Failed auth get_kbd_status')
+    return int.from_bytes(data[2:4],'little')
@@ -0,0 +1,187 @@
+"""
+Background reader for HID input reports.
+
+HidReader does blocking reads on its own thread and hands the reports over
+through a bounded queue, so the consumer sleeps in queue.get() until a
+report actually arrives rather than polling the device with a sleep in
+between. It works with both the `hid` package's hid.Device and the `hidapi`
+package's hid.device(), since both take the read timeout in milliseconds as
+the second positional argument.
+
+Each report is stamped with time.perf_counter_ns() as its read returns;
+get_timed() and timed() hand the stamp over with the report, so latency
+measured from it includes the time the report spent queued.
+
+`paused` holds the reader off between reads, for anything else that has
+to use the device without a read running at the same time, such as a
+ReauthScheduler:
+
+    ReauthScheduler(authenticate, lock=reader.paused)
+"""
+
+import queue
+import threading
+import time
+
+
+class HidReader:
+    """Reads reports from `dev` on a daemon thread.
+
+    `maxsize` bounds the queue. If the consumer falls that far behind, the
+    oldest queued report is discarded to make room (every Speed Editor key
+    report carries the full key state, so the newest one is the one worth
+    keeping) and `dropped` is incremented.
+
+    `timeout_ms` is how long each read may block before the thread checks
+    whether it has been asked to stop; it bounds how long stop() takes and
+    is the only wakeup an idle device causes. None blocks forever, in which
+    case the thread only notices stop() once the device is closed.
+
+    `paused` is a context manager that waits for the read in progress, if
+    any, to return, and holds off the next until the block ends; it can
+    wait for up to `timeout_ms`.
+    """
+
+    def __init__(self, dev, maxsize=256, size=64, timeout_ms=1000):
+        self.dev = dev
+        self.size = size
+        self.timeout_ms = timeout_ms
+        self.reports = 0
+        self.dropped = 0
+        self.error = None
+        self._queue = queue.Queue(maxsize)
+        self._stopping = threading.Event()
+        self._idle = threading.Condition()
+        self._reading = False
+        self._pauses = 0
+        self.paused = _Paused(self)
+        self._thread = threading.Thread(
+            target=self._run, name="HidReader", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Asks the thread to exit and waits for it."""
+        self._stopping.set()
+        with self._idle:
+            self._idle.notify_all()
+        if self._thread.is_alive() and (
+            self._thread is not threading.current_thread()
+        ):
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def pause(self):
+        """Waits for the read in progress and holds off the next one until
+        resume(); calls nest."""
+        with self._idle:
+            self._pauses += 1
+            while self._reading:
+                self._idle.wait()
+
+    def resume(self):
+        with self._idle:
+            self._pauses -= 1
+            self._idle.notify_all()
+
+    def _read(self):
+        with self._idle:
+            while self._pauses and not self._stopping.is_set():
+                self._idle.wait()
+            if self._stopping.is_set():
+                return None
+            self._reading = True
+        try:
+            if self.timeout_ms is None:
+                return self.dev.read(self.size)
+            return self.dev.read(self.size, self.timeout_ms)
+        finally:
+            with self._idle:
+                self._reading = False
+                self._idle.notify_all()
+
+    def _put(self, item):
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def _run(self):
+        try:
+            while not self._stopping.is_set():
+                report = self._read()
+                if report:
+                    self.reports += 1
+                    self._put((time.perf_counter_ns(), bytes(report)))
+        except Exception as e:
+            if not self._stopping.is_set():
+                self.error = e
+        finally:
+            # Wake the consumer so it can see the reader has gone.
+            self._put(None)
+
+    def get(self, timeout=None):
+        """Returns the next report, blocking until one arrives.
+
+        Returns None on timeout or once the reader has stopped; if the
+        reader stopped because the device failed, the exception is
+        re-raised here instead.
+        """
+        item = self.get_timed(timeout)
+        return None if item is None else item[1]
+
+    def get_timed(self, timeout=None):
+        """Like get(), but returns (time read, report): the time is the
+        time.perf_counter_ns() value when the read returned."""
+        try:
+            item = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if item is None:
+            # Leave the marker in place for any later callers.
+            self._put(None)
+            if self.error:
+                raise self.error
+        return item
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def __iter__(self):
+        for _, report in self.timed():
+            yield report
+
+    def timed(self):
+        """Yields (time read, report) pairs, as get_timed() returns them."""
+        while True:
+            item = self.get_timed()
+            if item is None:
+                return
+            yield item
+
+
+class _Paused:
+    # HidReader.paused: a reusable context manager, so it can stand in for a
+    # lock.
+    def __init__(self, reader):
+        self.reader = reader
+
+    def __enter__(self):
+        self.reader.pause()
+
+    def __exit__(self, *exc):
+        self.reader.resume()
@@ -0,0 +1,193 @@
+"""
+Background re-authentication.
+
+The Speed Editor only stays unlocked for as long as the status word returned
+by the handshake says (in seconds); after that it stops sending reports
+until it is authenticated again. These schedulers renew the authentication
+ahead of that deadline, off the read path: the handshake only uses feature
+reports on the control endpoint, and input reports arriving meanwhile are
+queued by the kernel, so nothing is lost or held up while a renewal is in
+progress. A synchronous driver reading on another thread still has to keep
+its reads and the renewal apart: give ReauthScheduler its HidReader's
+`paused` as the lock.
+
+ReauthScheduler runs on its own thread for the synchronous drivers;
+AsyncReauthScheduler is a task for AsyncSpeedEditor. Both record their
+timings in an AuthMetrics.
+"""
+
+import threading
+import time
+
+# Used when the device reports a zero lifetime; this is how often main.cc
+# re-authenticates.
+DEFAULT_LIFETIME = 60
+
+
+class AuthMetrics:
+    """Renewal timings. Durations are in seconds; times are
+    time.monotonic() values."""
+
+    def __init__(self):
+        self.renewals = 0
+        self.failures = 0
+        self.lifetime = None
+        self.last_duration = None
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+        self.last_renewal = None
+        self.expires = None
+        self.last_error = None
+
+    def record(self, start, end, status):
+        duration = end - start
+        self.renewals += 1
+        self.last_duration = duration
+        self.max_duration = max(self.max_duration, duration)
+        self.total_duration += duration
+        self.last_renewal = end
+        self.lifetime = status or DEFAULT_LIFETIME
+        # The device's clock started when it answered, which is no earlier
+        # than when we asked.
+        self.expires = start + self.lifetime
+
+    def snapshot(self):
+        now = time.monotonic()
+        return {
+            "renewals": self.renewals,
+            "failures": self.failures,
+            "lifetime": self.lifetime,
+            "last_duration": self.last_duration,
+            "max_duration": self.max_duration,
+            "mean_duration": (
+                self.total_duration / self.renewals if self.renewals else None
+            ),
+            "remaining": None if self.expires is None else self.expires - now,
+            "last_error": (
+                None if self.last_error is None else repr(self.last_error)
+            ),
+        }
+
+
+class _Reauth:
+    """Scheduling policy shared by both schedulers.
+
+    A renewal is due once `margin` of the lifetime has passed. After a
+    failure it is retried after `retry` seconds, doubling up to
+    `max_retry`.
+    """
+
+    def __init__(self, margin=0.75, retry=0.25, max_retry=5.0, metrics=None):
+        self.margin = margin
+        self.retry = retry
+        self.max_retry = max_retry
+        self.metrics = metrics or AuthMetrics()
+        self._backoff = retry
+
+    def _prime(self, status):
+        m = self.metrics
+        m.lifetime = status or DEFAULT_LIFETIME
+        m.last_renewal = time.monotonic()
+        m.expires = m.last_renewal + m.lifetime
+
+    def _delay(self):
+        m = self.metrics
+        due = m.last_renewal + m.lifetime * self.margin
+        return max(0.0, due - time.monotonic())
+
+    def _succeeded(self, start, status):
+        self.metrics.record(start, time.monotonic(), status)
+        self._backoff = self.retry
+
+    def _failed(self, e):
+        self.metrics.failures += 1
+        self.metrics.last_error = e
+        delay = self._backoff
+        self._backoff = min(self._backoff * 2, self.max_retry)
+        return delay
+
+
+class ReauthScheduler(_Reauth):
+    """Calls `authenticate()` on a daemon thread whenever renewal is due.
+
+    `lock`, if given, is held around each renewal; share it with anything
+    else that sends feature or output reports to the same device, or pass
+    the reader's HidReader.paused.
+    """
+
+    def __init__(self, authenticate, lock=None, **kwargs):
+        super().__init__(**kwargs)
+        self.authenticate = authenticate
+        self.lock = lock or threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="ReauthScheduler", daemon=True
+        )
+
+    def start(self, status):
+        """Starts renewing; `status` is what the first handshake returned."""
+        self._prime(status)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self):
+        delay = self._delay()
+        while not self._stopping.wait(delay):
+            start = time.monotonic()
+            try:
+                with self.lock:
+                    status = self.authenticate()
+            except Exception as e:
+                delay = self._failed(e)
+                continue
+            self._succeeded(start, status)
+            delay = self._delay()
+
+
+class AsyncReauthScheduler(_Reauth):
+    """Renews an AsyncSpeedEditor's authentication from a task.
+
+    A renewal that takes more than `timeout` seconds counts as failed.
+    """
+
+    def __init__(self, editor, timeout=2.0, **kwargs):
+        super().__init__(**kwargs)
+        self.editor = editor
+        self.timeout = timeout
+        self._task = None
+
+    def start(self, status):
+        """Starts renewing; `status` is what the first handshake returned."""
+        # Imported here so that the synchronous drivers don't pay for it;
+        # anything with a running loop has it loaded already.
+        import asyncio
+
+        self._prime(status)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    async def _run(self):
+        import asyncio
+
+        delay = self._delay()
+        while True:
+            await asyncio.sleep(delay)
+            start = time.monotonic()
+            try:
+                status = await asyncio.wait_for(
+                    self.editor.authenticate(), self.timeout
+                )
+            except (OSError, RuntimeError, asyncio.TimeoutError) as e:
+                delay = self._failed(e)
+                continue
+            self._succeeded(start, status)
+            delay = self._delay()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Recording and replaying raw device traffic.
+
+A recording is a binary file: the MAGIC header, then one record per
+report, each a REC_HEADER (time in nanoseconds since the recording started,
+the kind of record and the payload length) followed by the payload as it
+crossed the wire. Input reports, output reports and both directions of
+feature report exchanges are recorded, so a recording holds the handshake
+as well as the input.
+
+RecordingDevice wraps a hid.Device (or HidrawDevice) and records everything
+that goes through it; the drivers use it as they would the device. Replayer
+memory-maps a recording and iterates over it without copying, and replay()
+feeds the input reports through a ReportDecoder and a handler, either as
+fast as possible or at the pace they were recorded.
+
+    python3 bmd_record.py replay capture.bmdrec [--realtime] [--keymap F]
+"""
+
+import argparse
+import mmap
+import os
+import struct
+import time
+from collections import namedtuple
+
+MAGIC = b"BMDREC\x00\x01"
+
+INPUT = 0
+OUTPUT = 1
+FEATURE_SET = 2
+FEATURE_GET = 3
+KIND_NAMES = ("input", "output", "feature_set", "feature_get")
+
+# time (ns), kind, payload length
+REC_HEADER = struct.Struct("<QBH")
+
+
+class Recorder:
+    """Appends records to the file at `path`.
+
+    Writes are buffered; call flush() or close() to be sure they're on
+    disk.
+    """
+
+    def __init__(self, path, buffering=65536):
+        self.path = path
+        self.records = 0
+        self._file = open(path, "wb", buffering=buffering)
+        self._file.write(MAGIC)
+        self._start = time.monotonic_ns()
+
+    def record(self, kind, data):
+        # One write per record: the reader thread and the thread doing the
+        # handshake may both be recording.
+        header = REC_HEADER.pack(time.monotonic_ns() - self._start, kind, len(data))
+        self._file.write(header + data)
+        self.records += 1
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RecordingDevice:
+    """Passes calls through to `dev`, recording the reports in `recorder`.
+
+    It has the hid.Device methods the drivers use, plus readinto() if `dev`
+    has it; anything else is looked up on `dev`.
+    """
+
+    def __init__(self, dev, recorder):
+        self.dev = dev
+        self.recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self.dev, name)
+
+    def read(self, *args, **kwargs):
+        report = self.dev.read(*args, **kwargs)
+        if report:
+            self.recorder.record(INPUT, bytes(report))
+        return report
+
+    def readinto(self, buf):
+        n = self.dev.readinto(buf)
+        if n:
+            self.recorder.record(INPUT, bytes(buf[:n]))
+        return n
+
+    def write(self, data):
+        self.recorder.record(OUTPUT, bytes(data))
+        return self.dev.write(data)
+
+    def send_feature_report(self, data):
+        self.recorder.record(FEATURE_SET, bytes(data))
+        return self.dev.send_feature_report(data)
+
+    def get_feature_report(self, report_id, size):
+        data = self.dev.get_feature_report(report_id, size)
+        self.recorder.record(FEATURE_GET, bytes(data))
+        return data
+
+
+class Replayer:
+    """A recording, memory-mapped.
+
+    Iterating yields (time, kind, data) tuples, where `data` is a memoryview
+    into the mapping, valid until close(). They're plain tuples because
+    making namedtuples nearly doubles the cost of iterating.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < len(MAGIC):
+                raise ValueError(f"{path}: not a recording")
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[: len(MAGIC)] != MAGIC:
+            self._map.close()
+            raise ValueError(f"{path}: not a recording")
+        self._view = memoryview(self._map)
+
+    def __iter__(self):
+        view = self._view
+        end = len(view)
+        offset = len(MAGIC)
+        unpack = REC_HEADER.unpack_from
+        size = REC_HEADER.size
+        while offset + size <= end:
+            t, kind, length = unpack(view, offset)
+            offset += size
+            if offset + length > end:
+                # The recording was cut off part way through a record.
+                return
+            yield t, kind, view[offset : offset + length]
+            offset += length
+
+    def close(self):
+        try:
+            self._view.release()
+            self._map.close()
+        except BufferError:
+            # Records are still in use; the mapping goes when they do.
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+ReplayStats = namedtuple("ReplayStats", "reports events elapsed")
+
+
+def replay(path, handler, decoder=None, realtime=False):
+    """Decodes the input reports in a recording, calling `handler(events)`
+    for each; returns ReplayStats.
+
+    With `realtime`, reports are delivered at the times they were recorded,
+    relative to the first one; otherwise as fast as possible.
+    """
+    if decoder is None:
+        from bmd_decode import ReportDecoder
+
+        decoder = ReportDecoder()
+    decode = decoder.decode
+    reports = 0
+    events = 0
+    start = time.perf_counter()
+    first = None
+    with Replayer(path) as recording:
+        for t, kind, data in recording:
+            if kind != INPUT:
+                continue
+            if realtime:
+                if first is None:
+                    first = t
+                delay = (t - first) / 1e9 - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            decoded = decode(data)
+            reports += 1
+            events += len(decoded)
+            handler(decoded)
+            del data
+    return ReplayStats(reports, events, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("replay", help="decode and dispatch a recording")
+    p.add_argument("path")
+    p.add_argument("--realtime", action="store_true")
+    p.add_argument("--keymap", help="JSON keymap to dispatch through")
+    p = sub.add_parser("dump", help="list the records in a recording")
+    p.add_argument("path")
+    args = parser.parse_args()
+
+    if args.command == "dump":
+        with Replayer(args.path) as recording:
+            for t, kind, data in recording:
+                print(f"{t / 1e9:12.6f} {KIND_NAMES[kind]:<12} {bytes(data).hex()}")
+        return
+
+    from bmd_decode import ReportDecoder
+    from bmd_keymap import KeyResolver, compile_keymap, load_keymap
+    from bmd_macro import MacroRunner
+    from bmd_output import Injector
+
+    runner = MacroRunner(Injector(), maxsize=1 << 20)
+    keymap = compile_keymap(load_keymap(args.keymap) if args.keymap else {}, runner)
+    decoder = ReportDecoder()
+    resolver = KeyResolver()
+
+    def dispatch(events):
+        # As custom_bmd does, so layers and chords act as they did live.
+        for action, label in resolver.update(keymap, decoder.held):
+            action()
+
+    # The rate covers decoding and queueing the macros; they are played
+    # afterwards, and counted separately.
+    runner.start()
+    try:
+        stats = replay(args.path, dispatch, decoder, realtime=args.realtime)
+        runner.join()
+    finally:
+        runner.close()
+    print(
+        f"{stats.reports} reports, {stats.events} events in {stats.elapsed:.3f} s"
+        f" ({stats.reports / max(stats.elapsed, 1e-9) / 1e6:.2f} M reports/s)"
+    )
+    print(
+        f"{runner.played} macros played, {runner.dropped} dropped,"
+        f" {runner.failed} failed"
+    )
+    if runner.error:
+        print(f"Last macro failure: {runner.error!r}")
+
+
+if __name__ == "__main__":
+    main()
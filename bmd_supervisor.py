@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Hot-plug aware device supervision.
+
+Supervisor watches the device directory with inotify. When a panel's
+hidraw node appears it is opened and authenticated straight away, and when
+it disappears the device is closed; the caller just sees one continuous
+event stream, with DeviceAdded and DeviceRemoved markers in it, for as long
+as the process runs.
+
+Right after a node is created udev may not yet have given it its final
+permissions, so a failed open is retried on a short backoff, and also as
+soon as inotify reports an attribute change on the node; there is no fixed
+one-second wait anywhere.
+
+The device directory, the sysfs directory and the function used to open a
+device can all be replaced, so the whole thing can be exercised with FIFOs
+standing in for hidraw nodes.
+"""
+
+import asyncio
+import os
+import time
+from collections import namedtuple
+
+from bmd_async import AsyncSpeedEditor
+from bmd_fleet import is_panel
+from bmd_hidraw import SYSFS_HIDRAW, hidraw_info
+from bmd_inotify import (
+    IN_ATTRIB,
+    IN_CREATE,
+    IN_DELETE,
+    IN_MOVED_FROM,
+    IN_MOVED_TO,
+    Inotify,
+)
+from bmd_reauth import AsyncReauthScheduler
+
+DeviceAdded = namedtuple("DeviceAdded", "status")
+DeviceRemoved = namedtuple("DeviceRemoved", "error")
+
+# Delays, in seconds, between attempts to open a newly appeared node.
+RETRY_DELAYS = (0.01, 0.02, 0.05, 0.1, 0.2, 0.3)
+
+
+class Supervisor:
+    """Keeps every attached panel open and authenticated.
+
+    Each device's authentication is renewed in the background; the timings
+    are in `auth_metrics`, keyed by path.
+
+    `recoveries` records, for each successful connection after startup, the
+    time in seconds from the node appearing to the device being
+    authenticated.
+    """
+
+    def __init__(
+        self,
+        devdir="/dev",
+        sysfs=SYSFS_HIDRAW,
+        opener=AsyncSpeedEditor,
+        auth_timeout=2.0,
+        retry_delays=RETRY_DELAYS,
+        maxsize=1024,
+    ):
+        self.devdir = devdir
+        self.sysfs = sysfs
+        self.opener = opener
+        self.auth_timeout = auth_timeout
+        self.retry_delays = retry_delays
+        self.editors = {}
+        self.auth_metrics = {}
+        self.recoveries = []
+        self.dropped = 0
+        self._connecting = {}
+        # Paths whose editor _disappeared() closed and whose pump hasn't
+        # finished yet, and of those, the ones that have appeared again
+        # since, with when.
+        self._closing = set()
+        self._replugged = {}
+        self._tasks = set()
+        self._queue = asyncio.Queue(maxsize)
+        self._inotify = None
+        self._loop = None
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def _put(self, item):
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except asyncio.QueueFull:
+                self._queue.get_nowait()
+                self.dropped += 1
+
+    def _spawn(self, coro):
+        task = self._loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._inotify = Inotify()
+        self._inotify.add_watch(
+            self.devdir,
+            IN_CREATE | IN_DELETE | IN_ATTRIB | IN_MOVED_TO | IN_MOVED_FROM,
+        )
+        self._loop.add_reader(self._inotify.fileno(), self._on_inotify)
+
+        # Pick up whatever is already plugged in.
+        for name in sorted(os.listdir(self.devdir)):
+            if name.startswith("hidraw"):
+                self._appeared(name, None)
+
+    def _appeared(self, name, started):
+        path = os.path.join(self.devdir, name)
+        if path in self.editors:
+            if path in self._closing:
+                # Replugged before the old editor's pump has finished;
+                # connect once it has, so DeviceRemoved comes first.
+                self._replugged[path] = started
+            return
+        wake = self._connecting.get(path)
+        if wake:
+            # Already trying; retry now rather than at the next backoff.
+            wake.set()
+            return
+        wake = asyncio.Event()
+        self._connecting[path] = wake
+        self._spawn(self._connect(name, path, wake, started))
+
+    def _disappeared(self, name):
+        path = os.path.join(self.devdir, name)
+        editor = self.editors.get(path)
+        if editor:
+            self._closing.add(path)
+            editor.close()
+
+    def _on_inotify(self):
+        now = time.monotonic()
+        for event in self._inotify.read_events():
+            if not event.name.startswith("hidraw"):
+                continue
+            if event.mask & (IN_DELETE | IN_MOVED_FROM):
+                self._disappeared(event.name)
+            elif event.mask & (IN_CREATE | IN_MOVED_TO | IN_ATTRIB):
+                self._appeared(event.name, now)
+
+    async def _try_open(self, name, path):
+        info = hidraw_info(name, self.sysfs, self.devdir)
+        if info and not is_panel(info):
+            raise LookupError(path)
+        if not info:
+            return None
+        try:
+            editor = self.opener(path)
+        except OSError:
+            # Not readable yet, gone again, or busy (EBUSY, EIO while the
+            # device settles): retried like a failed handshake.
+            return None
+        try:
+            status = await asyncio.wait_for(
+                editor.authenticate(), self.auth_timeout
+            )
+        except (OSError, RuntimeError, asyncio.TimeoutError):
+            editor.close()
+            return None
+        return editor, status
+
+    async def _connect(self, name, path, wake, started):
+        try:
+            for delay in (0,) + tuple(self.retry_delays):
+                if delay:
+                    try:
+                        await asyncio.wait_for(wake.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                wake.clear()
+                if not os.path.exists(path):
+                    return
+                result = await self._try_open(name, path)
+                if result:
+                    break
+            else:
+                return
+        except LookupError:
+            # Some other kind of HID device.
+            return
+        finally:
+            del self._connecting[path]
+
+        editor, status = result
+        if started is not None:
+            self.recoveries.append(time.monotonic() - started)
+        self.editors[path] = editor
+        self._put((path, DeviceAdded(status)))
+        self._spawn(self._pump(path, editor, status))
+
+    async def _pump(self, path, editor, status):
+        reauth = AsyncReauthScheduler(editor, self.auth_timeout).start(status)
+        self.auth_metrics[path] = reauth.metrics
+        error = None
+        try:
+            async for event in editor.events():
+                self._put((path, event))
+        except OSError as e:
+            error = e
+        finally:
+            reauth.stop()
+            editor.close()
+            if self.editors.get(path) is editor:
+                del self.editors[path]
+            # Don't leave keys stuck down on whatever is consuming events.
+            for event in editor.decoder.release_all():
+                self._put((path, event))
+            self._put((path, DeviceRemoved(error)))
+            self._closing.discard(path)
+            if path in self._replugged and self._inotify is not None:
+                self._appeared(os.path.basename(path), self._replugged.pop(path))
+
+    async def events(self):
+        """Yields (path, event) pairs until the supervisor is closed."""
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                self._put(None)
+                return
+            yield item
+
+    def close(self):
+        if self._inotify is None:
+            return
+        self._loop.remove_reader(self._inotify.fileno())
+        self._inotify.close()
+        self._inotify = None
+        for task in list(self._tasks):
+            task.cancel()
+        for editor in list(self.editors.values()):
+            editor.close()
+        self.editors.clear()
+        self._put(None)
+
+
+async def _main():
+    async with Supervisor() as supervisor:
+        async for path, event in supervisor.events():
+            print(f"{path}: {event}")
+            if isinstance(event, DeviceAdded) and supervisor.recoveries:
+                ms = supervisor.recoveries[-1] * 1000
+                print(f"{path}: reconnected in {ms:.0f} ms")
+
+
+def main():
+    try:
+        asyncio.run(_main())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
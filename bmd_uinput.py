@@ -0,0 +1,203 @@
+"""
+Output through a virtual Linux input device.
+
+UinputInjector creates a keyboard-and-mouse device with /dev/uinput and
+writes evdev events to it. The kernel delivers those to X, Wayland
+compositors and the console alike, and writing them never waits for a
+display server.
+
+Events are packed into one buffer and written with a single write() per
+flush(), ending in one SYN_REPORT, so everything a HID report produces
+reaches readers as one evdev frame. Instead of /dev/uinput, the events can
+go to any file-like `writer` (see read_events() for decoding them again),
+which is how to check the output without the device.
+
+evdev deals in physical keys, not characters: text is typed as if the
+active layout were US QWERTY.
+"""
+
+import fcntl
+import os
+import struct
+from collections import namedtuple
+
+from bmd_output import MOUSE_BUTTONS, Injector
+
+UINPUT_PATH = "/dev/uinput"
+
+EV_SYN = 0x00
+EV_KEY = 0x01
+EV_REL = 0x02
+SYN_REPORT = 0
+REL_WHEEL = 0x08
+
+BTN_LEFT = 0x110
+BTN_RIGHT = 0x111
+BTN_MIDDLE = 0x112
+
+BUS_VIRTUAL = 0x06
+
+# struct input_event: a struct timeval (which the kernel fills in for
+# uinput), then type, code and value.
+_event = struct.Struct("@llHHi")
+EVENT_SIZE = _event.size
+
+InputEvent = namedtuple("InputEvent", "type code value")
+
+# Key codes from linux/input-event-codes.h, by pynput key name.
+KEY_CODES = {
+    "esc": 1, "backspace": 14, "tab": 15, "enter": 28, "ctrl": 29,
+    "ctrl_l": 29, "shift": 42, "shift_l": 42, "shift_r": 54, "alt": 56,
+    "alt_l": 56, "space": 57, "caps_lock": 58, "num_lock": 69,
+    "scroll_lock": 70, "ctrl_r": 97, "print_screen": 99, "alt_r": 100,
+    "alt_gr": 100, "home": 102, "up": 103, "page_up": 104, "left": 105,
+    "right": 106, "end": 107, "down": 108, "page_down": 109, "insert": 110,
+    "delete": 111, "media_volume_mute": 113, "media_volume_down": 114,
+    "media_volume_up": 115, "pause": 119, "cmd": 125, "cmd_l": 125,
+    "cmd_r": 126, "menu": 127, "media_next": 163, "media_play_pause": 164,
+    "media_previous": 165,
+}
+KEY_CODES.update({f"f{n}": 58 + n for n in range(1, 11)})
+KEY_CODES.update({"f11": 87, "f12": 88})
+KEY_CODES.update({f"f{n}": 170 + n for n in range(13, 25)})
+
+KEY_LEFTSHIFT = KEY_CODES["shift"]
+
+
+def _us_layout():
+    # (character, code) pairs for the keys of a US keyboard, unshifted and
+    # shifted.
+    rows = [
+        (2, "1234567890-=", "!@#$%^&*()_+"),
+        (16, "qwertyuiop[]", "QWERTYUIOP{}"),
+        (30, "asdfghjkl;'`", 'ASDFGHJKL:"~'),
+        (43, "\\zxcvbnm,./", "|ZXCVBNM<>?"),
+    ]
+    chars = {" ": (57, False), "\n": (28, False), "\t": (15, False)}
+    for first, plain, shifted in rows:
+        for i, (p, s) in enumerate(zip(plain, shifted)):
+            chars[p] = (first + i, False)
+            chars[s] = (first + i, True)
+    return chars
+
+
+# name -> (key code, shift)
+KEYS = _us_layout()
+KEYS.update((name, (code, False)) for name, code in KEY_CODES.items())
+
+BUTTON_CODES = {"left": BTN_LEFT, "middle": BTN_MIDDLE, "right": BTN_RIGHT}
+assert set(BUTTON_CODES) == set(MOUSE_BUTTONS)
+
+_IOC_WRITE = 1
+
+
+def _ioc(dir, nr, size):
+    return (dir << 30) | (size << 16) | (ord("U") << 8) | nr
+
+
+UI_DEV_CREATE = _ioc(0, 1, 0)
+UI_DEV_DESTROY = _ioc(0, 2, 0)
+# struct uinput_setup: struct input_id, char name[80], u32 ff_effects_max.
+_setup = struct.Struct("@HHHH80sI")
+UI_DEV_SETUP = _ioc(_IOC_WRITE, 3, _setup.size)
+UI_SET_EVBIT = _ioc(_IOC_WRITE, 100, 4)
+UI_SET_KEYBIT = _ioc(_IOC_WRITE, 101, 4)
+UI_SET_RELBIT = _ioc(_IOC_WRITE, 102, 4)
+
+
+def read_events(data):
+    """Decodes a buffer of input_event structs into InputEvents."""
+    return [
+        InputEvent(*e[2:]) for e in _event.iter_unpack(bytes(data))
+    ]
+
+
+class UinputDevice:
+    """A virtual input device, created through /dev/uinput."""
+
+    def __init__(self, name="Speed Editor", path=UINPUT_PATH):
+        self.fd = os.open(path, os.O_WRONLY | os.O_CLOEXEC)
+        try:
+            fcntl.ioctl(self.fd, UI_SET_EVBIT, EV_KEY)
+            fcntl.ioctl(self.fd, UI_SET_EVBIT, EV_REL)
+            fcntl.ioctl(self.fd, UI_SET_EVBIT, EV_SYN)
+            for code in sorted({c for c, _ in KEYS.values()}):
+                fcntl.ioctl(self.fd, UI_SET_KEYBIT, code)
+            for code in BUTTON_CODES.values():
+                fcntl.ioctl(self.fd, UI_SET_KEYBIT, code)
+            fcntl.ioctl(self.fd, UI_SET_RELBIT, REL_WHEEL)
+            setup = _setup.pack(
+                BUS_VIRTUAL, 0x1edb, 0x0001, 1, name.encode()[:79], 0
+            )
+            fcntl.ioctl(self.fd, UI_DEV_SETUP, setup)
+            fcntl.ioctl(self.fd, UI_DEV_CREATE)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def write(self, data):
+        return os.write(self.fd, data)
+
+    def close(self):
+        if self.fd is not None:
+            fcntl.ioctl(self.fd, UI_DEV_DESTROY)
+            os.close(self.fd)
+            self.fd = None
+
+
+class UinputInjector(Injector):
+    """Writes key, button and wheel events to a uinput device.
+
+    `writer` defaults to a new UinputDevice; anything with a write() method
+    will do. `names` are checked up front, so a keymap naming a key evdev
+    can't type fails here rather than on the keypress.
+    """
+
+    def __init__(self, names=(), writer=None):
+        self.check(names)
+        self.writer = writer if writer is not None else UinputDevice()
+        self.buffer = bytearray()
+        self.reports = 0
+
+    def check(self, names):
+        missing = sorted(n for n in names if n not in KEYS)
+        if missing:
+            raise ValueError(f"no evdev key for {', '.join(map(repr, missing))}")
+
+    def _emit(self, type, code, value):
+        self.buffer += _event.pack(0, 0, type, code, value)
+
+    def key(self, name, pressed):
+        try:
+            code, shift = KEYS[name]
+        except KeyError:
+            raise ValueError(f"no evdev key for {name!r}") from None
+        if pressed:
+            if shift:
+                self._emit(EV_KEY, KEY_LEFTSHIFT, 1)
+            self._emit(EV_KEY, code, 1)
+        else:
+            self._emit(EV_KEY, code, 0)
+            if shift:
+                self._emit(EV_KEY, KEY_LEFTSHIFT, 0)
+
+    def click(self, button):
+        code = BUTTON_CODES[button]
+        self._emit(EV_KEY, code, 1)
+        self._emit(EV_KEY, code, 0)
+
+    def scroll(self, steps):
+        # REL_WHEEL is positive for up.
+        self._emit(EV_REL, REL_WHEEL, -steps)
+
+    def flush(self):
+        if not self.buffer:
+            return
+        self._emit(EV_SYN, SYN_REPORT, 0)
+        self.writer.write(self.buffer)
+        self.buffer.clear()
+        self.reports += 1
+
+    def close(self):
+        self.flush()
+        self.writer.close()
@@ -0,0 +1,226 @@
+"""
+X11 output through the XTest extension, batched.
+
+pynput, like main.cc, waits for the X server after every event: pynput
+syncs each press and release, and main.cc XSyncs around every modifier,
+every key and every wheel step, and remaps unbound keysyms with an
+XChangeKeyboardMapping and XSync on every press. Each of those is a round
+trip to the server.
+
+X11Injector does all the keysym lookups once, when it's created: the
+keyboard mapping is fetched with one request, every keysym the keymap uses
+is resolved to a keycode (and whether it needs shift), and keysyms with no
+key are bound to spare keycodes in one batch followed by a single sync.
+After that, events are only queued on the connection, and flush() writes
+everything one HID report produced at once without waiting for a reply, so
+a keypress costs no round trips at all.
+
+Keysyms that weren't known up front (e.g. text typed by a macro) are bound
+to one of a few reserved keycodes in turn, passing over any that are held
+down. The remapping is queued in front of the key events, which the server
+handles in order, so that doesn't need a round trip either.
+"""
+
+from Xlib import X, XK, display as xdisplay
+from Xlib.ext import xtest
+
+from bmd_output import Injector
+
+# pynput key names whose X keysym is called something else.
+KEYSYM_NAMES = {
+    "alt": "Alt_L",
+    "alt_l": "Alt_L",
+    "alt_r": "Alt_R",
+    "alt_gr": "ISO_Level3_Shift",
+    "backspace": "BackSpace",
+    "caps_lock": "Caps_Lock",
+    "cmd": "Super_L",
+    "cmd_l": "Super_L",
+    "cmd_r": "Super_R",
+    "ctrl": "Control_L",
+    "ctrl_l": "Control_L",
+    "ctrl_r": "Control_R",
+    "delete": "Delete",
+    "down": "Down",
+    "end": "End",
+    "enter": "Return",
+    "esc": "Escape",
+    "home": "Home",
+    "insert": "Insert",
+    "left": "Left",
+    "media_next": "XF86AudioNext",
+    "media_play_pause": "XF86AudioPlay",
+    "media_previous": "XF86AudioPrev",
+    "media_volume_down": "XF86AudioLowerVolume",
+    "media_volume_mute": "XF86AudioMute",
+    "media_volume_up": "XF86AudioRaiseVolume",
+    "menu": "Menu",
+    "num_lock": "Num_Lock",
+    "page_down": "Next",
+    "page_up": "Prior",
+    "pause": "Pause",
+    "print_screen": "Print",
+    "right": "Right",
+    "scroll_lock": "Scroll_Lock",
+    "shift": "Shift_L",
+    "shift_l": "Shift_L",
+    "shift_r": "Shift_R",
+    "space": "space",
+    "tab": "Tab",
+    "up": "Up",
+}
+
+BUTTONS = {"left": 1, "middle": 2, "right": 3}
+SCROLL_UP = 4
+SCROLL_DOWN = 5
+
+
+def keysym(name):
+    """Returns the keysym for a pynput key name or a single character."""
+    if len(name) == 1:
+        c = ord(name)
+        if 0x20 <= c <= 0x7e or 0xa0 <= c <= 0xff:
+            return c
+        if c == 0x0a or c == 0x0d:
+            return XK.XK_Return
+        if c == 0x09:
+            return XK.XK_Tab
+        return 0x01000000 | c
+    sym = XK.string_to_keysym(KEYSYM_NAMES.get(name, name.capitalize()))
+    if not sym:
+        raise ValueError(f"unknown key {name!r}")
+    return sym
+
+
+class X11Injector(Injector):
+    """Sends keyboard and mouse events to an X server with XTest.
+
+    `names` are the keys to prepare for; see KEY_MAP and keymap_keys().
+    `spare` keycodes are kept back for keys that weren't in `names`.
+    """
+
+    def __init__(self, names=(), display=None, spare=4):
+        self.display = display or xdisplay.Display()
+        if not self.display.has_extension("XTEST"):
+            raise RuntimeError("the X server has no XTEST extension")
+        self.shift = self.display.keysym_to_keycode(XK.XK_Shift_L)
+
+        # name -> (keycode, shift)
+        self._keys = {}
+        self._bound = []
+        self._reserved = []
+        self._next_reserved = 0
+        # Keycodes pressed and not yet released.
+        self._down = set()
+        self._load(names, spare)
+
+    def _load(self, names, spare):
+        d = self.display
+        first = d.display.info.min_keycode
+        count = d.display.info.max_keycode - first + 1
+        mapping = d.get_keyboard_mapping(first, count)
+        free = [
+            first + i
+            for i, syms in enumerate(mapping)
+            if not any(syms)
+        ]
+        width = len(mapping[0]) if mapping else 2
+
+        found = {}
+        for i, syms in enumerate(mapping):
+            for column in (0, 1):
+                if column < len(syms) and syms[column] and syms[column] not in found:
+                    found[syms[column]] = (first + i, column == 1)
+
+        unbound = []
+        for name in sorted(set(names)):
+            sym = keysym(name)
+            if sym in found:
+                self._keys[name] = found[sym]
+            else:
+                unbound.append((name, sym))
+
+        if len(unbound) + spare > len(free):
+            raise RuntimeError(
+                f"not enough free keycodes: need {len(unbound) + spare}, "
+                f"have {len(free)}"
+            )
+        for (name, sym), keycode in zip(unbound, free):
+            self._keys[name] = (keycode, False)
+            self._bind(keycode, sym, width)
+            self._bound.append(keycode)
+        self._reserved = free[len(unbound):len(unbound) + spare]
+        self._width = width
+        if self._bound:
+            d.sync()
+
+    def _bind(self, keycode, sym, width):
+        # Shifted or not, the key produces `sym`.
+        self.display.change_keyboard_mapping(keycode, [(sym,) * width])
+
+    def _lookup(self, name):
+        key = self._keys.get(name)
+        if key is not None:
+            return key
+        # Rebinding a keycode that is held down would release a different
+        # key than was pressed, so those are passed over.
+        count = len(self._reserved)
+        for i in range(count):
+            n = (self._next_reserved + i) % count
+            if self._reserved[n] not in self._down:
+                break
+        else:
+            raise RuntimeError(f"no keycode for {name!r}")
+        keycode = self._reserved[n]
+        self._next_reserved = (n + 1) % count
+        for other, (code, _) in list(self._keys.items()):
+            if code == keycode:
+                del self._keys[other]
+        self._bind(keycode, keysym(name), self._width)
+        self._keys[name] = key = (keycode, False)
+        return key
+
+    def key(self, name, pressed):
+        keycode, shift = self._lookup(name)
+        d = self.display
+        if pressed:
+            if shift:
+                xtest.fake_input(d, X.KeyPress, self.shift)
+            xtest.fake_input(d, X.KeyPress, keycode)
+            self._down.add(keycode)
+        else:
+            xtest.fake_input(d, X.KeyRelease, keycode)
+            self._down.discard(keycode)
+            if shift:
+                xtest.fake_input(d, X.KeyRelease, self.shift)
+
+    def click(self, button):
+        d = self.display
+        button = BUTTONS[button]
+        xtest.fake_input(d, X.ButtonPress, button)
+        xtest.fake_input(d, X.ButtonRelease, button)
+
+    def scroll(self, steps):
+        d = self.display
+        button = SCROLL_DOWN if steps > 0 else SCROLL_UP
+        for _ in range(abs(steps)):
+            xtest.fake_input(d, X.ButtonPress, button)
+            xtest.fake_input(d, X.ButtonRelease, button)
+
+    def check(self, names):
+        # Keys outside the prepared set are bound to a spare keycode when
+        # they're sent; all they need is a keysym.
+        for name in names:
+            keysym(name)
+
+    def flush(self):
+        self.display.flush()
+
+    def close(self):
+        """Unbinds the keycodes this injector took and disconnects."""
+        d = self.display
+        for keycode in self._bound + self._reserved:
+            d.change_keyboard_mapping(keycode, [(X.NoSymbol,) * self._width])
+        self._bound = []
+        self._reserved = []
+        d.close()
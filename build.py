@@ -8,8 +8,13 @@ package(name="libfakekey", package="libfakekey")
 
 cxxprogram(
     name="bmdkey",
-    srcs=["src/main.cc"],
+    srcs=["src/main.cc", "src/auth.h"],
     deps=["+hidapi-libusb", "+fmt", "+libfakekey"],
 )
 
+cxxprogram(
+    name="authvectors",
+    srcs=["src/authvectors.cc", "src/auth.h"],
+)
+
 export(name="all", items={"bmdkey": "+bmdkey"})
@@ -1,19 +1,159 @@
+"""
+Embeds a file in a C/C++ program as `const uint8_t symbol[]` and
+`const size_t symbol_len`.
+
+    _objectify.py [-o OUT.h] <file> <symbol>
+    _objectify.py -o OUT.h --incbin OUT.S <file> <symbol>
+
+By default the data is written as an initializer, which is portable but
+slow for the compiler to parse once the file is more than a few hundred
+KB. With --incbin, OUT.h only declares the symbols and OUT.S defines them
+with the assembler's .incbin, which reads the file as it is (GNU as, ELF
+targets).
+
+The first line of each output carries a hash of the input and the options.
+If OUT.h (and OUT.S) already have the same hash they are left alone, so
+that what includes them isn't rebuilt just because the input was touched.
+"""
+
+import argparse
+import binascii
+import hashlib
+import os
 import sys
-from functools import partial
-
-if len(sys.argv) != 3:
-    sys.exit("Usage: %s <file> <symbol>" % sys.argv[0])
-filename = sys.argv[1]
-symbol = sys.argv[2]
-
-print("const uint8_t " + symbol + "[] = {")
-n = 0
-with open(filename, "rb") as in_file:
-    for c in iter(partial(in_file.read, 1), b""):
-        print("0x%02X," % ord(c), end="")
-        n += 1
-        if n % 16 == 0:
-            print()
-print("};")
-
-print("const size_t " + symbol + "_len = sizeof(" + symbol + ");")
+
+# Bumped when the output changes for the same input.
+VERSION = 2
+
+# Bytes per row of the initializer, and rows formatted at a time.
+ROW = 16
+CHUNK_ROWS = 65536
+
+_TEMPLATE = b"0x00," * ROW + b"\n"
+
+
+def c_rows(data):
+    """Formats `data`, a multiple of ROW bytes long, as initializer rows
+    ("0x1F,0x8B,...,\\n").
+
+    Rather than format each byte, this hexlifies the whole chunk and copies
+    every byte's two digits into place in a template with slice
+    assignments, 32 of them per chunk.
+    """
+    rows = len(data) // ROW
+    digits = binascii.hexlify(data).upper()
+    out = bytearray(_TEMPLATE) * rows
+    stride = len(_TEMPLATE)
+    for j in range(ROW):
+        out[j * 5 + 2 :: stride] = digits[2 * j :: 2 * ROW]
+        out[j * 5 + 3 :: stride] = digits[2 * j + 1 :: 2 * ROW]
+    return out
+
+
+def write_c(out, data, symbol):
+    out.write(b"const uint8_t %s[] = {\n" % symbol)
+    view = memoryview(data)
+    whole = len(data) - len(data) % ROW
+    step = ROW * CHUNK_ROWS
+    for start in range(0, whole, step):
+        out.write(c_rows(view[start : min(start + step, whole)]))
+    out.write(b"".join(b"0x%02X," % c for c in view[whole:]))
+    out.write(b"};\n")
+    out.write(b"const size_t %s_len = sizeof(%s);\n" % (symbol, symbol))
+
+
+def write_declarations(out, symbol):
+    out.write(b"extern const uint8_t %s[];\n" % symbol)
+    out.write(b"extern const size_t %s_len;\n" % symbol)
+
+
+def write_incbin(out, filename, symbol):
+    path = filename.replace("\\", "\\\\").replace('"', '\\"').encode()
+    out.write(
+        b"\t.section .rodata\n"
+        b"\t.global %(s)s\n"
+        b"\t.type %(s)s, @object\n"
+        b"\t.balign 16\n"
+        b"%(s)s:\n"
+        b'\t.incbin "%(p)s"\n'
+        b"%(s)s_end:\n"
+        b"\t.size %(s)s, %(s)s_end - %(s)s\n"
+        b"\t.global %(s)s_len\n"
+        b"\t.type %(s)s_len, @object\n"
+        b"\t.balign 8\n"
+        b"%(s)s_len:\n"
+        b"\t.dc.a %(s)s_end - %(s)s\n"
+        b"\t.size %(s)s_len, . - %(s)s_len\n"
+        b'\t.section .note.GNU-stack,"",@progbits\n' % {b"s": symbol, b"p": path}
+    )
+
+
+def stamp(path):
+    """Returns the first line of `path`, or None."""
+    try:
+        with open(path, "rb") as f:
+            return f.readline()
+    except FileNotFoundError:
+        return None
+
+
+def write_header(out, line, data, symbol, incbin):
+    out.write(line)
+    if incbin:
+        out.write(b"#include <stdint.h>\n#include <stddef.h>\n")
+        out.write(b'#ifdef __cplusplus\nextern "C" {\n#endif\n')
+        write_declarations(out, symbol)
+        out.write(b"#ifdef __cplusplus\n}\n#endif\n")
+    else:
+        write_c(out, data, symbol)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--output", help="the header (default: stdout)")
+    parser.add_argument("--incbin", metavar="ASM", help="write an assembly file")
+    parser.add_argument("file")
+    parser.add_argument("symbol")
+    args = parser.parse_args()
+    if args.incbin and not args.output:
+        parser.error("--incbin needs -o")
+
+    with open(args.file, "rb") as f:
+        data = f.read()
+    symbol = args.symbol.encode()
+
+    digest = hashlib.sha256(data)
+    digest.update(b"%d %s %d" % (VERSION, symbol, bool(args.incbin)))
+    if args.incbin:
+        # The assembly file names the input.
+        digest.update(os.path.abspath(args.file).encode())
+    line = b"/* objectify %s */\n" % digest.hexdigest().encode()
+
+    outputs = [args.output] + ([args.incbin] if args.incbin else [])
+    if args.output and all(stamp(p) == line for p in outputs):
+        return
+
+    if not args.output:
+        write_header(sys.stdout.buffer, line, data, symbol, args.incbin)
+        return
+
+    # Neither output is replaced until both are complete, so a run that is
+    # interrupted or fails never leaves a partial file behind a valid stamp.
+    temps = [p + ".tmp" for p in outputs]
+    try:
+        with open(temps[0], "wb") as out:
+            write_header(out, line, data, symbol, args.incbin)
+        if args.incbin:
+            with open(temps[1], "wb") as out:
+                out.write(line)
+                write_incbin(out, os.path.abspath(args.file), symbol)
+        for temp, path in zip(temps, outputs):
+            os.replace(temp, path)
+    finally:
+        for temp in temps:
+            if os.path.exists(temp):
+                os.unlink(temp)
+
+
+if __name__ == "__main__":
+    main()
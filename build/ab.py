@@ -3,18 +3,20 @@ from os.path import *
 from types import SimpleNamespace
 import argparse
 import functools
+import hashlib
+import io
+import json
+import os
 import importlib
-import importlib.abc
 import importlib.util
-import inspect
 import re
 import sys
 import builtins
 import string
 import fnmatch
-import traceback
 
 defaultGlobals = {}
+loadedFiles = []
 targets = {}
 unmaterialisedTargets = set()
 materialisingStack = []
@@ -30,6 +32,7 @@ def new_import(name, *args, **kwargs):
         path = name.replace(".", "/") + ".py"
         if isfile(path):
             sys.stderr.write(f"loading {path}\n")
+            loadedFiles.append(path)
             loader = importlib.machinery.SourceFileLoader(name, path)
 
             spec = importlib.util.spec_from_loader(
@@ -61,10 +64,18 @@ class Invocation:
     traits = None
     attr = None
     attrdeps = None
+    attrusers = None
+    attrcache = None
 
     def __init__(self):
         self.attr = SimpleNamespace()
+        # attr -> the targets bubbling it into this one, in the order they
+        # were added (a dict used as an ordered set)
         self.attrdeps = SimpleNamespace()
+        # attr -> the targets this one bubbles into; the reverse of attrdeps
+        self.attrusers = {}
+        # attr -> bubbledattrs(attr), once it has been asked for
+        self.attrcache = {}
         self.traits = set()
 
     def __eq__(self, other):
@@ -121,19 +132,65 @@ class Invocation:
 
     def bubbleattr(self, attr, xs):
         xs = targetsof(xs, cwd=self.cwd)
-        a = set()
-        if hasattr(self.attrdeps, attr):
-            a = getattr(self.attrdeps, attr)
-
+        a = getattr(self.attrdeps, attr, {})
         for x in xs:
-            a.add(x)
+            a[x] = None
+            x.attrusers.setdefault(attr, set()).add(self)
         setattr(self.attrdeps, attr, a)
 
+        # This target's closure has changed, and so has that of everything
+        # which bubbles it. Targets are normally given their deps before
+        # anything uses them, so there is rarely anything to walk.
+        pending = [self]
+        seen = set()
+        while pending:
+            t = pending.pop()
+            if t not in seen:
+                seen.add(t)
+                t.attrcache.pop(attr, None)
+                pending.extend(t.attrusers.get(attr, ()))
+
+    # Returns this target and everything bubbled into it for attr, each
+    # once, in depth-first order, and their values of attr in that order.
+    # Targets are counted once rather than values, as multi-word flags like
+    # "-framework A" would lose words otherwise. The result is cached until
+    # bubbleattr() changes the graph under this target, so the flags asked
+    # for once per source file are only gathered the first time. The walk
+    # uses a stack rather than recursion, so deep chains of deps are fine.
+    def bubbledclosure(self, attr):
+        cached = self.attrcache.get(attr)
+        if cached is None:
+            closure = {}
+            pending = [self]
+            while pending:
+                t = pending.pop()
+                if t in closure:
+                    continue
+                below = t.attrcache.get(attr)
+                if below is not None:
+                    # Everything under t comes next, as it would have if
+                    # the walk had gone on down.
+                    closure.update(dict.fromkeys(below[0]))
+                    continue
+                closure[t] = None
+                pending.extend(reversed(list(getattr(t.attrdeps, attr, {}))))
+            targets = list(closure)
+            values = [v for t in targets for v in getattr(t.attr, attr, [])]
+            cached = self.attrcache[attr] = (targets, values)
+        return cached
+
+    def bubbledattrs(self, attr):
+        return self.bubbledclosure(attr)[1]
+
     def __repr__(self):
         return "'%s'" % self.name
 
 
 def Rule(func):
+    # inspect is only imported once something defines a rule, which a run
+    # that uses the cache never does.
+    import inspect
+
     sig = inspect.signature(func)
 
     @functools.wraps(func)
@@ -232,7 +289,14 @@ class TargetsMap(Type):
 def flatten(*xs):
     def recurse(xs):
         for x in xs:
-            if isinstance(x, Iterable) and not isinstance(x, (str, bytes)):
+            # Checking against Iterable is slow, and nearly everything here
+            # is a string or a list.
+            t = type(x)
+            if t is str:
+                yield x
+            elif t is list or t is tuple:
+                yield from recurse(x)
+            elif isinstance(x, Iterable) and not isinstance(x, (str, bytes)):
                 yield from recurse(x)
             else:
                 yield x
@@ -338,21 +402,13 @@ def filenameof(x):
 
 
 def bubbledattrsof(x, attr):
-    x = targetsof(x)
-    alltargets = set()
-    pending = set(x) if isinstance(x, Iterable) else {x}
-    while pending:
-        t = pending.pop()
-        if t not in alltargets:
-            alltargets.add(t)
-            if hasattr(t.attrdeps, attr):
-                pending.update(getattr(t.attrdeps, attr))
-
-    values = []
-    for t in alltargets:
-        if hasattr(t.attr, attr):
-            values += getattr(t.attr, attr)
-    return values
+    xs = targetsof(x)
+    if len(xs) == 1:
+        return list(xs[0].bubbledattrs(attr))
+    closure = {}
+    for t in xs:
+        closure.update(dict.fromkeys(t.bubbledclosure(attr)[0]))
+    return [v for t in closure for v in getattr(t.attr, attr, [])]
 
 
 def stripext(path):
@@ -364,22 +420,31 @@ def emit(*args):
     outputFp.write("\n")
 
 
-def templateexpand(s, invocation):
-    class Formatter(string.Formatter):
-        def get_field(self, name, a1, a2):
-            return (
-                eval(name, invocation.callback.__globals__, invocation.args),
-                False,
-            )
+class TemplateFormatter(string.Formatter):
+    def __init__(self, invocation):
+        self.invocation = invocation
 
-        def format_field(self, value, format_spec):
-            if type(self) == str:
-                return value
-            return " ".join(
-                [templateexpand(f, invocation) for f in filenamesof(value)]
-            )
+    def get_field(self, name, a1, a2):
+        invocation = self.invocation
+        return (
+            eval(name, invocation.callback.__globals__, invocation.args),
+            False,
+        )
+
+    def format_field(self, value, format_spec):
+        if type(self) == str:
+            return value
+        return " ".join(
+            [templateexpand(f, self.invocation) for f in filenamesof(value)]
+        )
 
-    return Formatter().format(s)
+
+def templateexpand(s, invocation):
+    # Every flag and filename substituted into a command is expanded in
+    # turn, and most have nothing to expand.
+    if "{" not in s and "}" not in s:
+        return s
+    return TemplateFormatter(invocation).format(s)
 
 
 def emitter_rule(rule, ins, outs, deps=[]):
@@ -522,12 +587,52 @@ def loadbuildfile(filename):
 
 
 def load(filename):
+    import inspect
+
     loadbuildfile(filename)
     callerglobals = inspect.stack()[1][0].f_globals
     for k, v in defaultGlobals.items():
         callerglobals[k] = v
 
 
+# The generated makefile only depends on the build files (and the modules
+# they use, which are loaded the same way), ab.py itself and the arguments.
+# So the output is cached next to it with the content hashes of every file
+# that was loaded, and if none of them has changed the next run writes the
+# cached output without loading anything. Build files which look at the
+# tree itself (globbing for sources, say) are no different from before:
+# make only reruns ab.py when a build file changes either way.
+
+
+def filehash(path):
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def loadcache(cachefile, key):
+    try:
+        with open(cachefile, "rt") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cache.get("key") != key:
+        return None
+    for path, h in cache["files"].items():
+        if filehash(path) != h:
+            return None
+    return cache["output"]
+
+
+def savecache(cachefile, key, output):
+    files = {path: filehash(path) for path in [__file__] + loadedFiles}
+    with open(cachefile + ".tmp", "wt") as f:
+        json.dump({"key": key, "files": files, "output": output}, f)
+    os.replace(cachefile + ".tmp", cachefile)
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("-o", "--output")
@@ -537,8 +642,20 @@ def main():
     if not args.targets:
         raise ABException("no targets supplied")
 
+    key = {
+        "files": args.files,
+        "targets": args.targets,
+        "hashseed": os.environ.get("PYTHONHASHSEED"),
+    }
+    cachefile = args.output + ".cache"
+    output = loadcache(cachefile, key)
+    if output is not None:
+        with open(args.output, "wt") as f:
+            f.write(output)
+        return
+
     global outputFp
-    outputFp = open(args.output, "wt")
+    outputFp = io.StringIO()
 
     for k in ("Rule", "Targets", "load", "filenamesof", "stripext"):
         defaultGlobals[k] = globals()[k]
@@ -558,5 +675,10 @@ def main():
         targets[s].materialise()
     emit("AB_LOADED = 1\n")
 
+    output = outputFp.getvalue()
+    with open(args.output, "wt") as f:
+        f.write(output)
+    savecache(cachefile, key, output)
+
 
 main()
@@ -3,12 +3,20 @@ from os.path import basename
 
 
 @Rule
-def objectify(self, name, src: Target, symbol):
+def objectify(self, name, src: Target, symbol, incbin=False):
+    """Embeds `src` as `symbol`, in a header to include or, with `incbin`,
+    a header declaring it and an assembly file to add to the program's
+    srcs. The outputs are only rewritten when `src`'s contents change."""
+    outs = [basename(filenameof(src)) + ".h"]
+    command = "$(PYTHON) {ins[0]} -o {outs[0]} {ins[1]} " + symbol
+    if incbin:
+        outs += [basename(filenameof(src)) + ".S"]
+        command += " --incbin {outs[1]}"
     normalrule(
         replaces=self,
         ins=["build/_objectify.py", src],
-        outs=[basename(filenameof(src)) + ".h"],
-        commands=["$(PYTHON) {ins[0]} {ins[1]} " + symbol + " > {outs}"],
+        outs=outs,
+        commands=[command],
         label="OBJECTIFY",
     )
 
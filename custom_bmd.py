@@ -1,10 +1,20 @@
-import hid
 import struct
+import threading
 import time
-import enum
-from typing import List
-from pynput.keyboard import Controller as KeyboardController, Key
-from pynput.mouse import Controller as MouseController, Button
+from bmd_decode import ReportDecoder
+from bmd_handshake import Handshake
+from bmd_hidraw import CACHE_DIR, HidrawDevice, find_hidraw
+from bmd_jog import DEFAULT_ACCELERATION, JogEngine
+from bmd_keymap import KeymapError, KeymapWatcher, KeyResolver, compile_keymap, load_keymap, validate_keymap
+from bmd_log import DEBUG, INFO, BinarySink, ConsoleSink, EventLog, JsonlSink
+from bmd_leds import LedManager, leds_for
+from bmd_macro import MacroRunner
+from bmd_metrics import Metrics, MetricsServer
+from bmd_output import Injector, make_injector
+from bmd_protocol import USAGE_PAGE, USB_VID, JogEvent, JogLed, JogMode, Led, SpeedEditorKey, UnknownReport, authenticate
+from bmd_reader import HidReader
+from bmd_record import Recorder, RecordingDevice
+from bmd_reauth import AuthMetrics, ReauthScheduler
 
 # ==================================================================================
 # STEP 1: VERIFY YOUR PRODUCT ID
@@ -21,120 +31,346 @@ YOUR_PRODUCT_ID = 0xBD3D
 # STEP 2: DEFINE YOUR CUSTOM KEY MAP
 #
 # This is where you define what each button on the Speed Editor should do.
+# Keys and mouse buttons are given by their pynput names ('f5', 'ctrl',
+# 'enter', 'right'...) or, for keys, by the character they type.
 # ==================================================================================
 
 KEY_MAP = {
     # --- Example Mappings ---
-    'SMART_INSRT': {'type': 'key', 'action': Key.f5},
+    'SMART_INSRT': {'type': 'key', 'action': 'f5'},
     'APPND':       {'type': 'string', 'action': 'This is my custom text!'},
-    'RIPL_OWR':    {'type': 'mouse_click', 'action': Button.right},
-    'CLOSE_UP':    {'type': 'combo', 'action': [Key.ctrl, 'c']},
-    'PLACE_ON_TOP':{'type': 'combo', 'action': [Key.ctrl, 'v']},
+    'RIPL_OWR':    {'type': 'mouse_click', 'action': 'right'},
+    'CLOSE_UP':    {'type': 'combo', 'action': ['ctrl', 'c']},
+    'PLACE_ON_TOP':{'type': 'combo', 'action': ['ctrl', 'v']},
 
     # --- Add Your Own Mappings Below ---
     'CAM1':        {'type': 'key', 'action': '1'},
     'CAM2':        {'type': 'key', 'action': '2'},
     'CAM3':        {'type': 'key', 'action': '3'},
     'SPLIT':       {'type': 'string', 'action': 'Split command executed.'},
-    'SNAP':        {'type': 'key', 'action': Key.enter},
+    'SNAP':        {'type': 'key', 'action': 'enter'},
+
+    # --- Layers: while SOURCE is held, the CAM keys send F1-F3 instead ---
+    'layers': {
+        'SOURCE': {
+            'CAM1':    {'type': 'key', 'action': 'f1'},
+            'CAM2':    {'type': 'key', 'action': 'f2'},
+            'CAM3':    {'type': 'key', 'action': 'f3'},
+        },
+    },
+
+    # --- Chords: pressing IN and OUT together undoes ---
+    # Keys that are part of a chord act when they're released instead of
+    # when they're pressed, and not at all if the chord was pressed.
+    'chords': {
+        'IN+OUT':      {'type': 'combo', 'action': ['ctrl', 'z']},
+    },
 }
 
+# Alternatively, the path of a JSON file in the same format. It is used
+# instead of KEY_MAP and reloaded whenever it's saved; see keymap.example.json.
+KEYMAP_FILE = None
+
+# Actions are carried out in the background, in order. At most this many
+# can be waiting; presses beyond that are ignored. Pressing a key again while
+# its action is still running (e.g. typing a long string) stops it.
+MACRO_QUEUE_SIZE = 16
+
+# Set this to a file name to record everything sent to and received from the
+# device, for replaying later with `python3 bmd_record.py replay FILE`.
+RECORD_FILE = None
+
+# Set this to serve metrics in the Prometheus text format, either on a local
+# TCP port, e.g. ('127.0.0.1', 9477), or on a Unix socket, e.g.
+# '/tmp/speed-editor-metrics.sock'.
+METRICS_ADDRESS = None
+
+# The panel's LEDs show what the script is doing: keys are lit while they're
+# held, JOG is lit as the jog wheel is in jog mode, and this key is lit while
+# RECORD_FILE is being recorded. Set LEDS to False to leave them alone.
+LEDS = True
+RECORDING_LED = 'LIVE_OWR'
+
+# The jog wheel scrolls the mouse wheel. Set this to None to scroll at a
+# constant rate however fast the wheel is spun.
+JOG_ACCELERATION = DEFAULT_ACCELERATION
+
+# How key presses are sent: 'pynput' works everywhere; 'x11' (Linux, needs
+# python-xlib) sends everything one report produces in a single batch;
+# 'uinput' (Linux, needs write access to /dev/uinput) creates a virtual
+# keyboard, which also works under Wayland and on the console.
+OUTPUT = 'pynput'
+
+# On Linux the device is opened through /dev/hidraw, and the node found is
+# remembered in this file so that the next start doesn't have to look at
+# every HID device. Set it to None to always look.
+DEVICE_CACHE = f'{CACHE_DIR}/hidraw-{YOUR_PRODUCT_ID:04x}'
+
+# What each key does is printed, and can also be logged to a file, by a
+# background thread, so a slow terminal never holds up the keys. LOG_FILE is
+# a JSON lines file, or a compact binary one if it ends in .bmdlog (see
+# bmd_log.py); it's rotated once it reaches LOG_MAX_BYTES. LOG_LEVELS sets
+# the lowest level logged for key presses ('key', logged as 'info'), the jog
+# wheel ('jog', as 'debug') and unrecognised reports ('report', as 'debug').
+# Only one in JOG_LOG_SAMPLE jog reports is logged.
+LOG_FILE = None
+LOG_MAX_BYTES = 16 << 20
+LOG_LEVELS = {'key': 'info', 'jog': 'warning', 'report': 'warning'}
+JOG_LOG_SAMPLE = 16
+
+# Set this to the socket of a running bmd_daemon.py (e.g. bmd_client's
+# DEFAULT_SOCKET) to get key presses from it instead of opening the device,
+# so that other programs can use the panel at the same time. The daemon
+# looks after the device, putting the jog wheel in relative mode itself, so
+# LEDS and RECORD_FILE have no effect.
+DAEMON_SOCKET = None
+
 # ==================================================================================
 #
 #       (No need to modify anything below this line)
 #
 # ==================================================================================
 
-# --- Enums from provided code ---
-class SpeedEditorKey(enum.IntEnum):
-    NONE=0x00;SMART_INSRT=0x01;APPND=0x02;RIPL_OWR=0x03;CLOSE_UP=0x04;PLACE_ON_TOP=0x05;SRC_OWR=0x06;IN=0x07;OUT=0x08;TRIM_IN=0x09;TRIM_OUT=0x0a;ROLL=0x0b;SLIP_SRC=0x0c;SLIP_DEST=0x0d;TRANS_DUR=0x0e;CUT=0x0f;DIS=0x10;SMTH_CUT=0x11;SOURCE=0x1a;TIMELINE=0x1b;SHTL=0x1c;JOG=0x1d;SCRL=0x1e;ESC=0x31;SYNC_BIN=0x1f;AUDIO_LEVEL=0x2c;FULL_VIEW=0x2d;TRANS=0x22;SPLIT=0x2f;SNAP=0x2e;RIPL_DEL=0x2b;CAM1=0x33;CAM2=0x34;CAM3=0x35;CAM4=0x36;CAM5=0x37;CAM6=0x38;CAM7=0x39;CAM8=0x3a;CAM9=0x3b;LIVE_OWR=0x30;VIDEO_ONLY=0x25;AUDIO_ONLY=0x26;STOP_PLAY=0x3c
-
-# --- Authentication logic from provided code ---
-def bmd_kbd_auth(challenge):
-    AUTH_EVEN_TBL=[0x3ae1206f97c10bc8,0x2a9ab32bebf244c6,0x20a6f8b8df9adf0a,0xaf80ece52cfc1719,0xec2ee2f7414fd151,0xb055adfd73344a15,0xa63d2e3059001187,0x751bf623f42e0dde];AUTH_ODD_TBL=[0x3e22b34f502e7fde,0x24656b981875ab1c,0xa17f3456df7bf8c3,0x6df72e1941aef698,0x72226f011e66ab94,0x3831a3c606296b42,0xfd7ff81881332c89,0x61a3f6474ff236c6];MASK=0xa79a63f585d37bf0
-    def rol8(v): return ((v<<56)|(v>>8))&0xffffffffffffffff
-    def rol8n(v,n):
-        for _ in range(n): v=rol8(v)
-        return v
-    n=challenge&7;v=rol8n(challenge,n)
-    if(v&1)==((0x78>>n)&1):k=AUTH_EVEN_TBL[n]
-    else:v=v^rol8(v);k=AUTH_ODD_TBL[n]
-    return v^(rol8(v)&MASK)^k
-
 # --- Device communication class ---
 class SpeedEditor:
-    USB_VID=0x1edb
+    USB_VID=USB_VID
+
+    def __init__(self, pid, dev=None):
+        # `dev` replaces the USB device, e.g. with a bmd_emulator transport.
+        self.dev = dev if dev is not None else self.open(pid) # This will raise ConnectionError if it fails
 
-    def __init__(self, pid):
-        self.dev = hid.Device(self.USB_VID, pid) # This will raise HIDException if it fails
+    @classmethod
+    def open(cls, pid):
+        info = find_hidraw(cls.USB_VID, pid, USAGE_PAGE, cache=DEVICE_CACHE)
+        try:
+            if info: return HidrawDevice(info.path)
+            # Not Linux, or no hidraw: ask hidapi, which scans every device.
+            import hid
+            try: return hid.Device(cls.USB_VID, pid)
+            except hid.HIDException as e: raise ConnectionError(e) from e
+        except OSError as e:
+            # Not permitted, busy, or gone again (EACCES, EBUSY, ENODEV...).
+            raise ConnectionError(e) from e
 
     def authenticate(self):
-        self.dev.send_feature_report(b'\x06\x00\x00\x00\x00\x00\x00\x00\x00\x00')
-        data=self.dev.get_feature_report(6,10)
-        if data[0:2]!=b'\x06\x00':raise RuntimeError('Failed auth get_kbd_challenge')
-        challenge=int.from_bytes(data[2:],'little')
-        self.dev.send_feature_report(b'\x06\x01\x00\x00\x00\x00\x00\x00\x00\x00')
-        data=self.dev.get_feature_report(6,10)
-        if data[0:2]!=b'\x06\x02':raise RuntimeError('Failed auth get_kbd_response')
-        response=bmd_kbd_auth(challenge)
-        self.dev.send_feature_report(b'\x06\x03'+response.to_bytes(8,'little'))
-        data=self.dev.get_feature_report(6,10)
-        if data[0:2]!=b'\x06\x04':raise RuntimeError('Failed auth get_kbd_status')
-        return int.from_bytes(data[2:4],'little')
+        return authenticate(self.dev)
 
     def read_keys(self):
-        report = self.dev.read(64, timeout=50)
+        return self.parse_keys(self.dev.read(64, timeout=50))
+
+    @staticmethod
+    def parse_keys(report):
         if not report or report[0] != 4: return []
         keys = [SpeedEditorKey(k) for k in struct.unpack('<6H', report[1:13]) if k != 0]
         return keys
 
+class Background(threading.Thread):
+    """Calls fn(*args) on its own thread; result() waits for it."""
+    def __init__(self, fn, *args):
+        super().__init__(daemon=True)
+        self._call = (fn, args)
+        self._result = self._error = None
+        self.start()
+
+    def run(self):
+        fn, args = self._call
+        try: self._result = fn(*args)
+        except BaseException as e: self._error = e
+
+    def result(self):
+        self.join()
+        if self._error: raise self._error
+        return self._result
+
+    def discard(self):
+        """Waits for fn and closes what it returned, for when it won't be used."""
+        self.join()
+        if self._result is not None: self._result.close()
+
 # --- Main application logic ---
-def main():
-    keyboard = KeyboardController()
-    mouse = MouseController()
-    
+def device_reports(reader, decoder, metrics, handshake):
+    """Yields (time, events, held keys) for each report the reader reads."""
+    reader.start()
+    metrics.gauge('reader_queue_depth', 'Reports waiting to be decoded.', reader.qsize)
+    metrics.counter('reader_dropped_total', 'Reports discarded because decoding fell behind.', lambda: reader.dropped)
+    # Timed from the read, so the latency includes waiting in the reader's queue.
+    for now, report in reader.timed():
+        metrics.reports[report[0]] += 1
+        handshake.event()
+        events = decoder.decode(report)
+        yield now, events, decoder.held
+
+def daemon_reports(client):
+    """Yields (time, events, held keys) for each report the daemon sends.
+    The keys held on every panel it has count as held."""
+    for device, events in client.reports():
+        held = 0
+        for keys in client.held.values(): held |= keys
+        yield time.perf_counter_ns(), events, held
+
+def open_log():
+    sinks = [ConsoleSink()]
+    if LOG_FILE:
+        sink = BinarySink if LOG_FILE.endswith('.bmdlog') else JsonlSink
+        sinks.append(sink(LOG_FILE, LOG_MAX_BYTES))
+    return EventLog(sinks, levels=LOG_LEVELS, sample={'jog': JOG_LOG_SAMPLE})
+
+def report_macro_error(error):
+    print(f"Action failed: {error}")
+
+def report_reload(keymap, error):
+    if error: print(f"Keymap not reloaded: {error}")
+    else: print(f"Keymap reloaded from {KEYMAP_FILE}")
+
+def main(dev=None):
+    try: log = open_log()
+    except (OSError, ValueError) as e:
+        print(f"\nERROR: Could not open the log: {e}")
+        return
+    try:
+        key_map = load_keymap(KEYMAP_FILE) if KEYMAP_FILE else validate_keymap(KEY_MAP)
+        metrics = Metrics()
+        # Setting up the output (importing pynput, connecting to X...) is
+        # the slowest part of starting, so it happens while the device is
+        # found and authenticated; the runner gets it before it starts.
+        output = Background(make_injector, OUTPUT, key_map)
+        runner = MacroRunner(Injector(), MACRO_QUEUE_SIZE, metrics.read_to_inject, report_macro_error)
+        if KEYMAP_FILE:
+            watcher = KeymapWatcher(KEYMAP_FILE, runner, report_reload).start()
+            keymap = watcher.keymap
+        else:
+            watcher = None
+            keymap = compile_keymap(key_map, runner)
+    except (OSError, KeymapError) as e:
+        print(f"\nERROR: Invalid keymap: {e}")
+        log.stop()
+        return
+
+    metrics.gauge('macro_queue_depth', 'Actions waiting to be carried out.', runner.pending)
+    metrics.counter('macro_dropped_total', 'Actions ignored because the queue was full.', lambda: runner.dropped)
+    metrics.counter('macro_failed_total', 'Actions the output failed to carry out.', lambda: runner.failed)
+    server = MetricsServer(metrics, METRICS_ADDRESS).start() if METRICS_ADDRESS else None
+    metrics.counter('log_dropped_total', 'Log records discarded because the writer fell behind.', lambda: log.dropped)
+    metrics.counter('log_errors_total', 'Failed writes to the log sinks.', lambda: sum(log.errors))
+    recorder = None
+    leds = None
+    client = None
+    reader = None
+    reauth = None
+    connected = False
     try:
-        print(f"Attempting to connect to Speed Editor (PID: {hex(YOUR_PRODUCT_ID)})...")
-        se = SpeedEditor(pid=YOUR_PRODUCT_ID)
-        
-        print("Device found. Authenticating...")
-        se.authenticate()
-        
-        print("Authentication successful! Listening for key presses...")
+        if DAEMON_SOCKET:
+            print(f"Connecting to the daemon on {DAEMON_SOCKET}...")
+            from bmd_client import EventClient
+            try: client = EventClient(DAEMON_SOCKET)
+            except OSError as e: raise ConnectionError(e) from e
+            reports = daemon_reports(client)
+            connected = True
+            print("Connected! Listening for key presses...")
+        else:
+            print(f"Attempting to connect to Speed Editor (PID: {hex(YOUR_PRODUCT_ID)})...")
+            se = SpeedEditor(pid=YOUR_PRODUCT_ID, dev=dev)
+            if RECORD_FILE:
+                recorder = Recorder(RECORD_FILE)
+                se.dev = RecordingDevice(se.dev, recorder)
+
+            print("Device found. Authenticating...")
+            auth = AuthMetrics()
+            # Failed handshakes are retried, with a growing delay.
+            handshake = Handshake(se.authenticate, metrics=auth)
+            status = handshake.run()
+            metrics.add_auth(auth)
+            metrics.add_handshake(handshake)
+            # Renewals wait for the reader to be between reads.
+            reader = HidReader(se.dev)
+            reauth = ReauthScheduler(se.authenticate, lock=reader.paused, metrics=auth).start(status)
+
+            if LEDS:
+                leds = LedManager(se.dev).start()
+                metrics.counter('led_writes_total', 'LED and jog mode reports sent.', lambda: leds.writes)
+                leds.set_jog_mode(JogMode.RELATIVE) # Enable jog wheel
+                leds.set('jog', jog_leds=JogLed.JOG)
+                if recorder: leds.set('recording', Led[RECORDING_LED])
+            else:
+                se.dev.write(b'\x03\x00\x00\x00\x00\x00\x00') # Enable jog wheel
+            reports = device_reports(reader, ReportDecoder(), metrics, handshake)
+            connected = True
+            print("Authentication successful! Listening for key presses...")
+
         print("(Press Ctrl+C in this window to exit the script)")
+        log.start()
+        try: runner.output = output.result()
+        except Exception as e:
+            print(f"\nERROR: Could not start the '{OUTPUT}' output: {e}")
+            return
+        output = None # The runner closes it from now on.
+        runner.start()
+        resolver = KeyResolver()
+        jog = JogEngine(acceleration=JOG_ACCELERATION)
+        layer = 0
+        for now, events, held in reports:
+            if watcher: keymap = watcher.keymap
+            for event in events:
+                if isinstance(event, JogEvent):
+                    log.emit('jog', DEBUG, 'Jog:', event.mode, event.delta)
+                    steps = jog.feed(event.delta)
+                    if steps: runner.scroll(steps)
+                elif isinstance(event, UnknownReport):
+                    metrics.unhandled += 1
+                    log.emit('report', DEBUG, event.data)
+            if held == resolver.held: continue
+            # Layers and chords depend on every key held, so the keymap is
+            # applied to the whole report rather than to each event.
+            for action, label in resolver.update(keymap, held):
+                # Only queued here; printed by the log's thread.
+                log.emit('key', INFO, label)
+                action(now)
+            if leds:
+                leds.set('held', leds_for(held))
+                if resolver.layer != layer:
+                    # Light the keys the layer maps.
+                    layer = resolver.layer
+                    leds.set('layer', leds_for(keymap.layers[layer].keys) if layer else 0)
+        if client: print("\nThe daemon has stopped.")
 
-        last_keys = []
-        while True:
-            current_keys = se.read_keys()
-            pressed_keys = [k for k in current_keys if k not in last_keys]
-
-            for key in pressed_keys:
-                key_name = key.name
-                if key_name in KEY_MAP:
-                    mapping = KEY_MAP[key_name]
-                    action_type = mapping.get('type')
-                    action = mapping.get('action')
-                    print(f"Key: {key_name:<12} -> Action: {mapping}")
-                    if action_type == 'key': keyboard.press(action); keyboard.release(action)
-                    elif action_type == 'string': keyboard.type(action)
-                    elif action_type == 'mouse_click': mouse.click(action)
-                    elif action_type == 'combo':
-                        with keyboard.pressed(*action[:-1]):
-                            keyboard.press(action[-1]); keyboard.release(action[-1])
-            last_keys = current_keys
-            time.sleep(0.01)
-
-    except hid.HIDException:
-        print("\nERROR: FAILED TO CONNECT TO SPEED EDITOR.")
+    except OSError as e:
+        # Opening the device, the handshake and the reads all end up here;
+        # a read failing once connected is usually the panel being unplugged.
+        if DAEMON_SOCKET and connected:
+            print(f"\nERROR: LOST THE CONNECTION TO THE DAEMON: {e}")
+            return
+        if DAEMON_SOCKET:
+            print(f"\nERROR: FAILED TO CONNECT TO THE DAEMON: {e}")
+            print("Please check that bmd_daemon.py is running and using this socket.")
+            return
+        if connected:
+            print(f"\nERROR: LOST THE CONNECTION TO THE SPEED EDITOR: {e}")
+            print("Was it unplugged? Run the script again once it is back.")
+            return
+        print(f"\nERROR: FAILED TO CONNECT TO SPEED EDITOR: {e}")
         print("Please check the following:")
         print("  1. Is the Product ID in the script correct? Use the diagnostic script to check.")
         print("  2. Is DaVinci Resolve or other Blackmagic software completely closed?")
         print("  3. Is the device securely plugged in?")
         print("  4. Try running this script from a Command Prompt with 'Run as administrator'.")
+        print("     On Linux, you need read and write access to the /dev/hidraw node (a udev rule).")
     except RuntimeError as e:
         print(f"\nERROR: An error occurred during authentication: {e}")
     except KeyboardInterrupt:
         print("\nExiting script. Goodbye!")
+    finally:
+        if reauth: reauth.stop()
+        if reader: reader.stop()
+        if watcher: watcher.stop()
+        runner.close()
+        if output: output.discard()
+        log.stop()
+        if leds:
+            leds.clear()
+            leds.stop()
+        if recorder: recorder.close()
+        if client: client.close()
+        if server: server.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
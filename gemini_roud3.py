@@ -1,34 +1,30 @@
 import hid
-import time
 import sys
 import pprint # For pretty printing device info
+from bmd_handshake import Handshake
+from bmd_reader import HidReader
+from bmd_record import Recorder, RecordingDevice
 
 # Blackmagic Design Speed Editor Vendor and Product IDs
 VENDOR_ID = 0x1edb
 PRODUCT_ID = 0xda0e
 
-def authenticate_speed_editor(device):
+def authenticate_speed_editor(handshake):
     """
     Performs the authentication handshake with the Speed Editor.
     """
     print("\n[DEBUG] Starting authentication handshake...")
     try:
-        # The total buffer MUST be 21 bytes: 1 for the Report ID + 20 for the payload.
-        challenge = [0x06] + ([0x00] * 20)
-        print(f"[DEBUG] Sending {len(challenge)}-byte challenge to device (Report ID {challenge[0]})")
-        device.send_feature_report(bytes(challenge))
-        print("[DEBUG] Challenge sent successfully.")
-        
-        time.sleep(0.05) # Crucial delay
-
-        print("[DEBUG] Attempting to read response...")
-        response = device.get_feature_report(0x06, 20)
-        print(f"[DEBUG] Received response: {list(response)}")
-        print("[SUCCESS] Authentication handshake completed.")
+        # Every step is sent as soon as the last is answered; there's no
+        # delay to tune. Only a failed handshake is retried.
+        status = handshake.run()
+        print(f"[DEBUG] {handshake.summary()}")
+        print(f"[SUCCESS] Authentication handshake completed; unlocked for {status} s.")
         return True
 
-    except OSError as e:
-        print(f"[ERROR] An OS-level error occurred during authentication: {e}", file=sys.stderr)
+    except (OSError, RuntimeError) as e:
+        print(f"[DEBUG] {handshake.summary()}")
+        print(f"[ERROR] An error occurred during authentication: {e}", file=sys.stderr)
         print("[INFO] This is the final step. A failure here after a successful pre-auth check points to a firmware/timing issue.", file=sys.stderr)
         return False
 
@@ -58,23 +54,34 @@ def main():
         print(f"  - Manufacturer: {device.get_manufacturer_string()}")
         print(f"  - Product: {device.get_product_string()}")
 
+        # Optionally record the session, for `bmd_record.py replay`.
+        if len(sys.argv) > 1:
+            recorder = Recorder(sys.argv[1])
+            device = RecordingDevice(device, recorder)
+            print(f"[INFO] Recording to {sys.argv[1]}")
+
         # The authentication is the real test now
-        if not authenticate_speed_editor(device):
+        handshake = Handshake.for_device(device)
+        if not authenticate_speed_editor(handshake):
             print("\n[FAILURE] Authentication failed. The device did not respond as expected.", file=sys.stderr)
             print("[ACTION] This still strongly suggests a software conflict. See instructions below.", file=sys.stderr)
             device.close()
             return
 
         print("\n[SUCCESS] Device is authenticated. Listening for input (Ctrl+C to exit)...")
-        device.set_nonblocking(1)
-        while True:
-            try:
-                report = device.read(64)
-                if report:
-                    print(f"[DATA] {list(report)}")
-                time.sleep(0.01)
-            except KeyboardInterrupt:
-                break
+        reader = HidReader(device).start()
+        try:
+            for report in reader:
+                if handshake.first_event is None:
+                    handshake.event()
+                    print(f"[DEBUG] {handshake.summary()}")
+                print(f"[DATA] {list(report)}")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            reader.stop()
+            if reader.dropped:
+                print(f"[INFO] {reader.dropped} reports dropped.")
 
     except OSError as ex:
         print(f"\n[FATAL] An OS-level error occurred: {ex}", file=sys.stderr)
@@ -85,6 +92,8 @@ def main():
         if 'device' in locals() and 'device' in dir() and device.is_open():
             device.close()
             print("\n[INFO] Device connection closed.")
+        if 'recorder' in locals():
+            recorder.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,59 @@
+#ifndef AUTH_H
+#define AUTH_H
+
+#include <stdint.h>
+
+static uint64_t rol8(uint64_t v)
+{
+    return ((v << 56) | (v >> 8)) & 0xffffffffffffffff;
+}
+
+static uint64_t rol8n(uint64_t v, int n)
+{
+    while (n--)
+        v = rol8(v);
+    return v;
+}
+
+/* Authentication code borrowed from https://github.com/smunaut/blackmagic-misc.
+ */
+static uint64_t calculateKeyboardResponse(uint64_t challenge)
+{
+    static const uint64_t auth_even_tbl[] = {
+        0x3ae1206f97c10bc8,
+        0x2a9ab32bebf244c6,
+        0x20a6f8b8df9adf0a,
+        0xaf80ece52cfc1719,
+        0xec2ee2f7414fd151,
+        0xb055adfd73344a15,
+        0xa63d2e3059001187,
+        0x751bf623f42e0dde,
+    };
+    static const uint64_t auth_odd_tbl[] = {
+        0x3e22b34f502e7fde,
+        0x24656b981875ab1c,
+        0xa17f3456df7bf8c3,
+        0x6df72e1941aef698,
+        0x72226f011e66ab94,
+        0x3831a3c606296b42,
+        0xfd7ff81881332c89,
+        0x61a3f6474ff236c6,
+    };
+    static const uint64_t mask = 0xa79a63f585d37bf0;
+
+    uint64_t n = challenge & 7;
+    uint64_t v = rol8n(challenge, n);
+
+    uint64_t k;
+    if ((v & 1) == ((0x78 >> n) & 1))
+        k = auth_even_tbl[n];
+    else
+    {
+        v = v ^ rol8(v);
+        k = auth_odd_tbl[n];
+    }
+
+    return v ^ (rol8(v) & mask) ^ k;
+}
+
+#endif
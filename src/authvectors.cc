@@ -0,0 +1,40 @@
+#include <stdio.h>
+#include <stdint.h>
+#include "auth.h"
+
+/* Reads little-endian 64-bit challenges from stdin and writes the
+ * corresponding little-endian 64-bit responses to stdout. Used by
+ * bench_auth.py to check the Python implementations against this one.
+ */
+
+static uint64_t getInt64(const uint8_t* p)
+{
+    uint64_t v = 0;
+    for (int i = 7; i >= 0; i--)
+        v = (v << 8) | p[i];
+    return v;
+}
+
+static void putInt64(uint8_t* p, uint64_t value)
+{
+    for (int i = 0; i < 8; i++)
+        p[i] = value >> (i * 8);
+}
+
+int main()
+{
+    static uint8_t buffer[8 * 4096];
+    for (;;)
+    {
+        size_t count = fread(buffer, 8, sizeof(buffer) / 8, stdin);
+        if (!count)
+            break;
+
+        for (size_t i = 0; i < count; i++)
+            putInt64(&buffer[i * 8],
+                calculateKeyboardResponse(getInt64(&buffer[i * 8])));
+
+        fwrite(buffer, 8, count, stdout);
+    }
+    return 0;
+}
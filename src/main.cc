@@ -7,12 +7,14 @@
 #include <algorithm>
 #include <ranges>
 #include <map>
+#include <string>
 #include <chrono>
 #include <hidapi.h>
 #include <fmt/format.h>
 #include <fakekey/fakekey.h>
 #include <X11/Xlib.h>
 #include <X11/Xatom.h>
+#include "auth.h"
 
 #define MAX_STR 255
 #define WHEEL_STEP 30000
@@ -87,59 +89,6 @@ static void checkerror(int res)
     }
 }
 
-static uint64_t rol8(uint64_t v)
-{
-    return ((v << 56) | (v >> 8)) & 0xffffffffffffffff;
-}
-
-static uint64_t rol8n(uint64_t v, int n)
-{
-    while (n--)
-        v = rol8(v);
-    return v;
-}
-
-/* Authentication code borrowed from https://github.com/smunaut/blackmagic-misc.
- */
-static uint64_t calculateKeyboardResponse(uint64_t challenge)
-{
-    static const uint64_t auth_even_tbl[] = {
-        0x3ae1206f97c10bc8,
-        0x2a9ab32bebf244c6,
-        0x20a6f8b8df9adf0a,
-        0xaf80ece52cfc1719,
-        0xec2ee2f7414fd151,
-        0xb055adfd73344a15,
-        0xa63d2e3059001187,
-        0x751bf623f42e0dde,
-    };
-    static const uint64_t auth_odd_tbl[] = {
-        0x3e22b34f502e7fde,
-        0x24656b981875ab1c,
-        0xa17f3456df7bf8c3,
-        0x6df72e1941aef698,
-        0x72226f011e66ab94,
-        0x3831a3c606296b42,
-        0xfd7ff81881332c89,
-        0x61a3f6474ff236c6,
-    };
-    static const uint64_t mask = 0xa79a63f585d37bf0;
-
-    uint64_t n = challenge & 7;
-    uint64_t v = rol8n(challenge, n);
-
-    uint64_t k;
-    if ((v & 1) == ((0x78 >> n) & 1))
-        k = auth_even_tbl[n];
-    else
-    {
-        v = v ^ rol8(v);
-        k = auth_odd_tbl[n];
-    }
-
-    return v ^ (rol8(v) & mask) ^ k;
-}
-
 static uint64_t getInt16(const uint8_t* p)
 {
     return ((uint64_t)p[0] << 0) | ((uint64_t)p[1] << 8);
@@ -415,10 +364,14 @@ int main()
                     }
 
                     default:
-                        fmt::print("Unhandled packet: ");
+                    {
+                        /* Format the line first and write it once, rather
+                         * than a write per byte. */
+                        std::string line = "Unhandled packet: ";
                         for (uint8_t c : data)
-                            fmt::print("{:02x} ", c);
-                        fmt::print("\n");
+                            line += fmt::format("{:02x} ", c);
+                        fmt::print("{}\n", line);
+                    }
                 }
             }
             catch (const TimeoutException& e)